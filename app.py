@@ -1,15 +1,17 @@
 from flask import Flask, render_template, Response, request, jsonify
 from functools import wraps
+import json
 import logging
+import os
 from datetime import datetime
-from src import db, rag
+from src import answer_cache, db, rag, telemetry
 
 app = Flask(__name__)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize OpenAI client
-llm_client = rag.ThrottledOpenAI()
+# Maximum number of post ids per /api/find_ids request
+FIND_IDS_MAX_BATCH = int(os.getenv("FIND_IDS_MAX_BATCH", "100"))
 
 def error_handler(f):
     @wraps(f)
@@ -23,6 +25,11 @@ def error_handler(f):
     return decorated_function
 
 
+def sse_event(event: str, data: dict) -> str:
+    """Formats a server-sent event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
 @app.route("/")
 def home():
     return render_template("chat.html")
@@ -37,7 +44,89 @@ def chat():
     if not message:
         return jsonify({"error": "Message cannot be empty"}), 400
 
-    return Response(llm_client.rag_query(message), mimetype="text/event-stream")
+    try:
+        filters = db.parse_filters(data.get("filters"))
+        db.check_archived_filters(filters)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid filters: {str(e)}"}), 400
+
+    try:
+        fusion = db.parse_fusion(data.get("fusion"))
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid fusion parameters: {str(e)}"}), 400
+    # Answers retrieved with other fusion parameters are cached separately
+    cache_filters = {**filters, "fusion": fusion} if fusion else filters
+
+    # Retrieval runs before the response starts so that its timings can be
+    # sent in the Server-Timing header. The LLM stream timings (time to first
+    # token, total stream time) are only known afterwards: they are sent in
+    # the `done` event, exported with the trace and exposed on /metrics.
+    #
+    # The response is a stream of server-sent events:
+    #   - `sources`: the posts in the context, sent before the first token
+    #   - `token`: a piece of the answer
+    #   - `done`: token usage and stage timings
+    #   - `error`: the answer failed after the stream started
+    trace = telemetry.Trace("chat")
+    cache = answer_cache.get_answer_cache()
+    cached = None
+    sources = []
+    with telemetry.activate(trace):
+        if cache is not None:
+            with telemetry.span("answer_cache_lookup"):
+                cached = cache.lookup(message, cache_filters)
+        if cached is None:
+            messages = rag.get_llm_client().build_messages(
+                message, filters=filters, sources=sources, fusion=fusion
+            )
+
+    def generate():
+        usage = {}
+        try:
+            # Cached answers (their sources and token events) are replayed
+            # event by event, like a live stream
+            if cached is not None:
+                yield from cached
+            else:
+                events = [sse_event("sources", {"sources": sources})]
+                yield events[0]
+                with telemetry.activate(trace):
+                    for chunk in rag.get_llm_client().stream_answer(messages, usage):
+                        events.append(sse_event("token", {"text": chunk}))
+                        yield events[-1]
+                # Only complete answers are cached
+                if cache is not None:
+                    cache.store(message, cache_filters, events)
+            yield sse_event(
+                "done",
+                {
+                    "cached": cached is not None,
+                    "usage": usage,
+                    "timings_ms": trace.durations(),
+                },
+            )
+        except Exception as e:
+            logger.error(f"Error in chat stream: {str(e)}")
+            yield sse_event("error", {"error": str(e)})
+        finally:
+            telemetry.export(trace)
+
+    return Response(
+        generate(),
+        mimetype="text/event-stream",
+        headers={
+            "Server-Timing": trace.server_timing(),
+            "Cache-Control": "no-cache",
+            # Keeps reverse proxies such as nginx from buffering the stream
+            "X-Accel-Buffering": "no",
+        },
+    )
+
+
+@app.route("/metrics")
+def metrics():
+    """Stage latency histograms in the Prometheus text format."""
+    return Response(telemetry.metrics.render(), mimetype="text/plain; version=0.0.4")
 
 
 @app.route("/api/find_ids", methods=["POST"])
@@ -67,8 +156,16 @@ def find_post_urls() -> dict:
 
         post_ids: list[str] = data["post_ids"]
 
-        if not isinstance(post_ids, list):
-            return jsonify({"error": "post_ids must be a list"}), 400
+        if not isinstance(post_ids, list) or not all(
+            isinstance(post_id, str) for post_id in post_ids
+        ):
+            return jsonify({"error": "post_ids must be a list of strings"}), 400
+
+        if len(post_ids) > FIND_IDS_MAX_BATCH:
+            return (
+                jsonify({"error": f"At most {FIND_IDS_MAX_BATCH} post_ids per request"}),
+                400,
+            )
 
         urls = db.get_posts_url(post_ids)
 
@@ -0,0 +1,102 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src import db
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+OUTPUT_DIR = os.path.join(os.path.dirname(__file__), "output")
+
+
+def read_questions(path: str) -> list[str]:
+    """
+    Reads questions from a JSON file in the format of `data/questions.json`
+    or from a text file with one question per line.
+    """
+    with open(path) as f:
+        if path.endswith(".json"):
+            return [q["question"] for q in json.load(f)]
+        return [line.strip() for line in f if line.strip()]
+
+
+def to_records(questions: list[str], results: list[list[tuple]]) -> list[dict]:
+    """One record per (question, document), with the rank of the document."""
+    records = []
+    for question, rows in zip(questions, results):
+        for rank, (id, post_id, title, score, content, permalink) in enumerate(
+            rows, start=1
+        ):
+            records.append(
+                {
+                    "question": question,
+                    "rank": rank,
+                    "id": id,
+                    "post_id": post_id,
+                    "title": title,
+                    "score": float(score),
+                    "content": content,
+                    "permalink": permalink,
+                }
+            )
+    return records
+
+
+def write_records(records: list[dict], path: str) -> None:
+    """Writes JSONL, or Parquet when the path ends with .parquet."""
+    if path.endswith(".parquet"):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("Parquet output requires pyarrow: pip install pyarrow")
+        pq.write_table(pa.Table.from_pylist(records), path)
+        return
+
+    with open(path, "w") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Runs the hybrid search for many questions at once."
+    )
+    parser.add_argument(
+        "--questions", default=os.path.join(DATA_DIR, "questions.json")
+    )
+    parser.add_argument(
+        "--output", default=os.path.join(OUTPUT_DIR, "batch_search.jsonl")
+    )
+    parser.add_argument("--limit", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=db.BATCH_SEARCH_WORKERS)
+    args = parser.parse_args()
+
+    questions = read_questions(args.questions)
+
+    timings = {}
+    start = time.perf_counter()
+    results = db.batch_hybrid_search(
+        questions, args.limit, max_workers=args.workers, timings=timings
+    )
+    total_seconds = time.perf_counter() - start
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    write_records(to_records(questions, results), args.output)
+
+    stats = {
+        "num_questions": len(questions),
+        "limit": args.limit,
+        "vector_backend": db.VECTOR_SEARCH_BACKEND,
+        "keyword_backend": db.KEYWORD_SEARCH_BACKEND,
+        "workers": args.workers,
+        "total_seconds": total_seconds,
+        "questions_per_second": len(questions) / total_seconds,
+        **timings,
+        "output": args.output,
+    }
+    print(json.dumps(stats, indent=4))
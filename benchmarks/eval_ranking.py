@@ -0,0 +1,74 @@
+import json
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src import db, evaluation
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+OUTPUT_DIR = os.path.join(os.path.dirname(__file__), "output")
+
+
+def load_questions(path: str) -> list[dict]:
+    """
+    Loads a labeled question set. Each entry must have a `question` and the
+    list of `relevant_post_ids` that answer it.
+    """
+    with open(path) as f:
+        questions = json.load(f)
+
+    for q in questions:
+        assert "question" in q
+        assert "relevant_post_ids" in q
+    return questions
+
+
+def rank_posts(question: str, k: int, feature_weights: dict[str, float]) -> list[str]:
+    """Returns the post ids retrieved by `db.hybrid_search`, best first."""
+    rows = db.hybrid_search(question, limit=k, feature_weights=feature_weights)
+    return evaluation.unique_in_order([row[1] for row in rows])
+
+
+def evaluate(questions: list[dict], k: int, feature_weights: dict[str, float]) -> dict:
+    """Computes precision@k, recall@k and MRR of a ranking configuration."""
+    rankings = [rank_posts(q["question"], k, feature_weights) for q in questions]
+    labels = [set(q["relevant_post_ids"]) for q in questions]
+    return evaluation.summarize(rankings, labels, k)
+
+
+if __name__ == "__main__":
+
+    # Default values
+    questions_path = os.path.join(DATA_DIR, "questions.json")
+    k = 5
+
+    # Override with command line arguments if provided
+    if len(sys.argv) > 1:
+        questions_path = sys.argv[1]
+    if len(sys.argv) > 2:
+        k = int(sys.argv[2])
+
+    questions = load_questions(questions_path)
+
+    # Baseline is plain reciprocal rank fusion. The candidate uses the weights
+    # configured through the RANK_WEIGHT_* environment variables.
+    baseline_weights = {"score": 0.0, "comments": 0.0, "recency": 0.0}
+    report = {
+        "k": k,
+        "questions": questions_path,
+        "baseline": {
+            "weights": baseline_weights,
+            "metrics": evaluate(questions, k, baseline_weights),
+        },
+        "reranked": {
+            "weights": db.FEATURE_WEIGHTS,
+            "metrics": evaluate(questions, k, db.FEATURE_WEIGHTS),
+        },
+    }
+
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    with open(os.path.join(OUTPUT_DIR, "eval_ranking.json"), "w") as f:
+        json.dump(report, f, indent=4)
+
+    print(json.dumps(report, indent=4))
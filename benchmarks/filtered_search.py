@@ -0,0 +1,118 @@
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src import db, evaluation
+
+OUTPUT_DIR = os.path.join(os.path.dirname(__file__), "output")
+
+
+def sample_query_vectors(n: int) -> list[list[float]]:
+    """
+    Samples stored document embeddings to use as query vectors, so the
+    benchmark does not need to call the embedding API.
+    """
+    cursor = db.get_cursor()
+    cursor.execute(
+        "SELECT embedding::text FROM documents WHERE embedding IS NOT NULL "
+        "ORDER BY random() LIMIT %(n)s;",
+        {"n": n},
+    )
+    vectors = [json.loads(row[0]) for row in cursor.fetchall()]
+    cursor.close()
+    return vectors
+
+
+def get_filter_cases() -> list[dict]:
+    """
+    Returns filters covering a range of selectivities: one per tag and
+    minimum scores at several quantiles of the post score.
+    """
+    cursor = db.get_cursor()
+    cursor.execute("SELECT DISTINCT post_tag FROM documents WHERE post_tag IS NOT NULL;")
+    cases = [{"tag": row[0]} for row in cursor.fetchall()]
+
+    cursor.execute(
+        """
+        SELECT percentile_disc(ARRAY[0.5, 0.9, 0.99])
+        WITHIN GROUP (ORDER BY post_score)
+        FROM documents;
+        """
+    )
+    cases += [{"min_score": score} for score in cursor.fetchone()[0] or []]
+    cursor.close()
+    return cases
+
+
+def count_matching(filters: dict) -> tuple[int, int]:
+    """Returns the number of documents matching the filters and the total."""
+    conditions, params = db._filter_conditions(filters)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    cursor = db.get_cursor()
+    cursor.execute(f"SELECT count(*) FROM documents {where};", params)
+    matching = cursor.fetchone()[0]
+    cursor.execute("SELECT count(*) FROM documents;")
+    total = cursor.fetchone()[0]
+    cursor.close()
+    return matching, total
+
+
+def run_case(vectors: list[list[float]], filters: dict, limit: int) -> dict:
+    """Runs the filtered vector search for each query vector."""
+    matching, total = count_matching(filters)
+    expected = min(limit, matching)
+
+    latencies, completeness = [], []
+    for vector in vectors:
+        start = time.perf_counter()
+        rows = db.vector_search_by_embedding(vector, limit, filters)
+        latencies.append((time.perf_counter() - start) * 1000)
+        completeness.append(len(rows) / expected if expected > 0 else 1.0)
+
+    return {
+        "filters": filters,
+        "selectivity": matching / total if total > 0 else 0.0,
+        "latency": evaluation.latency_summary(latencies),
+        "completeness": sum(completeness) / len(completeness),
+    }
+
+
+if __name__ == "__main__":
+
+    # Default values
+    num_queries = 50
+    limit = 20
+
+    # Override with command line arguments if provided
+    if len(sys.argv) > 1:
+        num_queries = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        limit = int(sys.argv[2])
+
+    vectors = sample_query_vectors(num_queries)
+    cases = get_filter_cases()
+    configured_scan = db.HNSW_ITERATIVE_SCAN
+
+    # Compare post-filtering (iterative scans off) with the configured mode
+    report = {"num_queries": len(vectors), "limit": limit, "results": []}
+    for iterative_scan in ["off", configured_scan]:
+        db.HNSW_ITERATIVE_SCAN = iterative_scan
+        for filters in cases:
+            result = run_case(vectors, filters, limit)
+            result["iterative_scan"] = iterative_scan
+            report["results"].append(result)
+            print(
+                f"{iterative_scan:>13} {json.dumps(filters, default=str):<40} "
+                f"selectivity={result['selectivity']:.3f} "
+                f"p50={result['latency']['p50_ms']:.1f}ms "
+                f"p95={result['latency']['p95_ms']:.1f}ms "
+                f"completeness={result['completeness']:.2f}"
+            )
+    db.HNSW_ITERATIVE_SCAN = configured_scan
+
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    with open(os.path.join(OUTPUT_DIR, "filtered_search.json"), "w") as f:
+        json.dump(report, f, indent=4, default=str)
@@ -0,0 +1,156 @@
+import argparse
+from datetime import datetime
+import itertools
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src import db, evaluation
+from benchmarks.regression import DATA_DIR, LocalHybridSearch, load_corpus
+
+OUTPUT_DIR = os.path.join(os.path.dirname(__file__), "output")
+
+
+def parse_weights(value: str) -> tuple[float, float, float]:
+    """Parses "vector,keyword,exact" leg weights, e.g. "2,1,1"."""
+    weights = tuple(float(w) for w in value.split(","))
+    if len(weights) != 3:
+        raise argparse.ArgumentTypeError("weights must be vector,keyword,exact")
+    return weights
+
+
+def grid(
+    depths: list[int], methods: list[str], weights: list[tuple]
+) -> list[dict]:
+    """
+    The fusion parameters to evaluate: every vector depth, keyword depth
+    (also used for the exact-match leg), method and leg weights.
+    """
+    return [
+        {
+            "method": method,
+            "vector_depth": vector_depth,
+            "keyword_depth": keyword_depth,
+            "exact_depth": keyword_depth,
+            "vector_weight": vector_weight,
+            "keyword_weight": keyword_weight,
+            "exact_weight": exact_weight,
+        }
+        for method, vector_depth, keyword_depth, (
+            vector_weight,
+            keyword_weight,
+            exact_weight,
+        ) in itertools.product(methods, depths, depths, weights)
+    ]
+
+
+def evaluate(search, questions: list[dict], k: int, fusion: dict, repeat: int) -> dict:
+    """Retrieval quality and latency of one set of fusion parameters."""
+    latencies = []
+    rankings = []
+    for _ in range(repeat):
+        rankings = []
+        for q in questions:
+            start = time.perf_counter()
+            rows = search(q["question"], limit=k, fusion=fusion)
+            latencies.append((time.perf_counter() - start) * 1000)
+            rankings.append(evaluation.unique_in_order([row[1] for row in rows]))
+    labels = [set(q["relevant_post_ids"]) for q in questions]
+
+    quality = evaluation.summarize(rankings, labels, k)
+    del quality["queries"]
+    return {"quality": quality, "latency": evaluation.latency_summary(latencies)}
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description=(
+            "Sweeps the hybrid search leg depths, weights and fusion method, "
+            "and reports recall and latency of each combination."
+        )
+    )
+    parser.add_argument(
+        "--live",
+        action="store_true",
+        help=(
+            "Search the database with `db.hybrid_search` and the labeled questions "
+            "instead of the fixture corpus (needs Postgres and OpenAI)."
+        ),
+    )
+    parser.add_argument("--questions")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--depths", type=int, nargs="+", default=[5, 10, 20, 50, 100])
+    parser.add_argument(
+        "--methods",
+        nargs="+",
+        choices=db.FUSION_METHODS,
+        default=list(db.FUSION_METHODS),
+    )
+    parser.add_argument(
+        "--weights",
+        type=parse_weights,
+        nargs="+",
+        default=[(1.0, 1.0, 1.0)],
+        help="Leg weights as vector,keyword,exact, e.g. 1,1,1 2,1,1",
+    )
+    args = parser.parse_args()
+
+    if args.live:
+        questions_path = args.questions or os.path.join(DATA_DIR, "questions.json")
+        search = db.hybrid_search
+    else:
+        questions_path = args.questions or os.path.join(
+            DATA_DIR, "fixture_questions.json"
+        )
+        local = LocalHybridSearch(
+            load_corpus(os.path.join(DATA_DIR, "fixture_corpus.json"))
+        )
+        search = local.hybrid_search
+    with open(questions_path) as f:
+        questions = json.load(f)
+
+    results = []
+    for fusion in grid(args.depths, args.methods, args.weights):
+        if not args.live:
+            for values in local.latencies.values():
+                values.clear()
+        result = {
+            "fusion": fusion,
+            **evaluate(search, questions, args.k, fusion, args.repeat),
+        }
+        if not args.live:
+            result["stage_latency"] = {
+                stage: evaluation.latency_summary(values)
+                for stage, values in local.latencies.items()
+            }
+        results.append(result)
+        print(
+            f"{fusion['method']:>6} depths={fusion['vector_depth']:>4},"
+            f"{fusion['keyword_depth']:>4} weights={fusion['vector_weight']:g},"
+            f"{fusion['keyword_weight']:g},{fusion['exact_weight']:g}  "
+            f"recall@{args.k}={result['quality'][f'recall@{args.k}']:.3f}  "
+            f"mrr={result['quality']['mrr']:.3f}  "
+            f"p50={result['latency']['p50_ms']:.2f}ms  "
+            f"p95={result['latency']['p95_ms']:.2f}ms"
+        )
+
+    report = {
+        "live": args.live,
+        "questions": questions_path,
+        "k": args.k,
+        "repeat": args.repeat,
+        "feature_weights": db.FEATURE_WEIGHTS,
+        "results": results,
+    }
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    path = os.path.join(
+        OUTPUT_DIR, f"fusion_sweep_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    )
+    with open(path, "w") as f:
+        json.dump(report, f, indent=4)
+    print(f"Report written to {path}")
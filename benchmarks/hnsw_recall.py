@@ -0,0 +1,193 @@
+import argparse
+from datetime import datetime, timezone
+import json
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src import db, evaluation
+
+OUTPUT_DIR = os.path.join(os.path.dirname(__file__), "output")
+
+# The benchmark uses its own table so it never touches `documents`
+TABLE = "bench_vectors"
+
+
+def cluster_centers(num_clusters: int, dim: int, rng: random.Random) -> list[list[float]]:
+    return [[rng.gauss(0, 1) for _ in range(dim)] for _ in range(num_clusters)]
+
+
+def synthetic_vectors(
+    n: int, centers: list[list[float]], rng: random.Random
+) -> list[list[float]]:
+    """
+    Generates unit vectors grouped around the cluster centers. Real embeddings
+    are clustered by topic, which uniform random vectors are not, and HNSW
+    recall depends heavily on that structure.
+    """
+    out = []
+    for _ in range(n):
+        center = centers[rng.randrange(len(centers))]
+        v = [c + rng.gauss(0, 0.6) for c in center]
+        norm = math.sqrt(sum(x * x for x in v))
+        out.append([x / norm for x in v])
+    return out
+
+
+def to_pgvector(v: list[float]) -> str:
+    return "[" + ",".join(f"{x:.6f}" for x in v) + "]"
+
+
+def seed_table(vectors: list[list[float]], dim: int, m: int, ef_construction: int) -> dict:
+    """
+    Recreates the benchmark table with the given vectors and builds the HNSW
+    index. Returns the build time and the table and index sizes.
+    """
+    cursor = db.get_cursor()
+    cursor.execute(f"DROP TABLE IF EXISTS {TABLE};")
+    cursor.execute(
+        f"CREATE TABLE {TABLE} (id INTEGER PRIMARY KEY, embedding VECTOR({dim}));"
+    )
+    with cursor.copy(f"COPY {TABLE} (id, embedding) FROM STDIN") as copy:
+        for i, v in enumerate(vectors):
+            copy.write_row((i, to_pgvector(v)))
+
+    start = time.perf_counter()
+    cursor.execute(
+        f"""
+        CREATE INDEX {TABLE}_embedding_idx ON {TABLE}
+        USING hnsw (embedding vector_cosine_ops)
+        WITH (m = {int(m)}, ef_construction = {int(ef_construction)});
+        """
+    )
+    build_seconds = time.perf_counter() - start
+    cursor.execute(f"ANALYZE {TABLE};")
+
+    cursor.execute(
+        f"SELECT pg_relation_size('{TABLE}'), pg_relation_size('{TABLE}_embedding_idx');"
+    )
+    table_bytes, index_bytes = cursor.fetchone()
+    cursor.connection.commit()
+    cursor.close()
+    return {
+        "build_seconds": build_seconds,
+        "table_bytes": table_bytes,
+        "index_bytes": index_bytes,
+    }
+
+
+def search(cursor, query: list[float], k: int, ef_search: int | None, exact: bool) -> list[int]:
+    """Runs one k-NN query. `exact` disables the index to get the ground truth."""
+    if exact:
+        cursor.execute("SET LOCAL enable_indexscan = off;")
+    db.set_hnsw_options(cursor, ef_search=ef_search)
+    cursor.execute(
+        f"SELECT id FROM {TABLE} ORDER BY embedding <=> %(vector)s::vector LIMIT %(k)s;",
+        {"vector": to_pgvector(query), "k": k},
+    )
+    ids = [row[0] for row in cursor.fetchall()]
+    cursor.connection.rollback()  # ends the transaction and resets SET LOCAL
+    return ids
+
+
+def run_size(
+    n: int,
+    centers: list[list[float]],
+    queries: list[list[float]],
+    rng: random.Random,
+    args: argparse.Namespace,
+) -> dict:
+    """Seeds a corpus of size `n` and sweeps `ef_search`."""
+    vectors = synthetic_vectors(n, centers, rng)
+    build = seed_table(vectors, args.dim, args.m, args.ef_construction)
+
+    cursor = db.get_cursor()
+    exact = [search(cursor, q, args.k, None, exact=True) for q in queries]
+
+    sweeps = []
+    for ef_search in args.ef_search:
+        latencies, recalls = [], []
+        for q, truth in zip(queries, exact):
+            start = time.perf_counter()
+            ids = search(cursor, q, args.k, ef_search, exact=False)
+            latencies.append((time.perf_counter() - start) * 1000)
+            recalls.append(evaluation.recall_at_k(ids, set(truth), args.k))
+
+        sweep = {
+            "ef_search": ef_search,
+            f"recall@{args.k}": sum(recalls) / len(recalls),
+            "latency": evaluation.latency_summary(latencies),
+        }
+        sweeps.append(sweep)
+        print(
+            f"n={n:>7} ef_search={ef_search:>4} "
+            f"recall@{args.k}={sweep[f'recall@{args.k}']:.3f} "
+            f"p50={sweep['latency']['p50_ms']:.2f}ms "
+            f"p95={sweep['latency']['p95_ms']:.2f}ms "
+            f"p99={sweep['latency']['p99_ms']:.2f}ms"
+        )
+    cursor.close()
+    return {"corpus_size": n, **build, "sweeps": sweeps}
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="HNSW recall/latency benchmark on synthetic embeddings."
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 50_000])
+    parser.add_argument("--dim", type=int, default=db.EMBEDDING_DIMENSIONS)
+    parser.add_argument("--clusters", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--m", type=int, default=db.HNSW_M)
+    parser.add_argument("--ef-construction", type=int, default=db.HNSW_EF_CONSTRUCTION)
+    parser.add_argument(
+        "--ef-search", type=int, nargs="+", default=[10, 20, 40, 80, 160, 320]
+    )
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    centers = cluster_centers(args.clusters, args.dim, rng)
+    queries = synthetic_vectors(args.queries, centers, rng)
+
+    cursor = db.get_cursor()
+    cursor.execute("SELECT extversion FROM pg_extension WHERE extname = 'vector';")
+    pgvector_version = cursor.fetchone()[0]
+    cursor.close()
+
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "pgvector_version": pgvector_version,
+        "params": {
+            "dim": args.dim,
+            "clusters": args.clusters,
+            "queries": args.queries,
+            "k": args.k,
+            "m": args.m,
+            "ef_construction": args.ef_construction,
+            "seed": args.seed,
+        },
+        "results": [],
+    }
+    for n in args.sizes:
+        # Same seed per size so that runs are comparable over time
+        report["results"].append(
+            run_size(n, centers, queries, random.Random(args.seed + n), args)
+        )
+
+    cursor = db.get_cursor()
+    cursor.execute(f"DROP TABLE IF EXISTS {TABLE};")
+    cursor.connection.commit()
+    cursor.close()
+
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    filename = f"hnsw_recall_{datetime.now(timezone.utc):%Y%m%dT%H%M%S}.json"
+    with open(os.path.join(OUTPUT_DIR, filename), "w") as f:
+        json.dump(report, f, indent=4)
+    print(f"Results written to {os.path.join(OUTPUT_DIR, filename)}")
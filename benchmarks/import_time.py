@@ -0,0 +1,132 @@
+import argparse
+from datetime import datetime
+import json
+import os
+import subprocess
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src import evaluation
+
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+OUTPUT_DIR = os.path.join(os.path.dirname(__file__), "output")
+
+# Entry points of a gunicorn worker, of the ingest Lambda function, and the
+# modules they are built on
+DEFAULT_MODULES = ["app", "lambda_functions.get_posts", "src.db", "src.rag"]
+
+# Creates the shared clients, as the first request of a worker does. None of
+# them connects before it is used.
+FIRST_USE = """
+from src import db, rag, reddit
+db.get_engine()
+rag.get_llm_client()
+reddit.get_reddit()
+"""
+
+SCRIPT = """
+import time
+start = time.perf_counter()
+import {module}
+imported = time.perf_counter()
+{first_use}
+print(imported - start, time.perf_counter() - imported)
+"""
+
+
+def parse_importtime(stderr: str) -> list[dict]:
+    """
+    Parses the output of `python -X importtime` into one record per module,
+    with its own and cumulative import time in milliseconds.
+    """
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        modules.append(
+            {
+                "module": name.strip(),
+                "self_ms": int(self_us) / 1000,
+                "cumulative_ms": int(cumulative_us) / 1000,
+            }
+        )
+    return modules
+
+
+def measure(module: str, repo_dir: str, first_use: bool) -> tuple[float, float, str]:
+    """
+    Imports a module in a fresh interpreter. Returns the import time and the
+    time to create the shared clients in seconds, and the importtime output.
+    """
+    script = SCRIPT.format(module=module, first_use=FIRST_USE if first_use else "")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", script],
+        cwd=repo_dir,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+    import_seconds, first_use_seconds = map(float, result.stdout.split()[-2:])
+    return import_seconds, first_use_seconds, result.stderr
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description=(
+            "Import time of the app and Lambda entry points in fresh interpreters, "
+            "i.e. the cold start of a gunicorn worker or of a Lambda function."
+        )
+    )
+    parser.add_argument("--modules", nargs="+", default=DEFAULT_MODULES)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument(
+        "--repo",
+        default=REPO_DIR,
+        help="Checkout to measure, e.g. a `git worktree` of an older commit to compare with.",
+    )
+    parser.add_argument(
+        "--first-use",
+        action="store_true",
+        help="Also time the creation of the shared database, OpenAI and Reddit clients.",
+    )
+    args = parser.parse_args()
+
+    report = {
+        "repo": os.path.abspath(args.repo),
+        "python": sys.version.split()[0],
+        "repeat": args.repeat,
+        "modules": {},
+    }
+    for module in args.modules:
+        import_ms, first_use_ms = [], []
+        for _ in range(args.repeat):
+            import_seconds, first_use_seconds, stderr = measure(
+                module, args.repo, args.first_use
+            )
+            import_ms.append(import_seconds * 1000)
+            first_use_ms.append(first_use_seconds * 1000)
+
+        # Breakdown of the last run: the slowest modules by their own time
+        slowest = sorted(parse_importtime(stderr), key=lambda m: -m["self_ms"])
+        report["modules"][module] = {
+            "import_ms": evaluation.latency_summary(import_ms),
+            **(
+                {"first_use_ms": evaluation.latency_summary(first_use_ms)}
+                if args.first_use
+                else {}
+            ),
+            "slowest_imports": slowest[: args.top],
+        }
+
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    path = os.path.join(
+        OUTPUT_DIR, f"import_time_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    )
+    with open(path, "w") as f:
+        json.dump(report, f, indent=4)
+    print(json.dumps(report, indent=4))
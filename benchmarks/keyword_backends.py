@@ -0,0 +1,80 @@
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src import db, evaluation
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+OUTPUT_DIR = os.path.join(os.path.dirname(__file__), "output")
+
+
+def sample_queries(n: int) -> list[str]:
+    """Uses the labeled questions plus random post titles as keyword queries."""
+    with open(os.path.join(DATA_DIR, "questions.json")) as f:
+        queries = [q["question"] for q in json.load(f)]
+
+    cursor = db.get_cursor()
+    cursor.execute("SELECT title FROM posts ORDER BY random() LIMIT %(n)s;", {"n": n})
+    queries += [row[0] for row in cursor.fetchall()]
+    cursor.close()
+    return queries
+
+
+def overlap(a: list[tuple], b: list[tuple]) -> float:
+    """Fraction of shared ids between two result lists."""
+    if len(a) == 0 and len(b) == 0:
+        return 1.0
+    ids_a, ids_b = {r[0] for r in a}, {r[0] for r in b}
+    return len(ids_a & ids_b) / max(len(ids_a), len(ids_b))
+
+
+if __name__ == "__main__":
+
+    # Default values
+    num_queries = 100
+    limit = 20
+
+    # Override with command line arguments if provided
+    if len(sys.argv) > 1:
+        num_queries = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        limit = int(sys.argv[2])
+
+    queries = sample_queries(num_queries)
+
+    start = time.perf_counter()
+    index = db.build_keyword_index()
+    build_seconds = time.perf_counter() - start
+
+    postgres_latencies, bm25_latencies = [], []
+    any_overlap, all_overlap = [], []
+    for query in queries:
+        start = time.perf_counter()
+        pg_any, pg_all = db._postgres_keyword_searches(query, limit)
+        postgres_latencies.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        bm25_any, bm25_all = index.search(query, limit)
+        bm25_latencies.append((time.perf_counter() - start) * 1000)
+
+        any_overlap.append(overlap(pg_any, bm25_any))
+        all_overlap.append(overlap(pg_all, bm25_all))
+
+    report = {
+        "num_documents": len(index),
+        "num_queries": len(queries),
+        "limit": limit,
+        "bm25_build_seconds": build_seconds,
+        "postgres": evaluation.latency_summary(postgres_latencies),
+        "bm25": evaluation.latency_summary(bm25_latencies),
+        "overlap_any_terms": sum(any_overlap) / len(any_overlap),
+        "overlap_all_terms": sum(all_overlap) / len(all_overlap),
+    }
+    print(json.dumps(report, indent=4))
+
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    with open(os.path.join(OUTPUT_DIR, "keyword_backends.json"), "w") as f:
+        json.dump(report, f, indent=4)
@@ -0,0 +1,156 @@
+import json
+from datetime import datetime, timezone
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src import db, evaluation
+
+OUTPUT_DIR = os.path.join(os.path.dirname(__file__), "output")
+
+# The benchmark copies the document embeddings to its own table so that
+# indexes can be built and dropped without touching `documents`
+TABLE = "bench_documents"
+MODES = ["vector", "halfvec", "binary", "shortlist"]
+
+
+def seed_table(num_queries: int) -> list[str]:
+    """
+    Copies the document embeddings to the benchmark table, holding out
+    `num_queries` random documents whose embeddings are used as queries.
+    """
+    cursor = db.get_cursor()
+    cursor.execute(f"DROP TABLE IF EXISTS {TABLE};")
+    cursor.execute(
+        f"""
+        CREATE TABLE {TABLE} AS
+        SELECT id, embedding FROM documents WHERE embedding IS NOT NULL;
+        """
+    )
+    cursor.execute(
+        f"SELECT id, embedding::text FROM {TABLE} ORDER BY random() LIMIT %(n)s;",
+        {"n": num_queries},
+    )
+    rows = cursor.fetchall()
+    cursor.execute(f"DELETE FROM {TABLE} WHERE id = ANY(%(ids)s);", {"ids": [r[0] for r in rows]})
+    cursor.execute(f"ALTER TABLE {TABLE} ADD PRIMARY KEY (id);")
+    cursor.connection.commit()
+    cursor.close()
+    return [r[1] for r in rows]
+
+
+def build_index(mode: str) -> dict:
+    """Builds the HNSW index of a mode on the benchmark table."""
+    expression, opclass, _ = db._embedding_index_expression(mode)
+    cursor = db.get_cursor()
+    start = time.perf_counter()
+    cursor.execute(
+        f"""
+        CREATE INDEX {TABLE}_{mode}_idx ON {TABLE}
+        USING hnsw ({expression} {opclass})
+        WITH (m = {db.HNSW_M}, ef_construction = {db.HNSW_EF_CONSTRUCTION});
+        """
+    )
+    build_seconds = time.perf_counter() - start
+    cursor.execute(f"SELECT pg_relation_size('{TABLE}_{mode}_idx');")
+    index_bytes = cursor.fetchone()[0]
+    cursor.connection.commit()
+    cursor.close()
+    return {"build_seconds": build_seconds, "index_bytes": index_bytes}
+
+
+def search(cursor, mode: str, vector: str, k: int, rerank_factor: int) -> list[str]:
+    """Same query shape as `db.vector_search_by_embedding` on the benchmark table."""
+    if mode == "exact":
+        cursor.execute("SET LOCAL enable_indexscan = off;")
+        index_distance = "embedding <=> %(vector)s::vector"
+    else:
+        _, _, index_distance = db._embedding_index_expression(mode)
+    num_candidates = k if mode in ("vector", "exact") else k * rerank_factor
+    db.set_hnsw_options(cursor, ef_search=db.default_ef_search(num_candidates))
+    cursor.execute(
+        f"""
+        WITH candidates AS MATERIALIZED (
+            SELECT id, embedding FROM {TABLE}
+            ORDER BY {index_distance}
+            LIMIT %(num_candidates)s
+        )
+        SELECT id FROM candidates
+        ORDER BY embedding <=> %(vector)s::vector
+        LIMIT %(k)s;
+        """,
+        {"vector": vector, "k": k, "num_candidates": num_candidates},
+    )
+    ids = [row[0] for row in cursor.fetchall()]
+    cursor.connection.rollback()  # ends the transaction and resets SET LOCAL
+    return ids
+
+
+if __name__ == "__main__":
+
+    # Default values
+    num_queries = 100
+    k = 10
+    rerank_factors = [1, 2, 4, 8]
+
+    # Override with command line arguments if provided
+    if len(sys.argv) > 1:
+        num_queries = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        k = int(sys.argv[2])
+
+    queries = seed_table(num_queries)
+    cursor = db.get_cursor()
+    exact = [search(cursor, "exact", q, k, 1) for q in queries]
+
+    cursor.execute(f"SELECT pg_relation_size('{TABLE}'), count(*) FROM {TABLE};")
+    table_bytes, corpus_size = cursor.fetchone()
+    cursor.connection.commit()
+
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "corpus_size": corpus_size,
+        "table_bytes": table_bytes,
+        "num_queries": len(queries),
+        "k": k,
+        "results": [],
+    }
+    for mode in MODES:
+        build = build_index(mode)
+        for factor in rerank_factors if mode != "vector" else [1]:
+            latencies, recalls = [], []
+            for q, truth in zip(queries, exact):
+                start = time.perf_counter()
+                ids = search(cursor, mode, q, k, factor)
+                latencies.append((time.perf_counter() - start) * 1000)
+                recalls.append(evaluation.recall_at_k(ids, set(truth), k))
+
+            result = {
+                "mode": mode,
+                "rerank_factor": factor,
+                **build,
+                f"recall@{k}": sum(recalls) / len(recalls),
+                "latency": evaluation.latency_summary(latencies),
+            }
+            report["results"].append(result)
+            print(
+                f"{mode:>8} rerank_factor={factor} "
+                f"index={build['index_bytes'] / 2**20:.1f}MB "
+                f"recall@{k}={result[f'recall@{k}']:.3f} "
+                f"p50={result['latency']['p50_ms']:.2f}ms "
+                f"p95={result['latency']['p95_ms']:.2f}ms"
+            )
+
+        # Only one index at a time so the planner cannot pick another mode's
+        cursor.execute(f"DROP INDEX {TABLE}_{mode}_idx;")
+        cursor.connection.commit()
+
+    cursor.execute(f"DROP TABLE IF EXISTS {TABLE};")
+    cursor.connection.commit()
+    cursor.close()
+
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    with open(os.path.join(OUTPUT_DIR, "quantization.json"), "w") as f:
+        json.dump(report, f, indent=4)
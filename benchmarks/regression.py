@@ -0,0 +1,322 @@
+import argparse
+import contextlib
+from datetime import datetime
+import json
+import math
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src import db, evaluation, rag, rerank
+from src.keyword_index import BM25Index
+from src.vector_index import NumpyVectorIndex
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+OUTPUT_DIR = os.path.join(os.path.dirname(__file__), "output")
+
+
+def load_corpus(path: str) -> list[dict]:
+    """
+    Loads a fixture corpus. Each post has an `id`, `title`, `tag`, `score`,
+    `num_comments`, `created_utc` (ISO date) and a list of `chunks`.
+    """
+    with open(path) as f:
+        corpus = json.load(f)
+
+    for post in corpus:
+        for key in ("id", "title", "score", "num_comments", "created_utc", "chunks"):
+            assert key in post, f"Post {post.get('id')} has no {key}"
+    return corpus
+
+
+def post_features(corpus: list[dict], half_life_days: float) -> dict[str, tuple]:
+    """
+    Same features as `db.refresh_post_features`, with the newest post of the
+    corpus as the current time so that results are reproducible.
+    """
+    created = {p["id"]: datetime.fromisoformat(p["created_utc"]) for p in corpus}
+    now = max(created.values())
+    max_score = max(math.log1p(max(p["score"], 0)) for p in corpus) or 1.0
+    max_comments = max(math.log1p(max(p["num_comments"], 0)) for p in corpus) or 1.0
+
+    features = {}
+    for p in corpus:
+        age_days = (now - created[p["id"]]).total_seconds() / 86400
+        features[p["id"]] = (
+            math.log1p(max(p["score"], 0)) / max_score,
+            math.log1p(max(p["num_comments"], 0)) / max_comments,
+            math.exp(-math.log(2) * age_days / half_life_days),
+        )
+    return features
+
+
+class LocalHybridSearch:
+    """
+    The hybrid search pipeline of `db.hybrid_search` over a fixture corpus,
+    with the in-process vector and BM25 indexes and deterministic fake
+    embeddings (`evaluation.hashed_embedding`) instead of Postgres and the
+    embeddings API. Fusion and re-ranking use the same functions as
+    `db.hybrid_search`. The time spent in each stage is recorded.
+    """
+
+    def __init__(self, corpus: list[dict], dimensions: int = 256):
+        self.dimensions = dimensions
+        self.vector_index = NumpyVectorIndex()
+        self.keyword_index = BM25Index()
+        self.documents: dict[str, tuple] = {}
+        # Counted on first use, as `documents.num_tokens` is counted at ingest
+        self._token_counts: dict[str, int] = {}
+        self.latencies: dict[str, list[float]] = {
+            "embed": [],
+            "vector": [],
+            "keyword": [],
+            "fusion": [],
+        }
+
+        features = post_features(corpus, db.RECENCY_HALF_LIFE_DAYS)
+        ids, contents = [], []
+        for post in corpus:
+            for chunk_id, chunk in enumerate(post["chunks"], start=1):
+                id = f"{post['id']}_{chunk_id}"
+                content = f"{post['title']}\n{chunk}"
+                ids.append(id)
+                contents.append(content)
+                self.documents[id] = (
+                    id,
+                    post["id"],
+                    post["title"],
+                    content,
+                    *features[post["id"]],
+                    f"/r/dataengineering/comments/{post['id']}/",
+                )
+
+        self.vector_index.add(
+            ids, [evaluation.hashed_embedding(c, dimensions) for c in contents]
+        )
+        self.keyword_index.add(ids, contents)
+
+    def _timed(self, stage: str, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        self.latencies[stage].append((time.perf_counter() - start) * 1000)
+        return result
+
+    def token_counts(self, ids: list[str]) -> dict[str, int]:
+        """Same as `db.get_document_token_counts`."""
+        for id in ids:
+            if id not in self._token_counts:
+                self._token_counts[id] = rag.get_num_tokens_from_string(
+                    self.documents[id][3]
+                )
+        return {id: self._token_counts[id] for id in ids}
+
+    def hybrid_search(
+        self,
+        text_query: str,
+        limit: int,
+        feature_weights: dict[str, float] | None = None,
+        filters: dict | None = None,
+        fusion: dict | None = None,
+    ) -> list[tuple]:
+        """Same signature and rows as `db.hybrid_search`."""
+        if filters:
+            raise ValueError("The fixture corpus does not support filters.")
+        vector_depth, keyword_depth, exact_depth = db.leg_depths(
+            limit, feature_weights, fusion
+        )
+
+        vector = self._timed(
+            "embed", evaluation.hashed_embedding, text_query, self.dimensions
+        )
+        vector_results = self._timed(
+            "vector", self.vector_index.search, vector, vector_depth
+        )
+        keyword_results, exact_keyword_results = self._timed(
+            "keyword",
+            self.keyword_index.search,
+            text_query,
+            max(keyword_depth, exact_depth),
+        )
+        keyword_results = keyword_results[:keyword_depth]
+        exact_keyword_results = exact_keyword_results[:exact_depth]
+
+        def fuse() -> list[tuple]:
+            fused = db.fuse_legs(
+                vector_results, keyword_results, exact_keyword_results, fusion
+            )
+            return db.rank_fused(fused, self.documents, limit, feature_weights)
+
+        return self._timed("fusion", fuse)
+
+
+class StubChatClient:
+    """
+    Stands in for the OpenAI client in `rag.ThrottledOpenAI.rag_query`:
+    streams a fixed answer citing the retrieved posts, so that the end-to-end
+    latency excludes the LLM.
+    """
+
+    def __init__(self, chunk_size: int = 4):
+        self.chunk_size = chunk_size
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, messages: list[dict], **kwargs):
+        answer = f"Stub answer based on {len(messages[-1]['content'])} characters of context."
+        words = answer.split(" ")
+        for start in range(0, len(words), self.chunk_size):
+            content = " ".join(words[start : start + self.chunk_size]) + " "
+            yield SimpleNamespace(
+                choices=[SimpleNamespace(delta=SimpleNamespace(content=content))],
+                usage=None,
+            )
+        yield SimpleNamespace(
+            choices=[SimpleNamespace(delta=SimpleNamespace(content=None))], usage=None
+        )
+        # Usage chunk sent with stream_options={"include_usage": True}
+        yield SimpleNamespace(
+            choices=[],
+            usage=SimpleNamespace(
+                prompt_tokens=sum(len(m["content"]) // 4 for m in messages),
+                completion_tokens=len(words),
+                prompt_tokens_details=SimpleNamespace(cached_tokens=0),
+            ),
+        )
+
+
+def run(
+    corpus: list[dict],
+    questions: list[dict],
+    k: int,
+    repeat: int,
+    include_rag: bool = True,
+    rerank_backend: str | None = None,
+) -> dict:
+    """
+    Runs the fixture benchmark: retrieval quality of the hybrid search over
+    the labeled questions, and latency of each stage over `repeat` passes.
+    With `rerank_backend`, `rag_query` re-ranks the retrieved chunks (see
+    `rerank.Reranker`) before packing the context.
+    """
+    search = LocalHybridSearch(corpus)
+
+    rankings = []
+    hybrid_latencies = []
+    for _ in range(repeat):
+        rankings = []
+        for q in questions:
+            start = time.perf_counter()
+            rows = search.hybrid_search(q["question"], limit=k)
+            hybrid_latencies.append((time.perf_counter() - start) * 1000)
+            rankings.append(evaluation.unique_in_order([row[1] for row in rows]))
+    labels = [set(q["relevant_post_ids"]) for q in questions]
+
+    latency = {
+        stage: evaluation.latency_summary(values)
+        for stage, values in search.latencies.items()
+    }
+    latency["hybrid"] = evaluation.latency_summary(hybrid_latencies)
+
+    if include_rag:
+        client = rag.ThrottledOpenAI(
+            client=StubChatClient(),
+            retriever=search.hybrid_search,
+            token_counts=search.token_counts,
+            reranker=(
+                rerank.Reranker(rerank.build_scorer(rerank_backend))
+                if rerank_backend
+                else None
+            ),
+        )
+        rag_latencies = []
+        # rag_query prints token counts: keep them out of the report
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            for _ in range(repeat):
+                for q in questions:
+                    start = time.perf_counter()
+                    "".join(client.rag_query(q["question"]))
+                    rag_latencies.append((time.perf_counter() - start) * 1000)
+        latency["rag_query"] = evaluation.latency_summary(rag_latencies)
+
+    return {
+        "config": {
+            "k": k,
+            "repeat": repeat,
+            "num_posts": len(corpus),
+            "num_documents": len(search.documents),
+            "feature_weights": db.FEATURE_WEIGHTS,
+            "rerank": rerank_backend,
+        },
+        "quality": {
+            key: value
+            for key, value in evaluation.summarize(rankings, labels, k).items()
+            if key != "queries"
+        },
+        "latency": latency,
+    }
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Retrieval quality and latency regression benchmark on a fixture corpus."
+    )
+    parser.add_argument(
+        "--corpus", default=os.path.join(DATA_DIR, "fixture_corpus.json")
+    )
+    parser.add_argument(
+        "--questions", default=os.path.join(DATA_DIR, "fixture_questions.json")
+    )
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument(
+        "--skip-rag",
+        action="store_true",
+        help="Skip the end-to-end rag_query stage (it needs the tiktoken encoding).",
+    )
+    parser.add_argument(
+        "--rerank",
+        choices=["lexical", "onnx"],
+        help="Re-rank the chunks retrieved by rag_query (onnx needs RERANK_MODEL_DIR).",
+    )
+    parser.add_argument(
+        "--baseline",
+        help="Report to compare with. Exits with status 1 on regressions.",
+    )
+    parser.add_argument("--quality-tolerance", type=float, default=0.0)
+    parser.add_argument("--latency-tolerance", type=float, default=0.2)
+    parser.add_argument(
+        "--output", default=os.path.join(OUTPUT_DIR, "regression.json")
+    )
+    args = parser.parse_args()
+
+    with open(args.questions) as f:
+        questions = json.load(f)
+    report = run(
+        load_corpus(args.corpus),
+        questions,
+        args.k,
+        args.repeat,
+        include_rag=not args.skip_rag,
+        rerank_backend=args.rerank,
+    )
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = evaluation.find_regressions(
+            report, baseline, args.quality_tolerance, args.latency_tolerance
+        )
+        report["baseline"] = args.baseline
+        report["regressions"] = regressions
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=4)
+    print(json.dumps(report, indent=4))
+
+    if regressions:
+        sys.exit(1)
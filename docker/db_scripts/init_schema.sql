@@ -23,22 +23,47 @@ BEGIN
             PRIMARY KEY (id)
         );
 
-        -- Create the comments table
+        -- Create the comments table. The embedding size must match
+        -- OPENAI_EMBEDDING_DIMENSIONS.
         CREATE TABLE documents (
             id VARCHAR(32) NOT NULL, 
             post_id VARCHAR(32) NOT NULL, 
             chunk_id INTEGER NOT NULL, 
             content VARCHAR NOT NULL, 
             embedding VECTOR(1536), 
+            post_tag VARCHAR(30), 
+            post_created_at TIMESTAMP WITHOUT TIME ZONE, 
+            post_score INTEGER, 
+            num_tokens INTEGER, 
             PRIMARY KEY (id), 
             FOREIGN KEY(post_id) REFERENCES posts (id) ON DELETE CASCADE
         );
 
+        -- Create the precomputed ranking features table
+        CREATE TABLE post_features (
+            post_id VARCHAR(32) NOT NULL, 
+            score_norm FLOAT NOT NULL, 
+            comments_norm FLOAT NOT NULL, 
+            recency FLOAT NOT NULL, 
+            computed_at TIMESTAMP WITHOUT TIME ZONE NOT NULL, 
+            PRIMARY KEY (post_id), 
+            FOREIGN KEY(post_id) REFERENCES posts (id) ON DELETE CASCADE
+        );
+
+        -- 'english' is the default TEXT_SEARCH_CONFIG, see
+        -- `db.migrate_text_search_config`
         ALTER TABLE documents
         ADD COLUMN content_ts_vector tsvector
         GENERATED ALWAYS AS (to_tsvector('english', content)) STORED;
 
         CREATE INDEX content_ts_vector_idx ON documents USING GIN (content_ts_vector);
-        CREATE INDEX embedding_idx ON documents USING hnsw (embedding vector_cosine_ops);
+        -- Full-precision index (EMBEDDING_INDEX_MODE=vector). For the quantized
+        -- modes see `db.create_embedding_index`.
+        CREATE INDEX embedding_idx ON documents USING hnsw (embedding vector_cosine_ops)
+        WITH (m = 16, ef_construction = 64);
+
+        CREATE INDEX documents_post_tag_idx ON documents (post_tag);
+        CREATE INDEX documents_post_created_at_idx ON documents (post_created_at);
+        CREATE INDEX documents_post_score_idx ON documents (post_score);
     END IF;
 END $$;
\ No newline at end of file
@@ -0,0 +1,65 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src import db, rag
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description=(
+            "Migrates the document embeddings to another model while the app "
+            "keeps serving the current ones: start, backfill, cutover, retire."
+        )
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("status", help="List the embedding versions.")
+
+    start_parser = subparsers.add_parser(
+        "start", help="Add the column of a new version, written by the ingest."
+    )
+    start_parser.add_argument("model", help="e.g. text-embedding-3-large")
+    start_parser.add_argument("dimensions", type=int)
+
+    backfill_parser = subparsers.add_parser(
+        "backfill", help="Embed the existing documents with the new version."
+    )
+    backfill_parser.add_argument(
+        "--batch-size", type=int, default=rag.EMBEDDING_BATCH_SIZE
+    )
+
+    cutover_parser = subparsers.add_parser(
+        "cutover", help="Switch the searches to the backfilled version."
+    )
+    cutover_parser.add_argument(
+        "--lock-timeout-ms",
+        type=int,
+        default=5_000,
+        help="Maximum wait for the running searches before giving up.",
+    )
+
+    subparsers.add_parser("retire", help="Drop the previous version.")
+    subparsers.add_parser("abort", help="Drop the backfilling version.")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.command == "start":
+        db.start_embedding_migration(args.model, args.dimensions)
+    elif args.command == "backfill":
+        print(f"Embedded {db.backfill_embeddings(args.batch_size)} documents.")
+    elif args.command == "cutover":
+        db.cutover_embedding_version(args.lock_timeout_ms)
+    elif args.command == "retire":
+        db.retire_previous_embedding()
+    elif args.command == "abort":
+        db.abort_embedding_migration()
+    result = {
+        "versions": db.list_embedding_versions(),
+        "seconds": time.perf_counter() - start,
+    }
+    print(json.dumps(result, indent=4))
@@ -1,12 +1,12 @@
+import argparse
 from datetime import datetime
 import json
 import os
-from sqlalchemy.orm import Session
 import sys
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
-from src import reddit, db, rag
+from src import reddit, db, rag, snapshot
 
 def get_posts(n: int):
     posts = reddit.get_top_posts("dataengineering", limit=n, t="all")
@@ -54,65 +54,86 @@ def get_chunks_with_embeddings(post: dict) -> dict:
         post_id=post['id'],
         chunk_id=chunk_id,
         content=chunk_content,
-        embedding=rag.ThrottledOpenAI().get_embedding(chunk_content),
+        embedding=rag.get_llm_client().get_embedding(chunk_content),
     )
 
 
+def to_snapshot(posts: list[dict], chunks: list[dict], directory: str) -> None:
+    """
+    Writes posts in the format of `get_posts` (or `posts_dev.json`) and their
+    chunks with embeddings (or `chunks_dev.json`) as a snapshot, see
+    `src/snapshot.py`. The snapshot has the embedding size of the chunks,
+    e.g. 1536 for `chunks_dev.json`.
+    """
+    dimensions = len(chunks[0]["embedding"]) if chunks else db.EMBEDDING_DIMENSIONS
+    if any(len(chunk["embedding"]) != dimensions for chunk in chunks):
+        raise ValueError("The chunks have embeddings of different sizes")
+    with snapshot.SnapshotWriter(directory, len(chunks), dimensions) as writer:
+        # Chunks are embedded with the OPENAI_EMBEDDING_MODEL (see above)
+        writer.metadata["embedding_model"] = rag.EMBEDDING_MODEL_NAME
+        for post in posts:
+            writer.add_post(
+                dict(
+                    post,
+                    created_at=datetime.fromtimestamp(post["created"]),
+                    last_updated_at=datetime(2025, 1, 1),
+                )
+            )
+        for chunk in chunks:
+            writer.add_document(chunk, chunk["embedding"])
+
+
+def is_database_loaded() -> bool:
+    """Returns whether `posts` or `documents` exists and has rows."""
+    cursor = db.get_cursor()
+    for table in ("posts", "documents"):
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL;", (table,))
+        if cursor.fetchone()[0]:
+            cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {table});")
+            if cursor.fetchone()[0]:
+                cursor.close()
+                return True
+    cursor.close()
+    return False
+
+
 if __name__ == '__main__':
 
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    data_dir = os.path.join(current_dir, "data")
+    parser = argparse.ArgumentParser(
+        description="Bootstraps a dev database from etl/data/snapshot_dev."
+    )
+    parser.add_argument(
+        "--reset",
+        action="store_true",
+        help="Drop the schema, and every post and document in it, even if "
+        "the database is already loaded.",
+    )
+    args = parser.parse_args()
 
-    if 'posts_dev.json' in os.listdir(data_dir) and 'chunks_dev.json' in os.listdir(data_dir):
+    if not args.reset and is_database_loaded():
         print("Data already loaded.")
         sys.exit(0)
 
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    data_dir = os.path.join(current_dir, "data")
+    snapshot_dir = os.path.join(data_dir, "snapshot_dev")
+    posts_path = os.path.join(data_dir, "posts_dev.json")
+    chunks_path = os.path.join(data_dir, "chunks_dev.json")
+
+    if not os.path.exists(os.path.join(snapshot_dir, "manifest.json")):
+        if os.path.exists(posts_path) and os.path.exists(chunks_path):
+            # Convert the JSON dumps of earlier runs
+            with open(posts_path) as f:
+                posts = json.load(f)
+            with open(chunks_path) as f:
+                chunks = json.load(f)
+        else:
+            # Get posts and chunks with embeddings ##############################
+            posts = get_posts(200)
+            chunks = [get_chunks_with_embeddings(post) for post in posts]
+        to_snapshot(posts, chunks, snapshot_dir)
+
+    # Load the snapshot to DB, without calling Reddit or OpenAI. Search
+    # filters, token counts and ranking features are filled in by the import.
     db.init_schema()
-
-    # Get posts ###############################################################
-    posts = get_posts(200)
-    with open("posts_dev.json", "w") as f:
-        json.dump(posts, f, indent=4)
-
-    # Load posts to DB
-    for i, post in enumerate(posts):
-        print(f'Loading Post {i+1} of {len(posts)}')
-        with Session(db.engine) as session:
-            post = db.RedditPosts(
-                id=post["id"],
-                title=post["title"],
-                description=post["description"],
-                score=post["score"],
-                upvotes=post["upvotes"],
-                downvotes=post["downvotes"],
-                tag=post["tag"],
-                num_comments=post["num_comments"],
-                permalink=post["permalink"],
-                content_hash=post["content_hash"],
-                created_at=datetime.fromtimestamp(post["created"]),
-                last_updated_at=datetime(2025, 1, 1)
-            )
-            session.add(post)
-            session.commit()
-
-    # Get chunks with embeddings ##############################################
-    chunks = []
-    for post in posts:
-        chunks.append(get_chunks_with_embeddings(post))
-
-    with open("chunks_dev.json", "w") as f:
-        json.dump(chunks, f, indent=4)
-
-    # Load chunks to DB
-    for i, chunk in enumerate(chunks):
-        print(f'Loading Chunk {i+1} of {len(chunks)}')
-        with Session(db.engine) as session:
-            chunk = db.Documents(
-                id=chunk["id"],
-                post_id=chunk["post_id"],
-                chunk_id=chunk["chunk_id"],
-                content=chunk["content"],
-                embedding=chunk["embedding"],
-            )
-            session.add(chunk)
-            session.commit()
+    print(db.import_snapshot(snapshot_dir))
@@ -0,0 +1,78 @@
+import argparse
+from datetime import datetime
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src import db
+
+if __name__ == "__main__":
+
+    default_period = (
+        db.DOCUMENTS_PARTITIONING
+        if db.DOCUMENTS_PARTITIONING in db.DOCUMENTS_PARTITION_PERIODS
+        else "year"
+    )
+    parser = argparse.ArgumentParser(
+        description=(
+            "Partitions the documents table by post creation date, and moves "
+            "cold partitions out of the searches (see DOCUMENTS_PARTITIONING)."
+        )
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    migrate_parser = subparsers.add_parser(
+        "migrate", help="Partition an existing documents table."
+    )
+    migrate_parser.add_argument(
+        "--period",
+        choices=db.DOCUMENTS_PARTITION_PERIODS,
+        default=default_period,
+    )
+
+    create_parser = subparsers.add_parser(
+        "create", help="Create the partition of the period containing a date."
+    )
+    create_parser.add_argument("date", type=datetime.fromisoformat)
+    create_parser.add_argument(
+        "--period",
+        choices=db.DOCUMENTS_PARTITION_PERIODS,
+        default=default_period,
+    )
+
+    subparsers.add_parser("list", help="List the partitions and their size.")
+
+    archive_parser = subparsers.add_parser(
+        "archive",
+        help="Detach a cold partition and drop its HNSW index: its posts are "
+        "no longer searched.",
+    )
+    archive_parser.add_argument("name", help="e.g. documents_p2019")
+    archive_parser.add_argument(
+        "--tablespace", help="Cheaper tablespace the partition is moved to."
+    )
+
+    restore_parser = subparsers.add_parser(
+        "restore", help="Attach an archived partition again."
+    )
+    restore_parser.add_argument("name")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.command == "migrate":
+        result = {"partitions": db.migrate_documents_partitioning(args.period)}
+    elif args.command == "create":
+        result = {"partition": db.create_documents_partition(args.date, args.period)}
+    elif args.command == "list":
+        result = {"partitions": db.list_documents_partitions()}
+    elif args.command == "archive":
+        db.archive_documents_partition(args.name, args.tablespace)
+        result = {"archived": args.name}
+    else:
+        db.restore_documents_partition(args.name)
+        result = {"restored": args.name}
+    result["seconds"] = time.perf_counter() - start
+    print(json.dumps(result, indent=4))
@@ -0,0 +1,55 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src import db, snapshot
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description=(
+            "Exports the indexed corpus to a snapshot directory, or bulk-loads a "
+            "snapshot into Postgres or into the in-process vector index, without "
+            "calling the embeddings API."
+        )
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Database to snapshot.")
+    export_parser.add_argument("directory")
+    export_parser.add_argument(
+        "--dtype", choices=["float32", "float16"], default="float32"
+    )
+
+    import_parser = subparsers.add_parser("import", help="Snapshot to database.")
+    import_parser.add_argument("directory")
+    import_parser.add_argument(
+        "--keep-index",
+        action="store_true",
+        help="Update the HNSW index row by row instead of rebuilding it, e.g. "
+        "when loading a small snapshot into a large database.",
+    )
+
+    index_parser = subparsers.add_parser(
+        "vector-index",
+        help="Snapshot to a saved in-process vector index (see VECTOR_INDEX_DIR).",
+    )
+    index_parser.add_argument("directory")
+    index_parser.add_argument("output")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.command == "export":
+        result = db.export_snapshot(args.directory, args.dtype)
+    elif args.command == "import":
+        result = db.import_snapshot(args.directory, rebuild_index=not args.keep_index)
+    else:
+        index = snapshot.load_vector_index(args.directory)
+        index.save(args.output)
+        result = {"documents": len(index), "output": args.output}
+    result["seconds"] = time.perf_counter() - start
+    print(json.dumps(result, indent=4))
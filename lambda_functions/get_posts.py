@@ -1,23 +1,37 @@
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+import json
 import os
-from sqlalchemy.orm import Session
+import resource
 import sys
 import time
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
-from src import reddit, db
-from src.db import RedditPosts
+# Only the standard library and telemetry are imported at init. `src.db` and
+# `src.reddit` (SQLAlchemy, psycopg, pgvector, PRAW) are imported by the first
+# invocation, and the openai package only when a post has to be embedded.
+from src import telemetry
 
+# tiktoken encodings bundled with the function (see README), so that cold
+# starts do not download them
+TIKTOKEN_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tiktoken_cache")
+if os.path.isdir(TIKTOKEN_CACHE_DIR):
+    os.environ.setdefault("TIKTOKEN_CACHE_DIR", TIKTOKEN_CACHE_DIR)
 
 CHUNK_SIZE = int(os.getenv("CHUNK_SIZE"))
 CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP"))
+# Optional path where the JSON run report is written, in addition to stdout
+INGEST_REPORT_PATH = os.getenv("INGEST_REPORT_PATH")
 
 
 def delete_post(post_id: str):
+    from sqlalchemy.orm import Session
+    from src import db
+
     print(f"Deleting existing post: {post_id}")
-    with Session(db.engine) as session:
-        session.query(RedditPosts).filter_by(id=post_id).delete()
+    with Session(db.get_engine()) as session:
+        session.query(db.RedditPosts).filter_by(id=post_id).delete()
         session.commit()
 
 
@@ -29,18 +43,23 @@ def insert_reddit_post_and_comments(p: dict) -> None:
     If the post already exists and has been modified, the existing post is
     deleted and a new post is inserted. Otherwise, the post is skipped.
     """
-    with Session(db.engine) as session:
-        db_post = session.query(RedditPosts).filter_by(id=p["id"]).first()
+    from sqlalchemy.orm import Session
+    from src import db
+
+    with Session(db.get_engine()) as session:
+        db_post = session.query(db.RedditPosts).filter_by(id=p["id"]).first()
 
     if db_post is None:
         print(f'Inserting Reddit post: {p["id"]}')
         db.insert_reddit_post(p)
         db.insert_documents_from_comments_body(p["id"], CHUNK_SIZE, CHUNK_OVERLAP)
+        telemetry.increment("posts_inserted")
     else:
         print(f'Reddit post already exists: {p["id"]}')
 
         if not db.is_post_modified(p["id"]):
             print(f'Skipping Reddit post: {p["id"]}. Already up-to-date.')
+            telemetry.increment("posts_skipped")
         else:
             print(f'Reddit post has been modified: {p["id"]}')
             delete_post(p["id"])
@@ -48,6 +67,7 @@ def insert_reddit_post_and_comments(p: dict) -> None:
             print(f'Inserting Reddit post: {p["id"]}')
             db.insert_reddit_post(p)
             db.insert_documents_from_comments_body(p["id"], CHUNK_SIZE, CHUNK_OVERLAP)
+            telemetry.increment("posts_refreshed")
 
 
 def insert_reddit_posts(posts: list[dict]):
@@ -58,20 +78,40 @@ def insert_reddit_posts(posts: list[dict]):
 
         if p["link_flair_text"] == "Meme":
             print(f"Skipping Reddit post. Reason: Meme")
+            telemetry.increment("posts_skipped_meme")
             return
         try:
-            insert_reddit_post_and_comments(p)
+            with telemetry.span("ingest_post"):
+                insert_reddit_post_and_comments(p)
         except Exception as e:
             print(f"Error processing post: {p['id']}. Error: {e}")
+            telemetry.increment("posts_failed")
 
     with ThreadPoolExecutor(max_workers=10) as executor:
-        futures = [executor.submit(process_post, p) for p in posts]
+        futures = [telemetry.submit(executor, process_post, p) for p in posts]
 
         for f in as_completed(futures):
             f.result()
 
 
+def run_report(run: telemetry.Trace, event: dict, context) -> dict:
+    """
+    Builds the JSON report of an ingest run: the counters and stage timings
+    of the run, plus the figures needed to size the Lambda function.
+    """
+    report = run.summary()
+    report["event"] = event
+    # ru_maxrss is in kilobytes on Linux
+    report["peak_memory_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    if context is not None:
+        report["memory_limit_mb"] = int(context.memory_limit_in_mb)
+        report["remaining_time_ms"] = context.get_remaining_time_in_millis()
+    return report
+
+
 def lambda_handler(event, context):
+    from src import db, reddit
+
     print("Lambda function starting")
     print("Function starting")
 
@@ -79,15 +119,39 @@ def lambda_handler(event, context):
     t = event["t"]
     n = event["n"]
 
+    run = telemetry.Trace("ingest")
     retrieved = 0
     after = None
-    for i in range(iterations):
-        print(f"Fetching top posts from r/dataengineering. Iteration {i+1}.")
-        posts = reddit.get_top_posts("dataengineering", limit=n, t=t, after=after)
-        after = "t3_" + posts[-1]["id"]
-        insert_reddit_posts(posts)
-        retrieved += len(posts)
-        time.sleep(5)
+    with telemetry.activate(run):
+        if db.DOCUMENTS_PARTITIONING != "none":
+            # Created ahead of the first documents of the next period, so
+            # that they are not written to the default partition
+            _, next_period = db.partition_bounds(
+                datetime.now(timezone.utc), db.DOCUMENTS_PARTITIONING
+            )
+            db.create_documents_partition(next_period)
+
+        for i in range(iterations):
+            print(f"Fetching top posts from r/dataengineering. Iteration {i+1}.")
+            posts = reddit.get_top_posts("dataengineering", limit=n, t=t, after=after)
+            after = "t3_" + posts[-1]["id"]
+            with telemetry.span("insert_posts", posts=len(posts)):
+                insert_reddit_posts(posts)
+            retrieved += len(posts)
+            telemetry.increment("posts_retrieved", len(posts))
+            with telemetry.span("reddit_rate_limit_wait"):
+                time.sleep(5)
+
+        print("Refreshing post ranking features")
+        with telemetry.span("refresh_post_features"):
+            db.refresh_post_features()
+
+    report = run_report(run, event, context)
+    print(json.dumps(report))
+    if INGEST_REPORT_PATH:
+        with open(INGEST_REPORT_PATH, "w") as f:
+            json.dump(report, f, indent=4)
+    telemetry.export(run)
 
     print(f"Function completed for {event}")
     msg = f"Retrieved best {retrieved} posts for the {t}."
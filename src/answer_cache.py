@@ -0,0 +1,188 @@
+from collections import OrderedDict
+import itertools
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from src import telemetry
+
+# The answer cache is off by default: a cached answer is replayed for any
+# question whose embedding is within ANSWER_CACHE_THRESHOLD cosine similarity.
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "false").lower() == "true"
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+ANSWER_CACHE_MAX_AGE_SECONDS = int(os.getenv("ANSWER_CACHE_MAX_AGE_SECONDS", "86400"))
+# How long the corpus version is trusted before it is read again. Answers
+# cached before an ingest stop being served at most this long after it.
+ANSWER_CACHE_VERSION_SECONDS = int(os.getenv("ANSWER_CACHE_VERSION_SECONDS", "60"))
+
+
+class AnswerCache:
+    """
+    In-process cache of streamed answers keyed by question similarity.
+
+    A lookup embeds the question and returns the answer of the most similar
+    cached question if its cosine similarity is at least `threshold`, and if
+    it was answered with the same filters and corpus version. Entries are
+    evicted least recently used first beyond `max_entries`, and after
+    `max_age_seconds`.
+    """
+
+    def __init__(
+        self,
+        embed,
+        corpus_version,
+        threshold: float = 0.95,
+        max_entries: int = 1000,
+        max_age_seconds: float = 86400,
+        version_seconds: float = 60,
+    ):
+        """
+        Args:
+            embed (callable): Returns the embedding of a question.
+            corpus_version (callable): Returns a string that changes whenever
+                the documents change, e.g. `db.get_corpus_version`.
+        """
+        self.embed = embed
+        self.corpus_version = corpus_version
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_seconds
+        self.version_seconds = version_seconds
+        self.hits = 0
+        self.misses = 0
+        # key -> (normalized embedding, filters key, answer chunks, created at)
+        self._entries: OrderedDict[int, tuple] = OrderedDict()
+        self._keys = itertools.count()
+        self._matrix = None
+        self._version = None
+        self._version_checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def _current_version(self) -> str:
+        now = time.monotonic()
+        if self._version is None or now - self._version_checked_at > self.version_seconds:
+            version = self.corpus_version()
+            with self._lock:
+                if version != self._version:
+                    # Answers of the previous corpus may cite stale documents
+                    self._entries.clear()
+                    self._matrix = None
+                    self._version = version
+                self._version_checked_at = now
+        return self._version
+
+    def _evict(self) -> None:
+        """Drops expired entries, then the least recently used ones. Locked."""
+        now = time.monotonic()
+        expired = [
+            key
+            for key, entry in self._entries.items()
+            if now - entry[3] > self.max_age_seconds
+        ]
+        for key in expired:
+            del self._entries[key]
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        self._matrix = None
+
+    def _normalize(self, vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def lookup(self, question: str, filters: dict | None = None) -> list[str] | None:
+        """Returns the cached answer chunks for a similar question, if any."""
+        self._current_version()
+        vector = self._normalize(self.embed(question))
+        filters_key = json.dumps(filters or {}, sort_keys=True, default=str)
+
+        with self._lock:
+            self._evict()
+            keys = list(self._entries)
+            if self._matrix is None and keys:
+                self._matrix = np.vstack([self._entries[k][0] for k in keys])
+
+            answer = None
+            if keys:
+                similarities = self._matrix @ vector
+                for i in np.argsort(-similarities):
+                    if similarities[i] < self.threshold:
+                        break
+                    entry = self._entries[keys[i]]
+                    if entry[1] == filters_key:
+                        self._entries.move_to_end(keys[i])
+                        answer = list(entry[2])
+                        break
+
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        telemetry.increment("answer_cache_misses" if answer is None else "answer_cache_hits")
+        return answer
+
+    def store(self, question: str, filters: dict | None, chunks: list[str]) -> None:
+        """Caches the answer chunks of a question."""
+        self._current_version()
+        vector = self._normalize(self.embed(question))
+        filters_key = json.dumps(filters or {}, sort_keys=True, default=str)
+        with self._lock:
+            self._entries[next(self._keys)] = (
+                vector,
+                filters_key,
+                list(chunks),
+                time.monotonic(),
+            )
+            self._evict()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+
+
+_answer_cache = None
+_answer_cache_lock = threading.Lock()
+
+
+def get_answer_cache() -> AnswerCache | None:
+    """Returns the process-wide answer cache, or None if it is disabled."""
+    global _answer_cache
+    if not ANSWER_CACHE_ENABLED:
+        return None
+    with _answer_cache_lock:
+        if _answer_cache is None:
+            from src import db, rag
+
+            def embed(question: str) -> list[float]:
+                # The documents' embedding model, which can differ from the
+                # one set in the environment after a re-embedding
+                _, model, dimensions = db.get_embedding_version()
+                return rag.get_llm_client().embed_query(question, dimensions, model)
+
+            def corpus_version() -> str:
+                # Cached embeddings of another model are not comparable
+                version, _, _ = db.get_embedding_version()
+                return f"{db.get_corpus_version()}:{version}"
+
+            _answer_cache = AnswerCache(
+                embed=embed,
+                corpus_version=corpus_version,
+                threshold=ANSWER_CACHE_THRESHOLD,
+                max_entries=ANSWER_CACHE_MAX_ENTRIES,
+                max_age_seconds=ANSWER_CACHE_MAX_AGE_SECONDS,
+                version_seconds=ANSWER_CACHE_VERSION_SECONDS,
+            )
+    return _answer_cache
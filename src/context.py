@@ -0,0 +1,104 @@
+import os
+
+# Maximum number of tokens of retrieved content put in a prompt
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+# Number of documents retrieved to fill the budget, best first
+CONTEXT_CANDIDATES = int(os.getenv("CONTEXT_CANDIDATES", "10"))
+# Tokens shared by consecutive chunks of a post, see
+# `db.insert_documents_from_comments_body`
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "120"))
+
+# Characters used to find where the next chunk starts repeating the previous
+# one. Shorter overlaps are not merged.
+ANCHOR_CHARS = 32
+
+
+def chunk_number(document_id: str) -> int:
+    """Returns the chunk id of a document id of the form `{post_id}_{chunk_id}`."""
+    return int(document_id.rsplit("_", 1)[1])
+
+
+def strip_title(content: str, title: str) -> str:
+    """Removes the post title prepended to the chunks of a post."""
+    if content.startswith(title):
+        return content[len(title) :].strip()
+    return content
+
+
+def merge_overlap(previous: str, following: str, max_chars: int) -> str:
+    """
+    Joins two consecutive chunks of a post, dropping the start of `following`
+    that repeats the end of `previous` (at most `max_chars` characters).
+    """
+    anchor = following[:ANCHOR_CHARS]
+    if anchor:
+        start = max(len(previous) - max_chars, 0)
+        i = previous.find(anchor, start)
+        while i != -1:
+            if following.startswith(previous[i:]):
+                return previous[:i] + following
+            i = previous.find(anchor, i + 1)
+    return f"{previous}\n{following}"
+
+
+def pack_context(
+    sources: list[tuple],
+    token_counts: dict[str, int],
+    budget: int = CONTEXT_TOKEN_BUDGET,
+    chunk_overlap: int = CHUNK_OVERLAP,
+    count_tokens=None,
+) -> tuple[list[tuple[str, str, str]], int]:
+    """
+    Greedily packs the best retrieved chunks into a token budget.
+
+    Chunks are taken in ranking order and skipped when they do not fit in the
+    remaining budget. Chunks of the same post are grouped, and consecutive
+    chunks are merged into one passage without their repeated overlap, which
+    is then not counted against the budget.
+
+    Args:
+        sources (list[tuple]): Rows starting with (id, post_id, title, score,
+            content) as returned by `db.hybrid_search`, best first.
+        token_counts (dict[str, int]): Token count of each document, see
+            `db.get_document_token_counts`.
+        budget (int): Maximum number of tokens of content.
+        chunk_overlap (int): Tokens shared by consecutive chunks.
+        count_tokens (callable, optional): Counts the tokens of documents
+            missing from `token_counts`. Defaults to 4 characters per token.
+    Returns:
+        tuple: The (post_id, title, body) of each post in ranking order, and
+            the number of tokens packed.
+    """
+    posts: dict[str, dict] = {}
+    used = 0
+    for id, post_id, title, _, content, *_ in sources:
+        num_tokens = token_counts.get(id)
+        if num_tokens is None:
+            num_tokens = count_tokens(content) if count_tokens else len(content) // 4
+
+        chunk = chunk_number(id)
+        chunks = posts[post_id]["chunks"] if post_id in posts else {}
+        neighbours = (chunk - 1 in chunks) + (chunk + 1 in chunks)
+        cost = max(num_tokens - neighbours * chunk_overlap, 0)
+        if used + cost > budget:
+            continue
+
+        used += cost
+        if post_id not in posts:
+            posts[post_id] = {"title": title, "chunks": {}}
+        posts[post_id]["chunks"][chunk] = strip_title(content, title)
+
+    # Characters per overlap region, with a wide margin: tokens average ~4
+    max_chars = chunk_overlap * 8
+    blocks = []
+    for post_id, post in posts.items():
+        passages = []
+        previous_chunk = None
+        for chunk, body in sorted(post["chunks"].items()):
+            if previous_chunk is not None and chunk == previous_chunk + 1:
+                passages[-1] = merge_overlap(passages[-1], body, max_chars)
+            else:
+                passages.append(body)
+            previous_chunk = chunk
+        blocks.append((post_id, post["title"], "\n...\n".join(passages)))
+    return blocks, used
@@ -1,7 +1,12 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 import hashlib
 import logging
+import math
 import os
+import re
+import threading
+import time
 from sqlalchemy import (
     Column,
     Integer,
@@ -10,6 +15,7 @@ from sqlalchemy import (
     text,
     ForeignKey,
     DateTime,
+    Float,
 )
 from sqlalchemy.orm import (
     Session,
@@ -18,10 +24,18 @@ from sqlalchemy.orm import (
     mapped_column,
     relationship,
 )
+from pgvector.psycopg import register_vector
 from pgvector.sqlalchemy import Vector
+import numpy as np
 import psycopg
+from psycopg import sql
 
-from src import reddit, rag
+from src import reddit, rag, snapshot, telemetry
+from src.fusion import linear_fusion, reciprocal_rank_fusion
+from src.keyword_index import STOPWORDS, BM25Index
+from src.permalink_cache import PermalinkCache
+from src.text_query import build_tsqueries
+from src.vector_index import NumpyVectorIndex
 
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
@@ -33,8 +47,150 @@ connection_string = (
     f'postgresql+psycopg://{os.getenv("POSTGRES_USER")}:{os.getenv("POSTGRES_PASSWORD")}'
     f'@{os.getenv("POSTGRES_HOST")}:{os.getenv("POSTGRES_PORT")}/{os.getenv("POSTGRES_DB")}'
 )
-engine = create_engine(connection_string, pool_size=20)
-llm_client = rag.ThrottledOpenAI()
+# Created on first use by `get_engine`, not at import: gunicorn workers and
+# Lambda functions only pay for what they use
+_engine = None
+_engine_pid = None
+_engine_lock = threading.Lock()
+
+# Re-ranking weights applied to the precomputed post features. With all weights
+# set to zero the hybrid search ranking is the plain fusion of the legs.
+FEATURE_WEIGHTS = {
+    "score": float(os.getenv("RANK_WEIGHT_SCORE", "0")),
+    "comments": float(os.getenv("RANK_WEIGHT_COMMENTS", "0")),
+    "recency": float(os.getenv("RANK_WEIGHT_RECENCY", "0")),
+}
+RECENCY_HALF_LIFE_DAYS = float(os.getenv("RANK_RECENCY_HALF_LIFE_DAYS", "365"))
+RANK_CANDIDATES = int(os.getenv("RANK_CANDIDATES", "20"))
+
+# Fusion of the hybrid search legs, overridable per request (see
+# `parse_fusion`):
+#   - method: "rrf" (weighted reciprocal rank fusion) or "linear" (weighted sum
+#     of the min-max normalized leg scores)
+#   - rrf_k: the RRF constant. The partial-match keyword leg uses 3 * rrf_k
+#     when the exact-match leg returns results.
+#   - *_depth: the number of candidates retrieved by each leg. 0 retrieves
+#     `limit` documents, or RANK_CANDIDATES when re-ranking is enabled.
+#   - *_weight: the contribution of each leg to the fused score.
+FUSION_PARAMS = {
+    "method": os.getenv("FUSION_METHOD", "rrf"),
+    "rrf_k": float(os.getenv("FUSION_RRF_K", "60")),
+    "vector_depth": int(os.getenv("FUSION_VECTOR_DEPTH", "0")),
+    "keyword_depth": int(os.getenv("FUSION_KEYWORD_DEPTH", "0")),
+    "exact_depth": int(os.getenv("FUSION_EXACT_DEPTH", "0")),
+    "vector_weight": float(os.getenv("FUSION_VECTOR_WEIGHT", "1")),
+    "keyword_weight": float(os.getenv("FUSION_KEYWORD_WEIGHT", "1")),
+    "exact_weight": float(os.getenv("FUSION_EXACT_WEIGHT", "1")),
+}
+FUSION_METHODS = ("rrf", "linear")
+# Upper bound of the per-request leg depths accepted by `parse_fusion`. The
+# vector depth is also bounded by HNSW_MAX_EF_SEARCH.
+FUSION_MAX_DEPTH = int(os.getenv("FUSION_MAX_DEPTH", "1000"))
+
+# pgvector >= 0.8 iterative index scans. With a WHERE clause, HNSW otherwise
+# filters the `hnsw.ef_search` candidates after the scan and can return fewer
+# rows than requested. One of "off", "relaxed_order" or "strict_order".
+HNSW_ITERATIVE_SCAN = os.getenv("HNSW_ITERATIVE_SCAN", "relaxed_order")
+
+# HNSW build parameters (pgvector defaults are m=16, ef_construction=64) and
+# the size of the dynamic candidate list at query time. Higher `ef_search`
+# improves recall at the cost of latency. Unset uses the pgvector default. In
+# both cases it is raised to the number of candidates of the query, see
+# `default_ef_search`.
+HNSW_M = int(os.getenv("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "64"))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH")) if os.getenv("HNSW_EF_SEARCH") else None
+# pgvector default and maximum of `hnsw.ef_search`
+HNSW_DEFAULT_EF_SEARCH = 40
+HNSW_MAX_EF_SEARCH = 1000
+
+# The dimensions requested from the embedding model. The model and
+# dimensions of an existing database are changed online with
+# `start_embedding_migration`.
+EMBEDDING_DIMENSIONS = rag.EMBEDDING_DIMENSIONS
+# How often the searches re-read the active embedding version, i.e. how long
+# a process keeps embedding questions with the previous model after a cutover
+EMBEDDING_VERSION_REFRESH_SECONDS = int(
+    os.getenv("EMBEDDING_VERSION_REFRESH_SECONDS", "60")
+)
+
+# Representation of the embeddings in the HNSW index. The full-precision
+# `embedding` column is always kept; quantized modes index an expression on it
+# and re-rank the top `limit * EMBEDDING_RERANK_FACTOR` candidates exactly.
+#   - "vector": float32, no re-ranking
+#   - "halfvec": float16, half the index size
+#   - "binary": 1 bit per dimension, 1/32 of the index size
+#   - "shortlist": the first EMBEDDING_SHORTLIST_DIMENSIONS dimensions only.
+#     Matryoshka embeddings keep most of their meaning in the leading
+#     dimensions, so a low-dimensional shortlist re-ranked at full dimension
+#     is close to a full search with a much smaller index.
+EMBEDDING_INDEX_MODE = os.getenv("EMBEDDING_INDEX_MODE", "vector")
+EMBEDDING_RERANK_FACTOR = int(os.getenv("EMBEDDING_RERANK_FACTOR", "4"))
+EMBEDDING_SHORTLIST_DIMENSIONS = int(os.getenv("EMBEDDING_SHORTLIST_DIMENSIONS", "256"))
+# Backend answering the vector leg of the searches, see `VECTOR_SEARCH_BACKENDS`.
+# The "numpy" backend keeps every embedding in process memory (a few hundred MB
+# for a few hundred thousand chunks) and refreshes it from `documents` every
+# VECTOR_INDEX_REFRESH_SECONDS. With VECTOR_INDEX_DIR set, the index is
+# loaded memory-mapped from (and saved to) that directory, so gunicorn workers
+# share one copy through the page cache.
+VECTOR_SEARCH_BACKEND = os.getenv("VECTOR_SEARCH_BACKEND", "postgres")
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR")
+VECTOR_INDEX_DTYPE = os.getenv("VECTOR_INDEX_DTYPE", "float32")
+VECTOR_INDEX_REFRESH_SECONDS = int(os.getenv("VECTOR_INDEX_REFRESH_SECONDS", "300"))
+
+# Backend answering the two keyword legs, see `KEYWORD_SEARCH_BACKENDS`. The
+# "bm25" backend is an in-process inverted index refreshed from `documents`
+# every KEYWORD_INDEX_REFRESH_SECONDS.
+KEYWORD_SEARCH_BACKEND = os.getenv("KEYWORD_SEARCH_BACKEND", "postgres")
+KEYWORD_INDEX_REFRESH_SECONDS = int(os.getenv("KEYWORD_INDEX_REFRESH_SECONDS", "300"))
+# Snapshot (see `export_snapshot`) the in-process indexes are loaded from on
+# first use, then refreshed from the database, instead of reading the whole
+# documents table
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR")
+# Postgres text search configuration of `documents.content_ts_vector` and of
+# the keyword queries, e.g. "english" or "simple" for multilingual content (no
+# stemming, no stopwords). Existing databases are switched with
+# `migrate_text_search_config`.
+TEXT_SEARCH_CONFIG = os.getenv("TEXT_SEARCH_CONFIG", "english")
+# Dropped from the queries before they reach Postgres, which would drop them
+# anyway. Only known for the english configuration.
+TEXT_SEARCH_STOPWORDS = STOPWORDS if TEXT_SEARCH_CONFIG == "english" else frozenset()
+# Range partitioning of `documents` on `post_created_at`: "none", "year" or
+# "month". Each partition has its own (smaller) HNSW and GIN indexes, and
+# searches filtered on `created_after`/`created_before` only scan the matching
+# partitions. Existing databases are converted with
+# `migrate_documents_partitioning`.
+DOCUMENTS_PARTITIONING = os.getenv("DOCUMENTS_PARTITIONING", "none")
+DOCUMENTS_PARTITION_PERIODS = ("year", "month")
+# How often the API re-reads the archived partitions, whose dates are
+# rejected in search filters (see `check_archived_filters`)
+ARCHIVED_PARTITIONS_REFRESH_SECONDS = int(
+    os.getenv("ARCHIVED_PARTITIONS_REFRESH_SECONDS", "60")
+)
+
+EMBEDDING_INDEX_NAMES = {
+    "vector": "embedding_idx",
+    "halfvec": "embedding_halfvec_idx",
+    "binary": "embedding_binary_idx",
+    "shortlist": "embedding_shortlist_idx",
+}
+# Column of `documents` holding the embeddings of each embedding version
+# status, see `EmbeddingVersions`
+EMBEDDING_VERSION_COLUMNS = {
+    "active": "embedding",
+    "backfilling": "embedding_next",
+    "previous": "embedding_previous",
+}
+
+# Number of threads running the keyword legs in `batch_hybrid_search`. Each
+# thread holds its own database connection while searching.
+BATCH_SEARCH_WORKERS = int(os.getenv("BATCH_SEARCH_WORKERS", "8"))
+
+SEARCH_FILTERS = ("tag", "created_after", "created_before", "min_score")
+
+# Maximum number of post permalinks kept in memory by `get_posts_url`. The
+# cache is warmed with the newest posts.
+PERMALINK_CACHE_SIZE = int(os.getenv("PERMALINK_CACHE_SIZE", "100000"))
 
 Base = declarative_base()
 
@@ -73,7 +229,20 @@ class Documents(Base):
     )
     chunk_id = Column(Integer, nullable=False)
     content = Column(String, nullable=False)
-    embedding: Mapped[list[float]] = mapped_column(Vector(1536), nullable=True)
+    embedding: Mapped[list[float]] = mapped_column(
+        Vector(EMBEDDING_DIMENSIONS), nullable=True
+    )
+
+    # Denormalized copies of the parent post attributes used as search filters.
+    # Keeping them on `documents` lets filtered searches run against a single
+    # table instead of joining `posts` for every candidate.
+    post_tag = Column(String(30), nullable=True)
+    post_created_at = Column(DateTime, nullable=True)
+    post_score = Column(Integer, nullable=True)
+
+    # Number of tokens of `content`, counted once at ingest so that the
+    # context of a prompt can be packed without re-tokenizing it.
+    num_tokens = Column(Integer, nullable=True)
 
     post = relationship("RedditPosts", back_populates="documents")
 
@@ -81,28 +250,97 @@ class Documents(Base):
         return f"<Document(id={self.id}, post_id={self.post_id}, chunk_id={self.chunk_id})>"
 
 
-def get_cursor():
+class PostFeatures(Base):
+    """
+    Precomputed ranking features of a post. Kept in a narrow table so the
+    hybrid search can join it by primary key without touching the (possibly
+    large) post descriptions. Refreshed with `refresh_post_features`.
     """
-    Connects to the PostgreSQL database using psycopg and returns the connection and cursor objects.
-    The connection parameters are retrieved from environment variables.
 
-    Returns:
-        conn: The connection object to the PostgreSQL database.
-        cur: The cursor object for executing SQL queries.
+    __tablename__ = "post_features"
+
+    post_id = Column(
+        String(32), ForeignKey("posts.id", ondelete="CASCADE"), primary_key=True
+    )
+    score_norm = Column(Float, nullable=False)
+    comments_norm = Column(Float, nullable=False)
+    recency = Column(Float, nullable=False)
+    computed_at = Column(DateTime, nullable=False)
+
+    def __repr__(self):
+        return f"<PostFeatures(post_id={self.post_id}, score_norm={self.score_norm})>"
+
+
+class EmbeddingVersions(Base):
+    """
+    Embedding models the documents were embedded with. The "active" version
+    is stored in `documents.embedding` and used by the searches, a
+    "backfilling" version in `documents.embedding_next` while it is filled
+    by `backfill_embeddings`, and the "previous" version in
+    `documents.embedding_previous` until it is retired.
+    """
+
+    __tablename__ = "embedding_versions"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    model = Column(String, nullable=False)
+    dimensions = Column(Integer, nullable=False)
+    status = Column(String(16), nullable=False)
+    created_at = Column(DateTime, nullable=False)
+    activated_at = Column(DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"<EmbeddingVersion(id={self.id}, model={self.model}, status={self.status})>"
+
+
+def get_engine():
+    """
+    Returns the process-wide SQLAlchemy engine, created on first use.
+
+    In a forked process (e.g. gunicorn workers started with --preload) the
+    pooled connections inherited from the parent are discarded without being
+    closed, as they are still in use by the parent.
+    """
+    global _engine, _engine_pid
+    with _engine_lock:
+        if _engine is None:
+            _engine = create_engine(connection_string, pool_size=20)
+        elif _engine_pid != os.getpid():
+            _engine.dispose(close=False)
+        _engine_pid = os.getpid()
+    return _engine
+
+
+def get_connection() -> psycopg.Connection:
     """
-    conn = psycopg.connect(
+    Connects to the PostgreSQL database using psycopg. The connection
+    parameters are retrieved from environment variables.
+    """
+    return psycopg.connect(
         dbname=os.getenv("POSTGRES_DB"),
         user=os.getenv("POSTGRES_USER"),
         password=os.getenv("POSTGRES_PASSWORD"),
         host=os.getenv("POSTGRES_HOST"),
         port=os.getenv("POSTGRES_PORT"),
     )
+
+
+def get_cursor():
+    """
+    Connects to the PostgreSQL database using psycopg and returns the connection and cursor objects.
+    The connection parameters are retrieved from environment variables.
+
+    Returns:
+        conn: The connection object to the PostgreSQL database.
+        cur: The cursor object for executing SQL queries.
+    """
+    conn = get_connection()
     return conn.cursor()
 
 
 def init_schema() -> None:
 
-    with Session(engine) as session:
+    with Session(get_engine()) as session:
         session.execute(text("DROP SCHEMA IF EXISTS public CASCADE;"))
         session.execute(text("CREATE SCHEMA public;"))
         session.execute(
@@ -110,29 +348,177 @@ def init_schema() -> None:
         )
         session.commit()
 
-    Base.metadata.create_all(engine)
+    Base.metadata.create_all(get_engine())
 
-    with Session(engine) as session:
+    with Session(get_engine()) as session:
+        # Adding the full-text search column and its index
+        session.execute(text(_ts_vector_ddl(TEXT_SEARCH_CONFIG)))
+
+        # Adding indexes for the search filters
         session.execute(
             text(
                 """
-            ALTER TABLE documents
-            ADD COLUMN content_ts_vector tsvector
-            GENERATED ALWAYS AS (to_tsvector('english', content)) STORED;
+            CREATE INDEX documents_post_tag_idx ON documents (post_tag);
+            CREATE INDEX documents_post_created_at_idx ON documents (post_created_at);
+            CREATE INDEX documents_post_score_idx ON documents (post_score);
         """
             )
         )
+        session.add(_initial_embedding_version())
+        session.commit()
 
-        # Adding indexes for full-text search and vector search
-        session.execute(
-            text(
-                """
-            CREATE INDEX content_ts_vector_idx ON documents USING GIN (content_ts_vector);
-            CREATE INDEX embedding_idx ON documents USING hnsw (embedding vector_cosine_ops);
-        """
+    if DOCUMENTS_PARTITIONING != "none":
+        # Also creates the index for vector search, on every partition
+        migrate_documents_partitioning(DOCUMENTS_PARTITIONING)
+        return
+
+    # Adding index for vector search
+    create_embedding_index(EMBEDDING_INDEX_MODE)
+
+
+def _ts_vector_ddl(config: str) -> str:
+    """
+    Returns the statements adding `documents.content_ts_vector`, generated with
+    a text search configuration, and its GIN index.
+    """
+    # Interpolated: DDL statements do not take parameters
+    if not re.fullmatch(r"[A-Za-z_][\w.]*", config):
+        raise ValueError(f"Invalid text search configuration: {config}")
+    return f"""
+    ALTER TABLE documents
+    ADD COLUMN content_ts_vector tsvector
+    GENERATED ALWAYS AS (to_tsvector('{config}', content)) STORED;
+
+    CREATE INDEX content_ts_vector_idx ON documents USING GIN (content_ts_vector);
+    """
+
+
+def _embedding_index_expression(
+    mode: str, column: str = "embedding", dimensions: int = EMBEDDING_DIMENSIONS
+) -> tuple[str, str, str]:
+    """
+    Returns, for an embedding index mode, the indexed expression on an
+    embedding column, its operator class, and the matching distance to the
+    query vector (bound as `%(vector)s`). The distance must match the indexed
+    expression exactly for Postgres to use the index.
+    """
+    c, d = column, dimensions
+    if mode == "vector":
+        return c, "vector_cosine_ops", f"{c} <=> %(vector)s::vector"
+    if mode == "halfvec":
+        return (
+            f"({c}::halfvec({d}))",
+            "halfvec_cosine_ops",
+            f"{c}::halfvec({d}) <=> %(vector)s::vector::halfvec({d})",
+        )
+    if mode == "binary":
+        return (
+            f"(binary_quantize({c})::bit({d}))",
+            "bit_hamming_ops",
+            f"binary_quantize({c})::bit({d}) <~> binary_quantize(%(vector)s::vector)",
+        )
+    if mode == "shortlist":
+        # Cosine distance is scale invariant, so the truncated vectors do not
+        # need to be re-normalized
+        s = EMBEDDING_SHORTLIST_DIMENSIONS
+        return (
+            f"(subvector({c}, 1, {s})::vector({s}))",
+            "vector_cosine_ops",
+            f"subvector({c}, 1, {s})::vector({s}) <=> subvector(%(vector)s::vector, 1, {s})",
+        )
+    raise ValueError(f"Unknown embedding index mode: {mode}")
+
+
+def _embedding_index_name(mode: str, column: str = "embedding") -> str:
+    """Returns the name of the HNSW index of a mode on an embedding column."""
+    return EMBEDDING_INDEX_NAMES[mode].replace("embedding", column, 1)
+
+
+def create_embedding_index(
+    mode: str,
+    concurrently: bool = False,
+    column: str = "embedding",
+    dimensions: int = EMBEDDING_DIMENSIONS,
+) -> None:
+    """
+    Creates the HNSW index for the given embedding index mode, by default on
+    the `embedding` column.
+
+    Migrating an existing database to another mode without downtime:
+        1. create_embedding_index(new_mode, concurrently=True)
+        2. set EMBEDDING_INDEX_MODE=new_mode and restart the app
+        3. drop_embedding_index(old_mode)
+    """
+    expression, opclass, _ = _embedding_index_expression(mode, column, dimensions)
+    query = f"""
+    CREATE INDEX {"CONCURRENTLY" if concurrently else ""} IF NOT EXISTS
+    {_embedding_index_name(mode, column)} ON documents
+    USING hnsw ({expression} {opclass})
+    WITH (m = {HNSW_M}, ef_construction = {HNSW_EF_CONSTRUCTION});
+    """
+    cursor = get_cursor()
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+    cursor.connection.autocommit = True
+    if concurrently and is_documents_partitioned():
+        _create_partitioned_index_concurrently(cursor, mode, column, dimensions)
+    else:
+        cursor.execute(query)
+    cursor.close()
+
+
+def _create_partitioned_index_concurrently(
+    cursor, mode: str, column: str, dimensions: int
+) -> None:
+    """
+    Postgres cannot build an index concurrently on a partitioned table: the
+    index is created on the parent only, built concurrently on each partition
+    and attached to the parent, which becomes valid with its last partition.
+    """
+    index_name = _embedding_index_name(mode, column)
+    expression, opclass, _ = _embedding_index_expression(mode, column, dimensions)
+    index = sql.SQL(
+        "USING hnsw ({expression} {opclass}) "
+        "WITH (m = {m}, ef_construction = {ef_construction})"
+    ).format(
+        expression=sql.SQL(expression),
+        opclass=sql.SQL(opclass),
+        m=sql.Literal(HNSW_M),
+        ef_construction=sql.Literal(HNSW_EF_CONSTRUCTION),
+    )
+    cursor.execute(
+        sql.SQL("CREATE INDEX IF NOT EXISTS {name} ON ONLY documents {index};").format(
+            name=sql.Identifier(index_name), index=index
+        )
+    )
+    for partition in _documents_partitions(cursor):
+        partition_index = f"{partition}_{index_name}"
+        cursor.execute(
+            sql.SQL(
+                "CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} {index};"
+            ).format(
+                name=sql.Identifier(partition_index),
+                table=sql.Identifier(partition),
+                index=index,
             )
         )
-        session.commit()
+        cursor.execute(
+            sql.SQL("ALTER INDEX {parent} ATTACH PARTITION {child};").format(
+                parent=sql.Identifier(index_name),
+                child=sql.Identifier(partition_index),
+            )
+        )
+
+
+def drop_embedding_index(mode: str) -> None:
+    """Drops the HNSW index of the given embedding index mode, if it exists."""
+    cursor = get_cursor()
+    cursor.connection.autocommit = True
+    # Indexes of partitioned tables cannot be dropped concurrently
+    concurrently = "" if is_documents_partitioned() else "CONCURRENTLY"
+    cursor.execute(
+        f"DROP INDEX {concurrently} IF EXISTS {EMBEDDING_INDEX_NAMES[mode]};"
+    )
+    cursor.close()
 
 
 def get_content_hash(title: str, description: str, body: str) -> str:
@@ -182,7 +568,7 @@ def insert_reddit_post(p: dict) -> None:
     now = now.replace(microsecond=0)
 
     # Insert the post into the database
-    with Session(engine) as session:
+    with Session(get_engine()) as session:
         post = RedditPosts(
             id=p["id"],
             title=p["title"],
@@ -199,6 +585,9 @@ def insert_reddit_post(p: dict) -> None:
         )
         session.add(post)
         session.commit()
+    telemetry.increment("posts_written")
+    if _permalink_cache is not None:
+        _permalink_cache.update({p["id"]: p["permalink"]})
 
 
 def insert_documents_from_comments_body(
@@ -215,7 +604,7 @@ def insert_documents_from_comments_body(
         None
     """
 
-    with Session(engine) as session:
+    with Session(get_engine()) as session:
         post = session.query(RedditPosts).filter_by(id=post_id).first()
 
     # Generate entire document body as title + description + comments
@@ -228,6 +617,9 @@ def insert_documents_from_comments_body(
         len(tokens) + chunk_size - 1
     ) // chunk_size  # Calculate the number of chunks
 
+    with Session(get_engine()) as session:
+        versions = _live_embedding_versions(session)
+
     for chunk_id in range(1, num_chunks + 1):
         start = (chunk_id - 1) * (chunk_size - chunk_overlap)
         end = start + chunk_size
@@ -237,182 +629,2478 @@ def insert_documents_from_comments_body(
         if chunk_id != 1:
             chunk_content = f"{post.title}\n{chunk_content}"
 
-        # Insert the document chunk into the database
-        with Session(engine) as session:
-            d = Documents(
-                id=f"{post_id}_{chunk_id}",
-                post_id=post_id,
-                chunk_id=chunk_id,
-                content=chunk_content,
-                embedding=llm_client.get_embedding(chunk_content),
-            )
-            session.add(d)
-            session.commit()
+        document = dict(
+            id=f"{post_id}_{chunk_id}",
+            post_id=post_id,
+            chunk_id=chunk_id,
+            content=chunk_content,
+            post_tag=post.tag,
+            post_created_at=post.created_at,
+            post_score=post.score,
+            num_tokens=rag.get_num_tokens_from_string(chunk_content),
+        )
+        # The chunk is embedded before the transaction is opened: a cutover
+        # waiting on its lock would block every search in turn. It is embedded
+        # again in the rare case the versions changed in the meantime.
+        while True:
+            embeddings = _embed_document(chunk_content, versions)
+            changed = _insert_document(document, embeddings)
+            if changed is None:
+                break
+            versions = changed
+        telemetry.increment("documents_written")
+
+
+def _embed_document(
+    content: str, versions: list[tuple[str, str, int]]
+) -> dict[tuple[str, str, int], list[float]]:
+    """
+    Embeds a document with the active embedding version and, during a
+    migration, with the backfilling one too (dual-write), so that the
+    backfill never has to catch up with the ingest.
 
+    Args:
+        content (str): The document content.
+        versions (list): As returned by `_live_embedding_versions`.
+    Returns:
+        dict: The embedding of each version.
+    """
+    return {
+        (column, model, dimensions): rag.get_llm_client().get_embedding(
+            content, dimensions, model
+        )
+        for column, model, dimensions in versions
+    }
 
-def get_posts_url(ids: list[str]) -> dict[str, str]:
+
+def _insert_document(
+    document: dict, embeddings: dict[tuple[str, str, int], list[float]]
+) -> list[tuple[str, str, int]] | None:
     """
-    Returns the URLs of the Reddit posts based on the provided document IDs.
+    Inserts a document with its embeddings (see `_embed_document`), unless
+    the embedding versions changed since it was embedded. The versions are
+    re-read once `documents` is locked, and every version change alters
+    `documents`: none can happen before the commit.
+
+    Returns:
+        list | None: The live embedding versions if they changed, in which
+            case nothing was inserted, and None otherwise.
     """
-    with Session(engine) as session:
-        parent_posts = (
-            session.query(RedditPosts)
-            .filter(RedditPosts.id.in_(ids))
-            .order_by(RedditPosts.id.asc())
-            .all()
+    with Session(get_engine()) as session:
+        session.execute(text("LOCK TABLE documents IN ROW EXCLUSIVE MODE;"))
+        versions = _live_embedding_versions(session)
+        if set(versions) != set(embeddings):
+            return versions
+
+        session.add(Documents(**document))
+        session.flush()
+        assignments, params = [], {"id": document["id"]}
+        for (column, _, _), embedding in embeddings.items():
+            assignments.append(f"{column} = CAST(:{column} AS vector)")
+            params[column] = _vector_literal(embedding)
+        session.execute(
+            text(f"UPDATE documents SET {', '.join(assignments)} WHERE id = :id;"),
+            params,
+        )
+        session.commit()
+    return None
+
+
+def _live_embedding_versions(session: Session) -> list[tuple[str, str, int]]:
+    """
+    Returns the column, model and dimensions of the embedding versions new
+    documents are embedded with, the active one first. Databases created
+    before the versions only have the OPENAI_EMBEDDING_MODEL embeddings.
+    """
+    if not session.execute(
+        text("SELECT to_regclass('embedding_versions') IS NOT NULL;")
+    ).scalar():
+        return [("embedding", rag.EMBEDDING_MODEL_NAME, EMBEDDING_DIMENSIONS)]
+    rows = session.execute(
+        text(
+            """
+            SELECT status, model, dimensions FROM embedding_versions
+            WHERE status IN ('active', 'backfilling')
+            ORDER BY status;
+            """
         )
+    ).all()
+    return [(EMBEDDING_VERSION_COLUMNS[status], model, d) for status, model, d in rows]
 
-    return {post.id: post.permalink for post in parent_posts}
 
+def _vector_literal(vector) -> str:
+    """Returns the text representation of a vector, cast to `vector` in SQL."""
+    return "[" + ",".join(map(str, vector)) + "]"
 
-def vector_search(text_query: str, limit: int) -> list[tuple]:
+
+def refresh_post_features(half_life_days: float = RECENCY_HALF_LIFE_DAYS) -> None:
     """
-    Returns the id and rank of the most semantically similar documents to the
-    input text query.
+    Recomputes the ranking features of every post in a single statement:
+        - score_norm: log-scaled score, normalized to [0, 1] by the top post
+        - comments_norm: log-scaled number of comments, normalized to [0, 1]
+        - recency: exponential decay of the post age with the given half-life
+
+    Should be called after each ingest so that new posts get features and the
+    recency decay of existing posts is kept up to date.
     """
-    # NOTE: Casting for vector type https://github.com/pgvector/pgvector-python/issues/4
-    # The smaller the cosine distance, the more semantically similar two vectors are.
-    # Partial results are
-    # ('1ftama5_1', 0.39604451632764925, 1)
-    # ('1fv6hi1_3', 0.3967565950831704, 2)
     query = """
-    SELECT id, RANK () OVER (ORDER BY embedding <=> %(vector)s::vector) AS rank
-    FROM documents
-    ORDER BY embedding <=> %(vector)s::vector ASC
-    LIMIT %(limit)s;
+    INSERT INTO post_features (post_id, score_norm, comments_norm, recency, computed_at)
+    SELECT
+        id,
+        COALESCE(
+            ln(1 + greatest(score, 0))
+            / NULLIF(max(ln(1 + greatest(score, 0))) OVER (), 0),
+            0
+        ),
+        COALESCE(
+            ln(1 + greatest(num_comments, 0))
+            / NULLIF(max(ln(1 + greatest(num_comments, 0))) OVER (), 0),
+            0
+        ),
+        exp(
+            -ln(2) * greatest(extract(epoch FROM (now() AT TIME ZONE 'utc') - created_at), 0)
+            / 86400 / %(half_life_days)s
+        ),
+        now() AT TIME ZONE 'utc'
+    FROM posts
+    ON CONFLICT (post_id) DO UPDATE SET
+        score_norm = EXCLUDED.score_norm,
+        comments_norm = EXCLUDED.comments_norm,
+        recency = EXCLUDED.recency,
+        computed_at = EXCLUDED.computed_at;
     """
-    vector = llm_client.get_embedding(text_query)
-    cursor = get_cursor()
-    cursor.execute(query, {"vector": vector, "limit": limit})
-    result = cursor.fetchall()
-    cursor.close()
-    return result
+    # Through the engine's pool, so that warm Lambda invocations reuse the
+    # connection of the ingest
+    with get_engine().begin() as connection:
+        connection.exec_driver_sql(query, {"half_life_days": half_life_days})
+
 
+def migrate_post_features() -> None:
+    """
+    Creates the `post_features` table in an existing database and computes
+    the features of every post. Safe to run again.
+    """
+    PostFeatures.__table__.create(get_engine(), checkfirst=True)
+    refresh_post_features()
 
-def keyword_search(text_query: str, limit: int) -> list[tuple]:
-    """Performns full-text search on the content of the documents."""
+
+def migrate_document_filters() -> None:
+    """
+    Adds the denormalized filter columns and their indexes to an existing
+    `documents` table and backfills them from `posts`. Safe to run again.
+    """
     query = """
-    WITH ts_query AS (
-        SELECT replace(plainto_tsquery(%(text_query)s)::text, '&', '|') AS modified_query
-    )
-    SELECT
-        id,
-        RANK () OVER (
-            ORDER BY ts_rank_cd(
-                content_ts_vector,
-                to_tsquery('english', (SELECT modified_query FROM ts_query))
-            ) DESC
-        ) AS rank
-    FROM documents
-    WHERE
-        content_ts_vector @@
-        to_tsquery('english', (SELECT modified_query FROM ts_query))
-    ORDER BY rank
-    LIMIT %(limit)s;
+    ALTER TABLE documents ADD COLUMN IF NOT EXISTS post_tag VARCHAR(30);
+    ALTER TABLE documents ADD COLUMN IF NOT EXISTS post_created_at TIMESTAMP WITHOUT TIME ZONE;
+    ALTER TABLE documents ADD COLUMN IF NOT EXISTS post_score INTEGER;
+
+    UPDATE documents
+    SET
+        post_tag = posts.tag,
+        post_created_at = posts.created_at,
+        post_score = posts.score
+    FROM posts
+    WHERE documents.post_id = posts.id;
+
+    CREATE INDEX IF NOT EXISTS documents_post_tag_idx ON documents (post_tag);
+    CREATE INDEX IF NOT EXISTS documents_post_created_at_idx ON documents (post_created_at);
+    CREATE INDEX IF NOT EXISTS documents_post_score_idx ON documents (post_score);
+    """
+    with Session(get_engine()) as session:
+        session.execute(text(query))
+        session.commit()
+
+
+def migrate_text_search_config(config: str = TEXT_SEARCH_CONFIG) -> None:
+    """
+    Regenerates `documents.content_ts_vector` and its index with another text
+    search configuration. Rewrites the table: run it during a maintenance
+    window, then restart the app with the same TEXT_SEARCH_CONFIG.
+    """
+    query = f"""
+    DROP INDEX IF EXISTS content_ts_vector_idx;
+    ALTER TABLE documents DROP COLUMN IF EXISTS content_ts_vector;
+    {_ts_vector_ddl(config)}
+    """
+    with Session(get_engine()) as session:
+        session.execute(text(query))
+        session.commit()
+
+
+def migrate_document_token_counts(batch_size: int = 1_000) -> None:
+    """
+    Adds the `num_tokens` column to an existing `documents` table and
+    backfills it for the documents that have no count. Safe to run again.
     """
+    with Session(get_engine()) as session:
+        session.execute(
+            text("ALTER TABLE documents ADD COLUMN IF NOT EXISTS num_tokens INTEGER;")
+        )
+        session.commit()
+
     cursor = get_cursor()
-    cursor.execute(query, {"text_query": text_query, "limit": limit})
-    result = cursor.fetchall()
+    while True:
+        cursor.execute(
+            "SELECT id, content FROM documents WHERE num_tokens IS NULL LIMIT %(n)s;",
+            {"n": batch_size},
+        )
+        rows = cursor.fetchall()
+        if len(rows) == 0:
+            break
+        cursor.executemany(
+            "UPDATE documents SET num_tokens = %s WHERE id = %s;",
+            [(rag.get_num_tokens_from_string(content), id) for id, content in rows],
+        )
+        cursor.connection.commit()
+        logger.info(f"Backfilled token counts of {len(rows)} documents.")
+    cursor.close()
+
+
+def get_document_token_counts(ids: list[str]) -> dict[str, int]:
+    """Returns the stored token counts of the given documents, when known."""
+    if len(ids) == 0:
+        return {}
+    cursor = get_cursor()
+    cursor.execute(
+        """
+        SELECT id, num_tokens FROM documents
+        WHERE id = ANY(%(ids)s) AND num_tokens IS NOT NULL;
+        """,
+        {"ids": list(ids)},
+    )
+    result = dict(cursor.fetchall())
     cursor.close()
     return result
 
 
-def keyword_search_match_all(text_query: str, limit: int) -> list[tuple]:
+def export_snapshot(directory: str, dtype: str = "float32") -> dict:
     """
-    Performs a full-text search on the content of the documents where all the
-    words in the query must be present in the document.
+    Writes the posts, documents and embeddings to a snapshot directory (see
+    `src/snapshot.py`) from a single consistent view of the database.
+
+    Args:
+        directory (str): The snapshot directory, created if needed.
+        dtype (str): "float32", or "float16" for half the size.
+    Returns:
+        dict: The snapshot manifest.
     """
-    query = """
-    SELECT
-        id,
-        RANK () OVER (
-            ORDER BY ts_rank_cd(
-                content_ts_vector,
-                plainto_tsquery('english', %(text_query)s)
-            ) DESC
-        ) AS rank
+    posts_query = f"""
+    SELECT {", ".join(snapshot.POST_FIELDS)}
+    FROM posts
+    ORDER BY id;
+    """
+    documents_query = f"""
+    SELECT {", ".join(snapshot.DOCUMENT_FIELDS)}, embedding
     FROM documents
-    WHERE
-        content_ts_vector @@
-        plainto_tsquery('english', %(text_query)s)
-    ORDER BY rank
-    LIMIT %(limit)s;
+    ORDER BY id;
     """
-    cursor = get_cursor()
-    cursor.execute(query, {"text_query": text_query, "limit": limit})
-    result = cursor.fetchall()
-    cursor.close()
-    return result
+    _, model, dimensions = get_embedding_version(refresh=True)
+    with get_connection() as conn:
+        register_vector(conn)
+        conn.isolation_level = psycopg.IsolationLevel.REPEATABLE_READ
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM documents;")
+            num_documents = cursor.fetchone()[0]
+
+        with snapshot.SnapshotWriter(
+            directory, num_documents, dimensions, dtype
+        ) as writer:
+            writer.metadata["embedding_model"] = model
+            writer.metadata["text_search_config"] = TEXT_SEARCH_CONFIG
+            # Server-side cursors so the tables are never held in memory
+            with conn.cursor(name="export_posts") as cursor:
+                cursor.itersize = 2_000
+                cursor.execute(posts_query)
+                for row in cursor:
+                    writer.add_post(dict(zip(snapshot.POST_FIELDS, row)))
+            with conn.cursor(name="export_documents") as cursor:
+                cursor.itersize = 2_000
+                cursor.execute(documents_query)
+                for *row, embedding in cursor:
+                    writer.add_document(
+                        dict(zip(snapshot.DOCUMENT_FIELDS, row)), embedding
+                    )
+
+    manifest = snapshot.read_manifest(directory)
+    logger.info(
+        f"Exported {manifest['num_posts']} posts and "
+        f"{manifest['num_documents']} documents to {directory}."
+    )
+    return manifest
+
+
+# Column types of the binary COPY in `import_snapshot`
+SNAPSHOT_POST_COLUMNS = {
+    "id": "text",
+    "title": "text",
+    "description": "text",
+    "score": "int4",
+    "upvotes": "int4",
+    "downvotes": "int4",
+    "tag": "text",
+    "num_comments": "int4",
+    "permalink": "text",
+    "content_hash": "text",
+    "created_at": "timestamp",
+    "last_updated_at": "timestamp",
+}
+SNAPSHOT_DOCUMENT_COLUMNS = {
+    "id": "text",
+    "post_id": "text",
+    "chunk_id": "int4",
+    "content": "text",
+    "num_tokens": "int4",
+    "embedding": "vector",
+    # Denormalized from the posts, see `Documents`
+    "post_tag": "text",
+    "post_created_at": "timestamp",
+    "post_score": "int4",
+}
+
+
+def _copy_snapshot(directory: str) -> tuple[int, int]:
+    """
+    COPYs a snapshot into staging tables, then inserts the rows that are not
+    in the database yet. Returns the number of posts and documents inserted.
+    """
+    embeddings = snapshot.load_embeddings(directory)
+    post_columns = ", ".join(SNAPSHOT_POST_COLUMNS)
+    document_columns = ", ".join(SNAPSHOT_DOCUMENT_COLUMNS)
+    post_filters = {}
+
+    with get_connection() as conn:
+        register_vector(conn)
+        with conn.cursor() as cursor:
+            # Staging tables, so that rows already in the database are skipped
+            # instead of failing the COPY
+            cursor.execute(
+                """
+                CREATE TEMP TABLE posts_snapshot (LIKE posts) ON COMMIT DROP;
+                CREATE TEMP TABLE documents_snapshot (LIKE documents) ON COMMIT DROP;
+                """
+            )
+            with cursor.copy(
+                f"COPY posts_snapshot ({post_columns}) FROM STDIN WITH (FORMAT BINARY)"
+            ) as copy:
+                copy.set_types(list(SNAPSHOT_POST_COLUMNS.values()))
+                for post in snapshot.iter_posts(directory):
+                    post_filters[post["id"]] = (
+                        post["tag"],
+                        post["created_at"],
+                        post["score"],
+                    )
+                    copy.write_row([post[c] for c in SNAPSHOT_POST_COLUMNS])
+
+            with cursor.copy(
+                f"COPY documents_snapshot ({document_columns}) "
+                "FROM STDIN WITH (FORMAT BINARY)"
+            ) as copy:
+                copy.set_types(list(SNAPSHOT_DOCUMENT_COLUMNS.values()))
+                for row, document in enumerate(snapshot.iter_documents(directory)):
+                    document["embedding"] = (
+                        embeddings[row] if document["has_embedding"] else None
+                    )
+                    (
+                        document["post_tag"],
+                        document["post_created_at"],
+                        document["post_score"],
+                    ) = post_filters[document["post_id"]]
+                    copy.write_row([document[c] for c in SNAPSHOT_DOCUMENT_COLUMNS])
+
+            cursor.execute(
+                f"""
+                INSERT INTO posts ({post_columns})
+                SELECT {post_columns} FROM posts_snapshot
+                ON CONFLICT (id) DO NOTHING;
+                """
+            )
+            num_posts = cursor.rowcount
+            # No conflict target: the primary key of a partitioned
+            # `documents` is (id, post_created_at)
+            cursor.execute(
+                f"""
+                INSERT INTO documents ({document_columns})
+                SELECT {document_columns} FROM documents_snapshot
+                ON CONFLICT DO NOTHING;
+                """
+            )
+            num_documents = cursor.rowcount
 
+    return num_posts, num_documents
 
-def hybrid_search(text_query: str, limit: int) -> list[tuple]:
+
+def import_snapshot(directory: str, rebuild_index: bool = True) -> dict:
     """
-    Performs a hybrid search. Hybrid search combines:
-        - vector search
-        - full-text search for exact matches
-        - full-text search for partial matches
+    Bulk-loads a snapshot into the database with COPY, without any OpenAI
+    call. Posts and documents already in the database are kept as they are.
+    The search filter columns, token counts and post features are filled in
+    as by the ingest.
 
-    using both full-text search and vector search.
+    Args:
+        directory (str): The snapshot directory, see `export_snapshot`.
+        rebuild_index (bool): Drop the HNSW index during the load and build it
+            again afterwards, much faster than updating it row by row when
+            loading into an empty database.
+    Returns:
+        dict: The number of posts and documents inserted.
     """
-    keyword_results = keyword_search(text_query, limit)
-    vector_results = vector_search(text_query, limit)
-    exact_keyword_results = keyword_search_match_all(text_query, limit)
+    manifest = snapshot.read_manifest(directory)
+    _, model, dimensions = get_embedding_version(refresh=True)
+    if manifest["dimensions"] != dimensions:
+        raise ValueError(
+            f"The snapshot has {manifest['dimensions']}-dimensional embeddings, "
+            f"the database {dimensions}"
+        )
+    if manifest.get("embedding_model", model) != model:
+        raise ValueError(
+            f"The snapshot was embedded with {manifest['embedding_model']}, "
+            f"the database with {model}"
+        )
 
-    # Convert results into a format suitable for use in a SQL query
-    keyword_query = ", ".join([f"('{id}', {rank})" for id, rank in keyword_results])
-    vector_query = ", ".join([f"('{id}', {rank})" for id, rank in vector_results])
-    exact_keyword_query = ", ".join(
-        [f"('{id}', {rank})" for id, rank in exact_keyword_results]
+    if rebuild_index:
+        drop_embedding_index(EMBEDDING_INDEX_MODE)
+    try:
+        num_posts, num_documents = _copy_snapshot(directory)
+    finally:
+        if rebuild_index:
+            create_embedding_index(EMBEDDING_INDEX_MODE, dimensions=dimensions)
+
+    # Snapshots converted from older dumps may have no token counts
+    migrate_document_token_counts()
+    refresh_post_features()
+
+    logger.info(
+        f"Imported {num_posts} posts and {num_documents} documents from {directory}."
     )
+    return {"posts": num_posts, "documents": num_documents}
 
-    # Address edge case where no results are returned for exact keyword search
-    if len(exact_keyword_query) == 0:
-        exact_keyword_query = "('null', 0)"
-        k_vector, k_fs, k_exact = 60, 60, 60
-    else:
-        k_vector, k_fs, k_exact = 60, 60 * 3, 60
 
-    hybrid_query = f"""
-        WITH vector_search AS (
-            SELECT *
-            FROM (VALUES {vector_query}) AS v(id, rank)
-        ),
-        fulltext_search AS (
-            SELECT *
-            FROM (VALUES {keyword_query}) AS k(id, rank)
-        ),
-        exact_fulltext_search AS (
-            SELECT *
-            FROM (VALUES {exact_keyword_query}) AS k(id, rank)
-            WHERE id != 'null'
-        ),
-        hybrid_search AS (
-            SELECT
-                COALESCE(vector_search.id, fulltext_search.id, exact_fulltext_search.id) AS id,
-                COALESCE(1.0 / (%(k_vector)s + vector_search.rank), 0.0) +
-                COALESCE(1.0 / (%(k_fs)s + fulltext_search.rank), 0.0) +
-                COALESCE(1.0 / (%(k_exact)s + exact_fulltext_search.rank), 0.0) AS score
-            FROM vector_search
-            FULL OUTER JOIN fulltext_search ON vector_search.id = fulltext_search.id
-            FULL OUTER JOIN exact_fulltext_search ON vector_search.id = exact_fulltext_search.id
-            ORDER BY score DESC
-        )
-        SELECT hybrid_search.id, documents.post_id, title, hybrid_search.score, content
-        FROM hybrid_search
-        LEFT JOIN documents ON hybrid_search.id = documents.id
-        LEFT JOIN posts ON documents.post_id = posts.id
-        ORDER BY score DESC
-        LIMIT %(limit)s;
+def create_partial_vector_index(tag: str) -> None:
     """
+    Creates an HNSW index restricted to the documents of one tag. Worth it for
+    frequently filtered tags: the planner uses the smaller partial index and
+    every candidate it returns already satisfies the filter.
+    """
+    # DDL statements cannot take bind parameters, hence psycopg.sql composition
+    index_name = "embedding_" + "".join(c if c.isalnum() else "_" for c in tag.lower()) + "_idx"
+    expression, opclass, _ = _embedding_index_expression(EMBEDDING_INDEX_MODE)
+    query = sql.SQL(
+        """
+    CREATE INDEX IF NOT EXISTS {index_name} ON documents
+    USING hnsw ({expression} {opclass})
+    WITH (m = {m}, ef_construction = {ef_construction})
+    WHERE post_tag = {tag};
+    """
+    ).format(
+        index_name=sql.Identifier(index_name),
+        expression=sql.SQL(expression),
+        opclass=sql.SQL(opclass),
+        m=sql.Literal(HNSW_M),
+        ef_construction=sql.Literal(HNSW_EF_CONSTRUCTION),
+        tag=sql.Literal(tag),
+    )
+    cursor = get_cursor()
+    cursor.execute(query)
+    cursor.connection.commit()
+    cursor.close()
+
+
+PARTITION_NAME_PATTERN = re.compile(r"documents_p(\d{4})(?:_(\d{2}))?")
+
+
+def partition_bounds(when: datetime, period: str) -> tuple[datetime, datetime]:
+    """Returns the [start, end) range of the partition period containing `when`."""
+    if period == "year":
+        return datetime(when.year, 1, 1), datetime(when.year + 1, 1, 1)
+    if period == "month":
+        return (
+            datetime(when.year, when.month, 1),
+            datetime(when.year + when.month // 12, when.month % 12 + 1, 1),
+        )
+    raise ValueError(f"Unknown partitioning period: {period}")
+
+
+def partition_name(start: datetime, period: str) -> str:
+    """Returns the table name of a partition, e.g. documents_p2024_03."""
+    return f"documents_p{start:%Y}" if period == "year" else f"documents_p{start:%Y_%m}"
+
+
+def parse_partition_name(name: str) -> tuple[datetime, datetime]:
+    """Returns the [start, end) range of a partition from its table name."""
+    match = PARTITION_NAME_PATTERN.fullmatch(name)
+    if match is None:
+        raise ValueError(f"Not a documents partition: {name}")
+    year, month = match.groups()
+    if month is None:
+        return partition_bounds(datetime(int(year), 1, 1), "year")
+    return partition_bounds(datetime(int(year), int(month), 1), "month")
+
 
+def partition_ranges(
+    first: datetime, last: datetime, period: str
+) -> list[tuple[str, datetime, datetime]]:
+    """Returns the name, start and end of the partitions covering [first, last]."""
+    ranges = []
+    start, end = partition_bounds(first, period)
+    while start <= last:
+        ranges.append((partition_name(start, period), start, end))
+        start, end = partition_bounds(end, period)
+    return ranges
+
+
+def is_documents_partitioned() -> bool:
+    """Returns whether `documents` is range-partitioned."""
     cursor = get_cursor()
     cursor.execute(
-        hybrid_query,
-        {"k_vector": k_vector, "k_fs": k_fs, "k_exact": k_exact, "limit": limit},
+        """
+        SELECT EXISTS (
+            SELECT 1 FROM pg_partitioned_table
+            WHERE partrelid = 'documents'::regclass
+        );
+        """
     )
-    result = cursor.fetchall()
+    partitioned = cursor.fetchone()[0]
     cursor.close()
-    return result
+    return partitioned
+
+
+def _documents_partitions(cursor) -> list[str]:
+    """Returns the names of the partitions attached to `documents`."""
+    cursor.execute(
+        """
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'documents'::regclass
+        ORDER BY c.relname;
+        """
+    )
+    return [name for (name,) in cursor.fetchall()]
+
+
+def _document_columns(cursor, table: str) -> sql.Composable:
+    """Returns the columns of a documents table, except the generated ones."""
+    cursor.execute(
+        """
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = current_schema()
+        AND table_name = %s
+        AND is_generated = 'NEVER'
+        ORDER BY ordinal_position;
+        """,
+        (table,),
+    )
+    return sql.SQL(", ").join(sql.Identifier(c) for (c,) in cursor.fetchall())
+
+
+def _attach_partition(cursor, name: str, start: datetime, end: datetime) -> None:
+    """
+    Moves the rows of the default partition within [start, end) to the table
+    `name` and attaches it to `documents`, which builds its missing indexes.
+    """
+    cursor.execute(
+        sql.SQL(
+            """
+        WITH moved AS (
+            DELETE FROM documents_default
+            WHERE post_created_at >= {start} AND post_created_at < {end}
+            RETURNING {columns}
+        )
+        INSERT INTO {name} ({columns}) SELECT {columns} FROM moved;
+
+        ALTER TABLE documents ATTACH PARTITION {name}
+        FOR VALUES FROM ({start}) TO ({end});
+        """
+        ).format(
+            name=sql.Identifier(name),
+            columns=_document_columns(cursor, "documents"),
+            start=sql.Literal(start),
+            end=sql.Literal(end),
+        )
+    )
+
+
+def _set_table_tablespace(cursor, name: str, tablespace: str) -> None:
+    """Moves a table and its indexes to a tablespace."""
+    cursor.execute(
+        "SELECT indexname FROM pg_indexes "
+        "WHERE schemaname = current_schema() AND tablename = %s;",
+        (name,),
+    )
+    indexes = [index for (index,) in cursor.fetchall()]
+    cursor.execute(
+        sql.SQL("ALTER TABLE {name} SET TABLESPACE {tablespace};").format(
+            name=sql.Identifier(name), tablespace=sql.Identifier(tablespace)
+        )
+    )
+    for index in indexes:
+        cursor.execute(
+            sql.SQL("ALTER INDEX {index} SET TABLESPACE {tablespace};").format(
+                index=sql.Identifier(index), tablespace=sql.Identifier(tablespace)
+            )
+        )
+
+
+def migrate_documents_partitioning(period: str = DOCUMENTS_PARTITIONING) -> list[str]:
+    """
+    Converts `documents` into a table range-partitioned on `post_created_at`,
+    with one partition per period from the oldest document to the next period
+    and a default partition for the documents outside of them. Rewrites the
+    table and rebuilds every index: run it during a maintenance window, then
+    restart the app with the same DOCUMENTS_PARTITIONING.
+
+    The primary key becomes (id, post_created_at), as the partition key must
+    be part of it. Document ids stay unique: all the chunks of a post share
+    its creation date.
+
+    Returns:
+        list[str]: The names of the partitions, without the default one.
+    """
+    if period not in DOCUMENTS_PARTITION_PERIODS:
+        raise ValueError(f"Unknown partitioning period: {period}")
+    if is_documents_partitioned():
+        raise ValueError("documents is already partitioned")
+
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            # The partition key cannot be NULL
+            cursor.execute(
+                """
+                UPDATE documents
+                SET post_created_at = posts.created_at
+                FROM posts
+                WHERE documents.post_id = posts.id
+                AND documents.post_created_at IS NULL;
+                """
+            )
+            cursor.execute(
+                "SELECT min(post_created_at), max(post_created_at) FROM documents;"
+            )
+            first, last = cursor.fetchone()
+            _, next_period = partition_bounds(now, period)
+            ranges = partition_ranges(
+                min(first or now, now), max(last or now, next_period), period
+            )
+
+            columns = _document_columns(cursor, "documents")
+            cursor.execute(
+                """
+                ALTER TABLE documents RENAME TO documents_unpartitioned;
+                CREATE TABLE documents (
+                    LIKE documents_unpartitioned INCLUDING DEFAULTS INCLUDING GENERATED
+                ) PARTITION BY RANGE (post_created_at);
+                CREATE TABLE documents_default PARTITION OF documents DEFAULT;
+                """
+            )
+            for name, start, end in ranges:
+                cursor.execute(
+                    sql.SQL(
+                        "CREATE TABLE {name} PARTITION OF documents "
+                        "FOR VALUES FROM ({start}) TO ({end});"
+                    ).format(
+                        name=sql.Identifier(name),
+                        start=sql.Literal(start),
+                        end=sql.Literal(end),
+                    )
+                )
+            cursor.execute(
+                sql.SQL(
+                    """
+                INSERT INTO documents ({columns})
+                SELECT {columns} FROM documents_unpartitioned;
+                DROP TABLE documents_unpartitioned;
+                """
+                ).format(columns=columns)
+            )
+            # Created on the parent, hence on every partition. The index names
+            # are free again once the old table is dropped.
+            cursor.execute(
+                """
+                ALTER TABLE documents ADD PRIMARY KEY (id, post_created_at);
+                ALTER TABLE documents ADD FOREIGN KEY (post_id)
+                REFERENCES posts (id) ON DELETE CASCADE;
+
+                CREATE INDEX content_ts_vector_idx ON documents USING GIN (content_ts_vector);
+                CREATE INDEX documents_post_tag_idx ON documents (post_tag);
+                CREATE INDEX documents_post_created_at_idx ON documents (post_created_at);
+                CREATE INDEX documents_post_score_idx ON documents (post_score);
+                """
+            )
+
+    create_embedding_index(EMBEDDING_INDEX_MODE)
+    logger.info(f"Partitioned documents into {len(ranges)} partitions by {period}.")
+    return [name for name, _, _ in ranges]
+
+
+def create_documents_partition(
+    when: datetime, period: str = DOCUMENTS_PARTITIONING
+) -> str:
+    """
+    Creates the partition of the period containing `when`, if it does not
+    exist, moving its documents out of the default partition. Run ahead of a
+    new period so that its documents are indexed with their partition.
+
+    Returns:
+        str: The name of the partition. An archived partition is left
+            detached, see `archive_documents_partition`.
+    """
+    start, end = partition_bounds(when, period)
+    name = partition_name(start, period)
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT to_regclass(%s) IS NOT NULL;", (name,))
+            if cursor.fetchone()[0]:
+                return name
+            cursor.execute(
+                sql.SQL(
+                    "CREATE TABLE {name} "
+                    "(LIKE documents INCLUDING DEFAULTS INCLUDING GENERATED);"
+                ).format(name=sql.Identifier(name))
+            )
+            _attach_partition(cursor, name, start, end)
+    logger.info(f"Created documents partition {name}.")
+    return name
+
+
+def list_documents_partitions() -> list[dict]:
+    """
+    Returns the attached and archived partitions of `documents`, with their
+    estimated number of rows, size on disk (indexes included) and tablespace.
+    """
+    cursor = get_cursor()
+    cursor.execute(
+        """
+        SELECT
+            c.relname,
+            i.inhrelid IS NOT NULL,
+            c.reltuples::bigint,
+            pg_total_relation_size(c.oid),
+            coalesce(t.spcname, 'pg_default')
+        FROM pg_class c
+        LEFT JOIN pg_inherits i
+            ON i.inhrelid = c.oid AND i.inhparent = 'documents'::regclass
+        LEFT JOIN pg_tablespace t ON t.oid = c.reltablespace
+        WHERE c.relkind = 'r'
+        AND c.relnamespace = current_schema()::regnamespace
+        AND (i.inhrelid IS NOT NULL OR c.relname ~ '^documents_p[0-9]{4}(_[0-9]{2})?$')
+        ORDER BY c.relname;
+        """
+    )
+    partitions = [
+        {
+            "name": name,
+            "attached": attached,
+            "rows": rows,
+            "bytes": size,
+            "tablespace": tablespace,
+        }
+        for name, attached, rows, size, tablespace in cursor.fetchall()
+    ]
+    cursor.close()
+    return partitions
+
+
+def archive_documents_partition(name: str, tablespace: str | None = None) -> None:
+    """
+    Moves a cold partition out of the searches: it is detached from
+    `documents`, its HNSW indexes are dropped and, optionally, the table is
+    moved to a cheaper tablespace. Its documents are kept, still deleted with
+    their post, and no longer retrieved. `restore_documents_partition` brings
+    it back.
+
+    Documents of the period ingested after the archival (e.g. a modified old
+    post) go to the default partition and are searched as usual.
+    """
+    parse_partition_name(name)
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                sql.SQL("ALTER TABLE documents DETACH PARTITION {name};").format(
+                    name=sql.Identifier(name)
+                )
+            )
+            cursor.execute(
+                "SELECT indexname FROM pg_indexes "
+                "WHERE schemaname = current_schema() AND tablename = %s "
+                "AND indexdef LIKE '%% USING hnsw %%';",
+                (name,),
+            )
+            for (index,) in cursor.fetchall():
+                cursor.execute(
+                    sql.SQL("DROP INDEX {index};").format(index=sql.Identifier(index))
+                )
+            if tablespace:
+                _set_table_tablespace(cursor, name, tablespace)
+    logger.info(f"Archived documents partition {name}.")
+
+
+def restore_documents_partition(name: str) -> None:
+    """
+    Attaches an archived partition to `documents` again, with the documents
+    of its period ingested in the meantime. Its HNSW index is rebuilt on
+    attach, which takes a while for a large partition.
+    """
+    start, end = parse_partition_name(name)
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            _set_table_tablespace(cursor, name, "pg_default")
+            _attach_partition(cursor, name, start, end)
+    logger.info(f"Restored documents partition {name}.")
+
+
+_archived_ranges = None
+_archived_ranges_read_at = 0.0
+_archived_ranges_lock = threading.Lock()
+
+
+def get_archived_ranges() -> list[tuple[datetime, datetime]]:
+    """
+    Returns the [start, end) date ranges of the archived partitions, re-read
+    from the database every ARCHIVED_PARTITIONS_REFRESH_SECONDS. Always empty
+    without DOCUMENTS_PARTITIONING.
+    """
+    global _archived_ranges, _archived_ranges_read_at
+    if DOCUMENTS_PARTITIONING == "none":
+        return []
+    with _archived_ranges_lock:
+        if (
+            _archived_ranges is None
+            or time.monotonic() - _archived_ranges_read_at
+            > ARCHIVED_PARTITIONS_REFRESH_SECONDS
+        ):
+            _archived_ranges = sorted(
+                parse_partition_name(p["name"])
+                for p in list_documents_partitions()
+                if not p["attached"]
+            )
+            _archived_ranges_read_at = time.monotonic()
+    return _archived_ranges
+
+
+def check_archived_filters(
+    filters: dict | None, archived: list[tuple[datetime, datetime]] | None = None
+) -> None:
+    """
+    Archived partitions are not searched (see `archive_documents_partition`).
+    Rather than silently missing their posts, searches whose date filters
+    overlap an archived period are rejected. Searches without date filters
+    are not checked.
+
+    Args:
+        filters (dict, optional): Parsed filters, see `parse_filters`.
+        archived (list, optional): [start, end) ranges of the archived
+            partitions. Defaults to `get_archived_ranges()`.
+    Raises:
+        ValueError: If the date filters overlap an archived period.
+    """
+    filters = filters or {}
+    if "created_after" not in filters and "created_before" not in filters:
+        return
+    # post_created_at is stored as naive UTC
+    after, before = (
+        value.astimezone(timezone.utc).replace(tzinfo=None)
+        if value.tzinfo
+        else value
+        for value in (
+            filters.get("created_after", datetime.min),
+            filters.get("created_before", datetime.max),
+        )
+    )
+    for start, end in get_archived_ranges() if archived is None else archived:
+        if after < end and start < before:
+            raise ValueError(
+                f"posts created from {start.date()} to {end.date()} are archived "
+                "and not searched"
+            )
+
+
+def _initial_embedding_version() -> EmbeddingVersions:
+    """Returns the version of the embeddings written before any migration."""
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return EmbeddingVersions(
+        model=rag.EMBEDDING_MODEL_NAME,
+        dimensions=EMBEDDING_DIMENSIONS,
+        status="active",
+        created_at=now,
+        activated_at=now,
+    )
+
+
+def list_embedding_versions() -> list[dict]:
+    """
+    Returns the embedding versions, with the number of documents left to
+    embed for the backfilling one.
+    """
+    with Session(get_engine()) as session:
+        if not session.execute(
+            text("SELECT to_regclass('embedding_versions') IS NOT NULL;")
+        ).scalar():
+            return []
+        versions = [
+            {
+                "id": v.id,
+                "model": v.model,
+                "dimensions": v.dimensions,
+                "status": v.status,
+                "created_at": v.created_at.isoformat(),
+                "activated_at": v.activated_at.isoformat() if v.activated_at else None,
+            }
+            for v in session.query(EmbeddingVersions).order_by(EmbeddingVersions.id)
+        ]
+        for version in versions:
+            if version["status"] == "backfilling":
+                version["pending"] = session.execute(
+                    text("SELECT count(*) FROM documents WHERE embedding_next IS NULL;")
+                ).scalar()
+    return versions
+
+
+def _backfilling_version() -> EmbeddingVersions:
+    with Session(get_engine()) as session:
+        version = (
+            session.query(EmbeddingVersions).filter_by(status="backfilling").first()
+        )
+    if version is None:
+        raise ValueError("No embedding migration in progress")
+    return version
+
+
+def start_embedding_migration(model: str, dimensions: int) -> int:
+    """
+    Starts migrating the documents to another embedding model (or number of
+    dimensions) without downtime:
+        1. start_embedding_migration(model, dimensions): adds the empty
+           `documents.embedding_next` column. From then on, the ingest writes
+           the embeddings of both versions.
+        2. backfill_embeddings(): embeds the existing documents in the
+           background, while the searches keep using `documents.embedding`.
+        3. cutover_embedding_version(): swaps the columns atomically. The
+           app embeds the questions with the new model within
+           EMBEDDING_VERSION_REFRESH_SECONDS.
+        4. retire_previous_embedding(): drops the previous embeddings, once
+           the new version is validated.
+
+    Returns:
+        int: The id of the new version.
+    """
+    archived = [p["name"] for p in list_documents_partitions() if not p["attached"]]
+    if archived:
+        raise ValueError(f"Restore the archived partitions first: {archived}")
+
+    with Session(get_engine()) as session:
+        # Databases created before the versions
+        EmbeddingVersions.__table__.create(session.connection(), checkfirst=True)
+        if session.query(EmbeddingVersions).filter_by(status="active").first() is None:
+            session.add(_initial_embedding_version())
+        if session.query(EmbeddingVersions).filter_by(status="backfilling").first():
+            raise ValueError("An embedding migration is already in progress")
+
+        session.execute(
+            text(
+                "ALTER TABLE documents "
+                f"ADD COLUMN embedding_next vector({int(dimensions)});"
+            )
+        )
+        version = EmbeddingVersions(
+            model=model,
+            dimensions=dimensions,
+            status="backfilling",
+            created_at=datetime.now(timezone.utc).replace(tzinfo=None),
+        )
+        session.add(version)
+        session.commit()
+        logger.info(f"Started the migration to {model} ({dimensions} dimensions).")
+        return version.id
+
+
+def backfill_embeddings(batch_size: int = rag.EMBEDDING_BATCH_SIZE) -> int:
+    """
+    Embeds the documents that have no embedding of the backfilling version
+    yet, `batch_size` documents per request. The requests are throttled by
+    `rag.ThrottledOpenAI` and each batch is committed, so the backfill can be
+    stopped and resumed at any time.
+
+    Returns:
+        int: The number of documents embedded.
+    """
+    version = _backfilling_version()
+    client = rag.get_llm_client()
+    total = 0
+    cursor = get_cursor()
+    while True:
+        cursor.execute(
+            """
+            SELECT id, content FROM documents
+            WHERE embedding_next IS NULL
+            LIMIT %(n)s;
+            """,
+            {"n": batch_size},
+        )
+        rows = cursor.fetchall()
+        # Nothing is locked while the batch is embedded
+        cursor.connection.commit()
+        if len(rows) == 0:
+            break
+        embeddings = client.get_embeddings(
+            [content for _, content in rows],
+            version.dimensions,
+            batch_size=batch_size,
+            model=version.model,
+        )
+        cursor.executemany(
+            "UPDATE documents SET embedding_next = %s::vector WHERE id = %s;",
+            [(_vector_literal(e), id) for (id, _), e in zip(rows, embeddings)],
+        )
+        # The column may belong to another migration if this one was aborted
+        # while the batch was embedded
+        cursor.execute(
+            "SELECT id FROM embedding_versions WHERE status = 'backfilling';"
+        )
+        current = cursor.fetchone()
+        if current is None or current[0] != version.id:
+            cursor.connection.rollback()
+            raise ValueError("The embedding migration was aborted")
+        cursor.connection.commit()
+        total += len(rows)
+        telemetry.increment("embeddings_backfilled", len(rows))
+        logger.info(f"Backfilled {total} embeddings with {version.model}.")
+    cursor.close()
+    return total
+
+
+def cutover_embedding_version(lock_timeout_ms: int = 5_000) -> None:
+    """
+    Makes the backfilled version the active one. Its HNSW index is built
+    first, concurrently, then the embedding columns and their indexes are
+    renamed in a single transaction: the searches see either version, never a
+    mix of both. The old embeddings are kept in `documents.embedding_previous`.
+
+    The swap waits at most `lock_timeout_ms` for the running searches and
+    ingests to release `documents`, and can be retried if it times out.
+    """
+    version = _backfilling_version()
+    cursor = get_cursor()
+    cursor.execute("SELECT count(*) FROM documents WHERE embedding_next IS NULL;")
+    pending = cursor.fetchone()[0]
+    cursor.close()
+    if pending:
+        raise ValueError(f"{pending} documents are not backfilled yet")
+
+    create_embedding_index(
+        EMBEDDING_INDEX_MODE,
+        concurrently=True,
+        column="embedding_next",
+        dimensions=version.dimensions,
+    )
+
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT set_config('lock_timeout', %s, true);",
+                (f"{lock_timeout_ms}ms",),
+            )
+            cursor.execute("LOCK TABLE documents IN ACCESS EXCLUSIVE MODE;")
+            # Documents inserted by an ingest without dual-write
+            cursor.execute(
+                "SELECT count(*) FROM documents WHERE embedding_next IS NULL;"
+            )
+            pending = cursor.fetchone()[0]
+            if pending:
+                raise ValueError(f"{pending} documents are not backfilled yet")
+
+            cursor.execute(
+                """
+                ALTER TABLE documents DROP COLUMN IF EXISTS embedding_previous;
+                ALTER TABLE documents RENAME COLUMN embedding TO embedding_previous;
+                ALTER TABLE documents RENAME COLUMN embedding_next TO embedding;
+                """
+            )
+            for mode in EMBEDDING_INDEX_NAMES:
+                # Indexes follow their column, their names are kept in line
+                for old, new in (
+                    ("embedding", "embedding_previous"),
+                    ("embedding_next", "embedding"),
+                ):
+                    _rename_embedding_index(
+                        cursor,
+                        _embedding_index_name(mode, old),
+                        _embedding_index_name(mode, new),
+                    )
+            cursor.execute(
+                """
+                UPDATE embedding_versions SET status = 'retired' WHERE status = 'previous';
+                UPDATE embedding_versions SET status = 'previous' WHERE status = 'active';
+                UPDATE embedding_versions
+                SET status = 'active', activated_at = now() AT TIME ZONE 'utc'
+                WHERE status = 'backfilling';
+                """
+            )
+    logger.info(
+        f"Embeddings switched to {version.model} ({version.dimensions} dimensions)."
+    )
+
+
+def _rename_embedding_index(cursor, old: str, new: str) -> None:
+    """
+    Renames an embedding index, if it exists, and the indexes of the
+    partitions attached to it, which are named after it (see
+    `_create_partitioned_index_concurrently`). The next migration would
+    otherwise find the partition indexes of this one under the names it
+    builds its own with.
+    """
+    cursor.execute(
+        """
+        SELECT child.relname, partition.relname
+        FROM pg_inherits i
+        JOIN pg_class child ON child.oid = i.inhrelid
+        JOIN pg_index x ON x.indexrelid = child.oid
+        JOIN pg_class partition ON partition.oid = x.indrelid
+        WHERE i.inhparent = to_regclass(%s);
+        """,
+        (old,),
+    )
+    for child, partition in cursor.fetchall():
+        cursor.execute(
+            sql.SQL("ALTER INDEX {old} RENAME TO {new};").format(
+                old=sql.Identifier(child), new=sql.Identifier(f"{partition}_{new}")
+            )
+        )
+    cursor.execute(
+        sql.SQL("ALTER INDEX IF EXISTS {old} RENAME TO {new};").format(
+            old=sql.Identifier(old), new=sql.Identifier(new)
+        )
+    )
+
+
+def retire_previous_embedding() -> None:
+    """
+    Drops the embeddings of the previous version, and the HNSW indexes on
+    them. The disk space is reclaimed as the rows are rewritten.
+    """
+    with Session(get_engine()) as session:
+        session.execute(
+            text(
+                """
+            ALTER TABLE documents DROP COLUMN IF EXISTS embedding_previous;
+            UPDATE embedding_versions SET status = 'retired' WHERE status = 'previous';
+            """
+            )
+        )
+        session.commit()
+
+
+def abort_embedding_migration() -> None:
+    """Drops the embeddings of the backfilling version, keeping the active one."""
+    with Session(get_engine()) as session:
+        session.execute(
+            text(
+                """
+            ALTER TABLE documents DROP COLUMN IF EXISTS embedding_next;
+            UPDATE embedding_versions SET status = 'retired' WHERE status = 'backfilling';
+            """
+            )
+        )
+        session.commit()
+
+
+_permalink_cache = None
+_permalink_cache_lock = threading.Lock()
+
+
+def get_permalink_cache() -> PermalinkCache:
+    """
+    Returns the process-wide permalink cache. It is warmed on first use with
+    the permalinks of the newest PERMALINK_CACHE_SIZE posts, then kept up to
+    date by the posts inserted or ranked in this process.
+    """
+    global _permalink_cache
+    with _permalink_cache_lock:
+        if _permalink_cache is None:
+            cache = PermalinkCache(PERMALINK_CACHE_SIZE)
+            with Session(get_engine()) as session:
+                rows = (
+                    session.query(RedditPosts.id, RedditPosts.permalink)
+                    .order_by(RedditPosts.created_at.desc())
+                    .limit(PERMALINK_CACHE_SIZE)
+                    .all()
+                )
+            # Oldest first, so that the newest posts are evicted last
+            cache.update({id: permalink for id, permalink in reversed(rows)})
+            _permalink_cache = cache
+    return _permalink_cache
+
+
+def get_posts_url(ids: list[str]) -> dict[str, str]:
+    """
+    Returns the permalinks of the Reddit posts with the given ids. Ids missing
+    from the permalink cache are read with a query on the two columns.
+    """
+    cache = get_permalink_cache()
+    urls, missing = cache.get_many(ids)
+    telemetry.increment("permalink_cache_hits", len(urls))
+    telemetry.increment("permalink_cache_misses", len(missing))
+    if missing:
+        with Session(get_engine()) as session:
+            rows = (
+                session.query(RedditPosts.id, RedditPosts.permalink)
+                .filter(RedditPosts.id.in_(missing))
+                .all()
+            )
+        fetched = {id: permalink for id, permalink in rows}
+        cache.update(fetched)
+        urls.update(fetched)
+    return urls
+
+
+def parse_filters(filters: dict | None) -> dict:
+    """
+    Validates the search filters received from the API and converts them to
+    the types expected by the search functions.
+
+    Supported filters:
+        - tag (str): The post flair, e.g. "Career".
+        - created_after (str | datetime): ISO date, inclusive lower bound.
+        - created_before (str | datetime): ISO date, exclusive upper bound.
+        - min_score (int): The minimum post score.
+
+    Raises:
+        ValueError: If a filter is unknown or has an invalid value.
+    """
+    if not filters:
+        return {}
+    if not isinstance(filters, dict):
+        raise ValueError("filters must be an object")
+
+    unknown = set(filters) - set(SEARCH_FILTERS)
+    if unknown:
+        raise ValueError(f"Unknown filters: {sorted(unknown)}")
+
+    out = {}
+    for key, value in filters.items():
+        if value is None:
+            continue
+        if key == "tag":
+            if not isinstance(value, str):
+                raise ValueError("tag must be a string")
+            out[key] = value
+        elif key in ("created_after", "created_before"):
+            if isinstance(value, datetime):
+                out[key] = value
+            elif isinstance(value, str):
+                out[key] = datetime.fromisoformat(value)
+            else:
+                raise ValueError(f"{key} must be an ISO date string")
+        elif key == "min_score":
+            if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+                raise ValueError("min_score must be an integer")
+            try:
+                out[key] = int(value)
+            except OverflowError:
+                raise ValueError("min_score must be an integer") from None
+    return out
+
+
+def parse_fusion(fusion: dict | None) -> dict:
+    """
+    Validates the fusion parameters received from the API. The keys are those
+    of `FUSION_PARAMS`, and missing keys keep their configured value.
+
+    Raises:
+        ValueError: If a parameter is unknown or has an invalid value.
+    """
+    if not fusion:
+        return {}
+    if not isinstance(fusion, dict):
+        raise ValueError("fusion must be an object")
+
+    unknown = set(fusion) - set(FUSION_PARAMS)
+    if unknown:
+        raise ValueError(f"Unknown fusion parameters: {sorted(unknown)}")
+
+    out = {}
+    for key, value in fusion.items():
+        if value is None:
+            continue
+        if key == "method":
+            if value not in FUSION_METHODS:
+                raise ValueError(f"method must be one of {list(FUSION_METHODS)}")
+            out[key] = value
+        elif key.endswith("_depth"):
+            try:
+                out[key] = int(value)
+            except OverflowError:
+                raise ValueError(f"{key} must be a finite number") from None
+            # The HNSW index returns at most `hnsw.ef_search` rows, which
+            # `default_ef_search` raises to the depth up to the pgvector maximum
+            max_depth = FUSION_MAX_DEPTH
+            if key == "vector_depth":
+                max_depth = min(max_depth, HNSW_MAX_EF_SEARCH)
+            if not 0 <= out[key] <= max_depth:
+                raise ValueError(f"{key} must be between 0 and {max_depth}")
+        else:
+            try:
+                out[key] = float(value)
+            except OverflowError:
+                raise ValueError(f"{key} must be a finite number") from None
+            if not math.isfinite(out[key]):
+                raise ValueError(f"{key} must be a finite number")
+            if out[key] < 0 or (key == "rrf_k" and out[key] == 0):
+                raise ValueError(f"{key} must be positive")
+    return out
+
+
+def _filter_conditions(filters: dict | None) -> tuple[list[str], dict]:
+    """
+    Returns the SQL conditions on the denormalized `documents` columns and the
+    query parameters for the given (parsed) filters.
+    """
+    filters = filters or {}
+    conditions = []
+    if "tag" in filters:
+        conditions.append("post_tag = %(filter_tag)s")
+    if "created_after" in filters:
+        conditions.append("post_created_at >= %(filter_created_after)s")
+    if "created_before" in filters:
+        conditions.append("post_created_at < %(filter_created_before)s")
+    if "min_score" in filters:
+        conditions.append("post_score >= %(filter_min_score)s")
+
+    params = {f"filter_{key}": value for key, value in filters.items()}
+    return conditions, params
+
+
+class EmbeddingVersionChanged(RuntimeError):
+    """The query was embedded with another version than the active one."""
+
+
+_embedding_version = None
+_embedding_version_read_at = 0.0
+_embedding_version_lock = threading.Lock()
+
+
+def get_embedding_version(refresh: bool = False) -> tuple[int | None, str, int]:
+    """
+    Returns the id, model and dimensions of the active embedding version, the
+    one the questions must be embedded with. It is re-read from the database
+    every EMBEDDING_VERSION_REFRESH_SECONDS, or right away with `refresh`.
+    Databases without versions use OPENAI_EMBEDDING_MODEL and a None id.
+    """
+    global _embedding_version, _embedding_version_read_at
+    with _embedding_version_lock:
+        if (
+            refresh
+            or _embedding_version is None
+            or time.monotonic() - _embedding_version_read_at
+            > EMBEDDING_VERSION_REFRESH_SECONDS
+        ):
+            cursor = get_cursor()
+            cursor.execute("SELECT to_regclass('embedding_versions') IS NOT NULL;")
+            row = None
+            if cursor.fetchone()[0]:
+                cursor.execute(
+                    "SELECT id, model, dimensions FROM embedding_versions "
+                    "WHERE status = 'active';"
+                )
+                row = cursor.fetchone()
+            cursor.close()
+            _embedding_version = (
+                tuple(row)
+                if row
+                else (None, rag.EMBEDDING_MODEL_NAME, EMBEDDING_DIMENSIONS)
+            )
+            _embedding_version_read_at = time.monotonic()
+    return _embedding_version
+
+
+def check_embedding_version(cursor, embedding_version: int | None) -> None:
+    """
+    Raises EmbeddingVersionChanged if `embedding_version` is no longer the
+    active version. `documents` is locked for the rest of the transaction of
+    the cursor first, so that no cutover can happen before the search is
+    done. Nothing is checked for a None version. On a mismatch the
+    transaction is rolled back, releasing the lock, and the connection of the
+    cursor is closed.
+    """
+    if embedding_version is None:
+        return
+    cursor.execute("LOCK TABLE documents IN ACCESS SHARE MODE;")
+    cursor.execute("SELECT id FROM embedding_versions WHERE status = 'active';")
+    row = cursor.fetchone()
+    if row is None or row[0] != embedding_version:
+        cursor.connection.rollback()
+        cursor.connection.close()
+        raise EmbeddingVersionChanged(
+            f"Embedding version {embedding_version} is no longer active"
+        )
+
+
+def default_ef_search(num_candidates: int) -> int:
+    """
+    Returns the `hnsw.ef_search` of a query asking the HNSW index for
+    `num_candidates` rows, when the caller sets none. Without iterative scans
+    the index returns at most `ef_search` rows, e.g. 40 of the 80 candidates
+    of a quantized search of 20 documents with the pgvector default. Capped at
+    the pgvector maximum.
+    """
+    return min(
+        max(HNSW_EF_SEARCH or HNSW_DEFAULT_EF_SEARCH, num_candidates),
+        HNSW_MAX_EF_SEARCH,
+    )
+
+
+def set_hnsw_options(
+    cursor, ef_search: int | None = None, iterative_scan: str | None = None
+) -> None:
+    """
+    Sets the HNSW query options for the current transaction of the cursor.
+    Options left as None keep the session/server setting.
+    """
+    if ef_search is not None:
+        cursor.execute(
+            "SELECT set_config('hnsw.ef_search', %s, true);", (str(int(ef_search)),)
+        )
+    if iterative_scan is not None and iterative_scan != "off":
+        cursor.execute(
+            "SELECT set_config('hnsw.iterative_scan', %s, true);", (iterative_scan,)
+        )
+
+
+def _postgres_vector_search(
+    vector: list[float],
+    limit: int,
+    filters: dict | None = None,
+    ef_search: int | None = None,
+    embedding_version: int | None = None,
+) -> list[tuple]:
+    """
+    Returns the id, rank and cosine similarity of the documents closest to
+    the input embedding using the pgvector HNSW index.
+
+    With a quantized `EMBEDDING_INDEX_MODE`, the index returns the top
+    `limit * EMBEDDING_RERANK_FACTOR` candidates, which are re-ranked with the
+    exact full-precision cosine distance.
+
+    When filters are given, pgvector iterative index scans are enabled for the
+    transaction (see `HNSW_ITERATIVE_SCAN`) so that the HNSW index keeps
+    scanning until enough rows pass the filters.
+
+    Args:
+        vector (list[float]): The query embedding.
+        limit (int): The number of documents to return.
+        filters (dict, optional): Metadata filters, see `parse_filters`.
+        ef_search (int, optional): HNSW candidate list size for this query.
+            Defaults to `default_ef_search` of the number of candidates. Must
+            be at least the number of candidates to get them all without
+            iterative scans.
+        embedding_version (int, optional): The embedding version the query
+            was embedded with, see `check_embedding_version`.
+    Returns:
+        list[tuple]: Rows of (id, rank, similarity).
+    """
+    # NOTE: Casting for vector type https://github.com/pgvector/pgvector-python/issues/4
+    # The smaller the cosine distance, the more semantically similar two vectors are.
+    # Candidates are materialized before ranking because with "relaxed_order"
+    # iterative scans the index may return rows slightly out of order.
+    _, _, index_distance = _embedding_index_expression(
+        EMBEDDING_INDEX_MODE, dimensions=len(vector)
+    )
+    num_candidates = (
+        limit if EMBEDDING_INDEX_MODE == "vector" else limit * EMBEDDING_RERANK_FACTOR
+    )
+    conditions, params = _filter_conditions(filters)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    query = f"""
+    WITH candidates AS MATERIALIZED (
+        SELECT id, embedding
+        FROM documents
+        {where}
+        ORDER BY {index_distance}
+        LIMIT %(num_candidates)s
+    ),
+    reranked AS (
+        SELECT id, embedding <=> %(vector)s::vector AS distance
+        FROM candidates
+        ORDER BY distance
+        LIMIT %(limit)s
+    )
+    SELECT id, RANK () OVER (ORDER BY distance) AS rank, 1 - distance AS similarity
+    FROM reranked
+    ORDER BY rank;
+    """
+    cursor = get_cursor()
+    check_embedding_version(cursor, embedding_version)
+    set_hnsw_options(
+        cursor,
+        ef_search=(
+            ef_search if ef_search is not None else default_ef_search(num_candidates)
+        ),
+        iterative_scan=HNSW_ITERATIVE_SCAN if conditions else None,
+    )
+    cursor.execute(
+        query,
+        {"vector": vector, "limit": limit, "num_candidates": num_candidates, **params},
+    )
+    result = cursor.fetchall()
+    cursor.close()
+    return result
+
+
+def _updated_documents_condition(
+    updated_since: datetime | None, ids: list[str] | None
+) -> str | None:
+    """
+    Returns the SQL condition selecting the documents of posts inserted or
+    refreshed since `updated_since` and the documents in `ids`, or None to
+    select every document.
+    """
+    if updated_since is None:
+        return None
+    if ids:
+        return (
+            "(posts.last_updated_at >= %(updated_since)s "
+            "OR documents.id = ANY(%(ids)s))"
+        )
+    return "posts.last_updated_at >= %(updated_since)s"
+
+
+def fetch_document_embeddings(
+    updated_since: datetime | None = None,
+    ids: list[str] | None = None,
+    embedding_version: int | None = None,
+) -> tuple[list[str], np.ndarray, datetime | None]:
+    """
+    Streams the document embeddings from the database into a float32 matrix.
+
+    Args:
+        updated_since (datetime, optional): Only return the documents of posts
+            inserted or refreshed at or after this time...
+        ids (list[str], optional): ...and these documents.
+        embedding_version (int, optional): The version the embeddings must be
+            of, see `check_embedding_version`. No cutover happens while they
+            are read.
+    Returns:
+        tuple: The document ids, the embedding matrix and the latest
+            `last_updated_at` of the returned posts.
+    Raises:
+        EmbeddingVersionChanged: If `embedding_version` is no longer active.
+    """
+    where = "WHERE documents.embedding IS NOT NULL"
+    condition = _updated_documents_condition(updated_since, ids)
+    if condition:
+        where += f" AND {condition}"
+    query = f"""
+    SELECT documents.id, documents.embedding, posts.last_updated_at
+    FROM documents
+    JOIN posts ON documents.post_id = posts.id
+    {where};
+    """
+    params = {"updated_since": updated_since, "ids": ids}
+    ids, rows, watermark = [], [], None
+    with get_connection() as conn:
+        register_vector(conn)
+        with conn.cursor() as cursor:
+            check_embedding_version(cursor, embedding_version)
+        # Server-side cursor so the whole table is never held twice in memory
+        with conn.cursor(name="fetch_document_embeddings") as cursor:
+            cursor.itersize = 2_000
+            cursor.execute(query, params)
+            for id, embedding, last_updated_at in cursor:
+                ids.append(id)
+                rows.append(np.asarray(embedding, dtype=np.float32))
+                if watermark is None or last_updated_at > watermark:
+                    watermark = last_updated_at
+
+    matrix = np.vstack(rows) if rows else np.empty((0, EMBEDDING_DIMENSIONS), np.float32)
+    return ids, matrix, watermark
+
+
+def build_vector_index() -> NumpyVectorIndex:
+    """
+    Builds an in-process vector index from all the documents, stamped with
+    the active embedding version.
+    """
+    version = get_embedding_version(refresh=True)[0]
+    try:
+        ids, matrix, watermark = fetch_document_embeddings(embedding_version=version)
+    except EmbeddingVersionChanged:
+        # A cutover happened since the version was read
+        version = get_embedding_version(refresh=True)[0]
+        ids, matrix, watermark = fetch_document_embeddings(embedding_version=version)
+    index = NumpyVectorIndex(dtype=VECTOR_INDEX_DTYPE)
+    index.add(ids, matrix)
+    index.metadata["watermark"] = watermark.isoformat() if watermark else None
+    index.metadata["embedding_version"] = version
+    return index
+
+
+def refresh_local_index(index: NumpyVectorIndex | BM25Index, fetch) -> None:
+    """
+    Incrementally brings an in-process index up to date: re-reads the
+    documents of posts inserted or refreshed since the last refresh, adds the
+    documents missing from the index and drops the documents deleted from the
+    database.
+
+    The watermark is the `last_updated_at` of the posts, which is set before
+    their documents are committed: documents committed after a refresh read
+    the watermark of their post are found by id instead.
+
+    Args:
+        index (NumpyVectorIndex | BM25Index): The index to refresh.
+        fetch (callable): `fetch_document_embeddings` or
+            `fetch_document_contents`, matching the index type.
+    """
+    cursor = get_cursor()
+    cursor.execute("SELECT id FROM documents;")
+    existing = {row[0] for row in cursor.fetchall()}
+    cursor.close()
+    indexed = set(index.ids)
+    index.remove([id for id in indexed if id not in existing])
+
+    watermark = index.metadata.get("watermark")
+    ids, data, new_watermark = fetch(
+        datetime.fromisoformat(watermark) if watermark else None,
+        [id for id in existing if id not in indexed],
+    )
+    index.add(ids, data)
+
+    if new_watermark is not None:
+        index.metadata["watermark"] = new_watermark.isoformat()
+    logger.info(
+        f"{type(index).__name__} refreshed: {len(ids)} upserted, {len(index)} total."
+    )
+
+
+def refresh_vector_index(index: NumpyVectorIndex) -> None:
+    """
+    Incrementally refreshes an in-process vector index from `documents`.
+
+    Raises:
+        EmbeddingVersionChanged: If the index is not stamped with the active
+            embedding version (see `build_vector_index`). It must be rebuilt
+            instead: the embeddings of another version are never added to it.
+    """
+    if "embedding_version" not in index.metadata:
+        raise EmbeddingVersionChanged("The index has no embedding version")
+    version = index.metadata["embedding_version"]
+    if get_embedding_version(refresh=True)[0] != version:
+        raise EmbeddingVersionChanged(
+            f"Embedding version {version} is no longer active"
+        )
+    refresh_local_index(
+        index,
+        lambda updated_since, ids: fetch_document_embeddings(
+            updated_since, ids, embedding_version=version
+        ),
+    )
+
+
+def _load_vector_index(version: tuple[int | None, str, int]) -> NumpyVectorIndex | None:
+    """
+    Loads the in-process vector index saved in VECTOR_INDEX_DIR or, if set,
+    the one of the SNAPSHOT_DIR snapshot, when it holds the embeddings of the
+    active `version` (see `get_embedding_version`). Snapshots record the
+    embedding model only: they are stamped with the active version if they
+    have its model and dimensions.
+
+    Returns:
+        NumpyVectorIndex | None: The index, or None if there is none of the
+            active version, e.g. one saved before the embedding versions.
+    """
+    id, model, dimensions = version
+    if VECTOR_INDEX_DIR and os.path.exists(
+        os.path.join(VECTOR_INDEX_DIR, "embeddings.npy")
+    ):
+        index = NumpyVectorIndex.load(VECTOR_INDEX_DIR)
+        if index.metadata.get("embedding_version", -1) == id:
+            return index
+        logger.warning(f"{VECTOR_INDEX_DIR} holds another embedding version.")
+    elif SNAPSHOT_DIR:
+        try:
+            index = snapshot.load_vector_index(SNAPSHOT_DIR, dimensions=dimensions)
+        except ValueError as e:
+            logger.warning(f"Vector index not loaded from snapshot: {str(e)}")
+            return None
+        if index.metadata["embedding_model"] == model:
+            index.metadata["embedding_version"] = id
+            return index
+        logger.warning(f"{SNAPSHOT_DIR} holds the embeddings of another model.")
+    return None
+
+
+_vector_index = None
+_vector_index_refreshed_at = 0.0
+_vector_index_lock = threading.Lock()
+
+
+def get_vector_index(embedding_version: int | None = None) -> NumpyVectorIndex:
+    """
+    Returns the process-wide in-process vector index of the active embedding
+    version. It is loaded on first use (see `_load_vector_index`) or built
+    from the database, and refreshed every VECTOR_INDEX_REFRESH_SECONDS. It
+    is rebuilt from the database once another version becomes active.
+
+    Args:
+        embedding_version (int, optional): The version the query vectors were
+            embedded with, see `get_embedding_version`.
+    Raises:
+        EmbeddingVersionChanged: If `embedding_version` is no longer active.
+    """
+    global _vector_index, _vector_index_refreshed_at
+
+    with _vector_index_lock:
+        if _vector_index is None:
+            _vector_index = _load_vector_index(get_embedding_version())
+            _vector_index_refreshed_at = 0.0
+
+        now = time.monotonic()
+        if _vector_index is not None and (
+            now - _vector_index_refreshed_at > VECTOR_INDEX_REFRESH_SECONDS
+            # The question was embedded with another version: one of the
+            # two is out of date
+            or (
+                embedding_version is not None
+                and _vector_index.metadata["embedding_version"] != embedding_version
+            )
+        ):
+            try:
+                refresh_vector_index(_vector_index)
+                _vector_index_refreshed_at = now
+            except EmbeddingVersionChanged:
+                # The embedding model was switched: every embedding is read again
+                _vector_index = None
+
+        if _vector_index is None:
+            _vector_index = build_vector_index()
+            if VECTOR_INDEX_DIR:
+                _vector_index.save(VECTOR_INDEX_DIR)
+            _vector_index_refreshed_at = time.monotonic()
+
+        index = _vector_index
+
+    if embedding_version is not None and (
+        index.metadata["embedding_version"] != embedding_version
+    ):
+        # The index is up to date: the question must be embedded again
+        raise EmbeddingVersionChanged(
+            f"Embedding version {embedding_version} is no longer active"
+        )
+    return index
+
+
+def _numpy_vector_search(
+    vector: list[float],
+    limit: int,
+    filters: dict | None = None,
+    ef_search: int | None = None,
+    embedding_version: int | None = None,
+) -> list[tuple]:
+    """
+    Returns the id, rank and similarity of the documents closest to the input
+    embedding using the in-process index. The search is exact, so `ef_search` is
+    ignored. The in-process index holds no metadata: filtered searches are
+    delegated to Postgres.
+    """
+    if filters:
+        return _postgres_vector_search(
+            vector, limit, filters, ef_search, embedding_version
+        )
+    return get_vector_index(embedding_version).search(vector, limit)
+
+
+# Registry of the vector search backends. A backend is a function with the
+# signature of `vector_search_by_embedding`.
+VECTOR_SEARCH_BACKENDS = {
+    "postgres": _postgres_vector_search,
+    "numpy": _numpy_vector_search,
+}
+
+
+def vector_search_by_embedding(
+    vector: list[float],
+    limit: int,
+    filters: dict | None = None,
+    ef_search: int | None = None,
+    embedding_version: int | None = None,
+) -> list[tuple]:
+    """
+    Returns the id, rank and similarity of the documents closest to the input
+    embedding, using the backend selected by `VECTOR_SEARCH_BACKEND`.
+    """
+    backend = VECTOR_SEARCH_BACKENDS[VECTOR_SEARCH_BACKEND]
+    return backend(vector, limit, filters, ef_search, embedding_version)
+
+
+def _postgres_vector_search_batch(
+    vectors: list[list[float]],
+    limit: int,
+    filters: dict | None = None,
+    ef_search: int | None = None,
+    embedding_version: int | None = None,
+) -> list[list[tuple]]:
+    """
+    Runs `_postgres_vector_search` for several query embeddings in a single
+    statement: the queries are unnested and each one is answered by a
+    LATERAL subquery that uses the HNSW index.
+
+    Returns:
+        list[list[tuple]]: Rows of (id, rank, similarity) for each query, in
+            input order.
+    """
+    if len(vectors) == 0:
+        return []
+    _, _, index_distance = _embedding_index_expression(
+        EMBEDDING_INDEX_MODE, dimensions=len(vectors[0])
+    )
+    index_distance = index_distance.replace("%(vector)s", "q.vector")
+    num_candidates = (
+        limit if EMBEDDING_INDEX_MODE == "vector" else limit * EMBEDDING_RERANK_FACTOR
+    )
+    conditions, params = _filter_conditions(filters)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    query = f"""
+    SELECT
+        q.query_id,
+        reranked.id,
+        RANK () OVER (PARTITION BY q.query_id ORDER BY reranked.distance) AS rank,
+        1 - reranked.distance AS similarity
+    FROM unnest(%(vectors)s::text[]) WITH ORDINALITY AS q(vector, query_id)
+    CROSS JOIN LATERAL (
+        SELECT candidates.id, candidates.embedding <=> q.vector::vector AS distance
+        FROM (
+            SELECT id, embedding
+            FROM documents
+            {where}
+            ORDER BY {index_distance}
+            LIMIT %(num_candidates)s
+        ) AS candidates
+        ORDER BY distance
+        LIMIT %(limit)s
+    ) AS reranked
+    ORDER BY q.query_id, rank;
+    """
+    # Sent as text literals and cast per query: psycopg has no adapter for
+    # arrays of vectors without registering the type on the connection.
+    literals = [_vector_literal(vector) for vector in vectors]
+    cursor = get_cursor()
+    check_embedding_version(cursor, embedding_version)
+    set_hnsw_options(
+        cursor,
+        ef_search=(
+            ef_search if ef_search is not None else default_ef_search(num_candidates)
+        ),
+        iterative_scan=HNSW_ITERATIVE_SCAN if conditions else None,
+    )
+    cursor.execute(
+        query,
+        {
+            "vectors": literals,
+            "limit": limit,
+            "num_candidates": num_candidates,
+            **params,
+        },
+    )
+    results = [[] for _ in vectors]
+    for query_id, id, rank, similarity in cursor.fetchall():
+        results[query_id - 1].append((id, rank, similarity))
+    cursor.close()
+    return results
+
+
+def _numpy_vector_search_batch(
+    vectors: list[list[float]],
+    limit: int,
+    filters: dict | None = None,
+    ef_search: int | None = None,
+    embedding_version: int | None = None,
+) -> list[list[tuple]]:
+    """
+    Answers all the queries with one matrix product over the in-process
+    index. Filtered searches are delegated to Postgres.
+    """
+    if filters:
+        return _postgres_vector_search_batch(
+            vectors, limit, filters, ef_search, embedding_version
+        )
+    if len(vectors) == 0:
+        return []
+    return get_vector_index(embedding_version).search_batch(vectors, limit)
+
+
+# Batched counterparts of `VECTOR_SEARCH_BACKENDS`, with the signature of
+# `vector_search_batch_by_embedding`.
+VECTOR_SEARCH_BATCH_BACKENDS = {
+    "postgres": _postgres_vector_search_batch,
+    "numpy": _numpy_vector_search_batch,
+}
+
+
+def vector_search_batch_by_embedding(
+    vectors: list[list[float]],
+    limit: int,
+    filters: dict | None = None,
+    ef_search: int | None = None,
+    embedding_version: int | None = None,
+) -> list[list[tuple]]:
+    """
+    Returns, for each query embedding, the id, rank and similarity of the
+    closest documents, using the backend selected by `VECTOR_SEARCH_BACKEND`.
+    """
+    backend = VECTOR_SEARCH_BATCH_BACKENDS[VECTOR_SEARCH_BACKEND]
+    return backend(vectors, limit, filters, ef_search, embedding_version)
+
+
+def vector_search(
+    text_query: str,
+    limit: int,
+    filters: dict | None = None,
+    ef_search: int | None = None,
+) -> list[tuple]:
+    """
+    Returns the id, rank and cosine similarity of the most semantically
+    similar documents to the input text query.
+    """
+    # Partial results are
+    # ('1ftama5_1', 1, 0.62)
+    # ('1fv6hi1_3', 2, 0.58)
+    def search(refresh: bool) -> list[tuple]:
+        version, model, dimensions = get_embedding_version(refresh)
+        with telemetry.span("embed_query"):
+            vector = rag.get_llm_client().embed_query(text_query, dimensions, model)
+        with telemetry.span("vector_search", backend=VECTOR_SEARCH_BACKEND):
+            return vector_search_by_embedding(
+                vector, limit, filters, ef_search, version
+            )
+
+    try:
+        return search(refresh=False)
+    except EmbeddingVersionChanged:
+        # The embedding model was switched since the version was last read
+        return search(refresh=True)
+
+
+def keyword_search(
+    text_query: str, limit: int, filters: dict | None = None
+) -> list[tuple]:
+    """
+    Performs a full-text search on the content of the documents where any of
+    the words in the query must be present in the document.
+    """
+    return _postgres_keyword_searches(text_query, limit, filters)[0]
+
+
+def keyword_search_match_all(
+    text_query: str, limit: int, filters: dict | None = None
+) -> list[tuple]:
+    """
+    Performs a full-text search on the content of the documents where all the
+    words in the query must be present in the document.
+    """
+    return _postgres_keyword_searches(text_query, limit, filters)[1]
+
+
+def fetch_document_contents(
+    updated_since: datetime | None = None,
+    ids: list[str] | None = None,
+) -> tuple[list[str], list[str], datetime | None]:
+    """
+    Returns the document ids and contents, optionally only for the posts
+    inserted or refreshed at or after `updated_since` and the documents in
+    `ids`, and the latest `last_updated_at` of the returned posts.
+    """
+    condition = _updated_documents_condition(updated_since, ids)
+    where = f"WHERE {condition}" if condition else ""
+    query = f"""
+    SELECT documents.id, documents.content, posts.last_updated_at
+    FROM documents
+    JOIN posts ON documents.post_id = posts.id
+    {where};
+    """
+    params = {"updated_since": updated_since, "ids": ids}
+    ids, contents, watermark = [], [], None
+    with get_connection() as conn:
+        with conn.cursor(name="fetch_document_contents") as cursor:
+            cursor.itersize = 2_000
+            cursor.execute(query, params)
+            for id, content, last_updated_at in cursor:
+                ids.append(id)
+                contents.append(content)
+                if watermark is None or last_updated_at > watermark:
+                    watermark = last_updated_at
+    return ids, contents, watermark
+
+
+def build_keyword_index() -> BM25Index:
+    """Builds an in-process BM25 index from all the documents."""
+    ids, contents, watermark = fetch_document_contents()
+    index = BM25Index()
+    index.add(ids, contents)
+    index.metadata["watermark"] = watermark.isoformat() if watermark else None
+    return index
+
+
+_keyword_index = None
+_keyword_index_refreshed_at = 0.0
+_keyword_index_lock = threading.Lock()
+
+
+def get_keyword_index() -> BM25Index:
+    """
+    Returns the process-wide in-process BM25 index. It is built on first use,
+    from SNAPSHOT_DIR if set and from the database otherwise, and refreshed
+    every KEYWORD_INDEX_REFRESH_SECONDS.
+    """
+    global _keyword_index, _keyword_index_refreshed_at
+
+    with _keyword_index_lock:
+        if _keyword_index is None:
+            if SNAPSHOT_DIR:
+                _keyword_index = snapshot.load_keyword_index(SNAPSHOT_DIR)
+                refresh_local_index(_keyword_index, fetch_document_contents)
+            else:
+                _keyword_index = build_keyword_index()
+            _keyword_index_refreshed_at = time.monotonic()
+
+        elif time.monotonic() - _keyword_index_refreshed_at > KEYWORD_INDEX_REFRESH_SECONDS:
+            refresh_local_index(_keyword_index, fetch_document_contents)
+            _keyword_index_refreshed_at = time.monotonic()
+
+    return _keyword_index
+
+
+def _postgres_keyword_searches(
+    text_query: str, limit: int, filters: dict | None = None
+) -> tuple[list[tuple], list[tuple]]:
+    """
+    Runs both Postgres full-text legs, see `keyword_searches`. The question is
+    parsed once (see `text_query.parse_query`), and the documents matching all
+    the words are ranked from the same index scan as those matching any word,
+    which they are a subset of.
+    """
+    any_query, all_query = build_tsqueries(text_query, TEXT_SEARCH_STOPWORDS)
+    if not any_query:
+        return [], []
+
+    conditions, params = _filter_conditions(filters)
+    filter_clause = " ".join(f"AND {c}" for c in conditions)
+    query = f"""
+    WITH matches AS (
+        SELECT
+            id,
+            ts_rank_cd(
+                content_ts_vector, to_tsquery(%(config)s::regconfig, %(any_query)s)
+            ) AS score,
+            CASE
+                WHEN content_ts_vector @@ to_tsquery(%(config)s::regconfig, %(all_query)s)
+                THEN ts_rank_cd(
+                    content_ts_vector, to_tsquery(%(config)s::regconfig, %(all_query)s)
+                )
+            END AS score_all
+        FROM documents
+        WHERE
+            content_ts_vector @@ to_tsquery(%(config)s::regconfig, %(any_query)s)
+            {filter_clause}
+    ),
+    ranked AS (
+        SELECT
+            id,
+            score,
+            score_all,
+            RANK () OVER (ORDER BY score DESC) AS rank,
+            RANK () OVER (ORDER BY score_all DESC NULLS LAST) AS rank_all
+        FROM matches
+    )
+    SELECT id, rank, score, rank_all, score_all
+    FROM ranked
+    WHERE rank <= %(limit)s OR (score_all IS NOT NULL AND rank_all <= %(limit)s);
+    """
+    cursor = get_cursor()
+    cursor.execute(
+        query,
+        {
+            "config": TEXT_SEARCH_CONFIG,
+            "any_query": any_query,
+            "all_query": all_query,
+            "limit": limit,
+            **params,
+        },
+    )
+    rows = cursor.fetchall()
+    cursor.close()
+
+    keyword_results = sorted(
+        ((id, rank, score) for id, rank, score, _, _ in rows if rank <= limit),
+        key=lambda row: (row[1], row[0]),
+    )
+    exact_keyword_results = sorted(
+        (
+            (id, rank_all, score_all)
+            for id, _, _, rank_all, score_all in rows
+            if score_all is not None and rank_all <= limit
+        ),
+        key=lambda row: (row[1], row[0]),
+    )
+    return keyword_results[:limit], exact_keyword_results[:limit]
+
+
+def _bm25_keyword_searches(
+    text_query: str, limit: int, filters: dict | None = None
+) -> tuple[list[tuple], list[tuple]]:
+    """
+    Answers both keyword legs in one pass over the in-process BM25 index. The
+    index holds no metadata: filtered searches are delegated to Postgres.
+    """
+    if filters:
+        return _postgres_keyword_searches(text_query, limit, filters)
+    return get_keyword_index().search(text_query, limit)
+
+
+# Registry of the keyword search backends. A backend is a function with the
+# signature of `keyword_searches`.
+KEYWORD_SEARCH_BACKENDS = {
+    "postgres": _postgres_keyword_searches,
+    "bm25": _bm25_keyword_searches,
+}
+
+
+def keyword_searches(
+    text_query: str,
+    limit: int,
+    filters: dict | None = None,
+    exact_limit: int | None = None,
+) -> tuple[list[tuple], list[tuple]]:
+    """
+    Runs the two keyword legs of the hybrid search with the backend selected
+    by `KEYWORD_SEARCH_BACKEND`. The exact-match leg returns `exact_limit`
+    documents, defaulting to `limit`.
+
+    Returns:
+        tuple: The id, rank and score of the documents matching any of the
+            query words (see `keyword_search`) and all of them (see
+            `keyword_search_match_all`).
+    """
+    exact_limit = limit if exact_limit is None else exact_limit
+    backend = KEYWORD_SEARCH_BACKENDS[KEYWORD_SEARCH_BACKEND]
+    with telemetry.span("keyword_search", backend=KEYWORD_SEARCH_BACKEND):
+        keyword_results, exact_keyword_results = backend(
+            text_query, max(limit, exact_limit), filters
+        )
+    return keyword_results[:limit], exact_keyword_results[:exact_limit]
+
+
+def fuse_legs(
+    vector_results: list[tuple],
+    keyword_results: list[tuple],
+    exact_keyword_results: list[tuple],
+    fusion: dict | None = None,
+) -> list[tuple[str, float]]:
+    """
+    Fuses the three legs of the hybrid search with weighted reciprocal rank
+    fusion or linear fusion, see `FUSION_PARAMS`.
+
+    Returns:
+        list[tuple[str, float]]: The (id, score) of every document, best first.
+    """
+    params = {**FUSION_PARAMS, **(fusion or {})}
+    legs = [vector_results, keyword_results, exact_keyword_results]
+    weights = [
+        params["vector_weight"],
+        params["keyword_weight"],
+        params["exact_weight"],
+    ]
+    if params["method"] == "linear":
+        return linear_fusion(legs, weights)
+
+    k = params["rrf_k"]
+    # Address edge case where no results are returned for exact keyword search
+    if len(exact_keyword_results) == 0:
+        k_vector, k_fs, k_exact = k, k, k
+    else:
+        k_vector, k_fs, k_exact = k, k * 3, k
+
+    return reciprocal_rank_fusion(legs, [k_vector, k_fs, k_exact], weights)
+
+
+def fetch_ranking_documents(ids: list[str]) -> dict[str, tuple]:
+    """
+    Fetches the documents and post features needed to rank fused results.
+
+    Returns:
+        dict[str, tuple]: (id, post_id, title, content, score_norm,
+            comments_norm, recency, permalink, num_tokens) by document id.
+    """
+    if len(ids) == 0:
+        return {}
+    query = """
+    SELECT
+        documents.id,
+        documents.post_id,
+        posts.title,
+        documents.content,
+        COALESCE(post_features.score_norm, 0),
+        COALESCE(post_features.comments_norm, 0),
+        COALESCE(post_features.recency, 0),
+        posts.permalink,
+        documents.num_tokens
+    FROM documents
+    JOIN posts ON documents.post_id = posts.id
+    LEFT JOIN post_features ON documents.post_id = post_features.post_id
+    WHERE documents.id = ANY(%(ids)s);
+    """
+    cursor = get_cursor()
+    cursor.execute(query, {"ids": list(ids)})
+    documents = {row[0]: row for row in cursor.fetchall()}
+    cursor.close()
+    if _permalink_cache is not None:
+        _permalink_cache.update({row[1]: row[7] for row in documents.values()})
+    return documents
+
+
+def rank_fused(
+    fused: list[tuple[str, float]],
+    documents: dict[str, tuple],
+    limit: int,
+    feature_weights: dict[str, float] | None = None,
+) -> list[tuple]:
+    """
+    Applies the post feature boost to fused results and keeps the top
+    `limit` documents.
+
+    Args:
+        fused (list[tuple[str, float]]): (id, score), see `fuse_legs`.
+        documents (dict[str, tuple]): As returned by `fetch_ranking_documents`,
+            only the first 8 fields are read. Ids missing from it (e.g.
+            deleted since indexed) are skipped.
+        limit (int): The number of documents to return.
+        feature_weights (dict[str, float], optional): Weights for the "score",
+            "comments" and "recency" features. Defaults to `FEATURE_WEIGHTS`.
+    Returns:
+        list[tuple]: Rows of (id, post_id, title, score, content,
+            permalink).
+    """
+    weights = {**FEATURE_WEIGHTS, **(feature_weights or {})}
+    ranked = []
+    for id, score in fused:
+        if id not in documents:
+            continue
+        (
+            _,
+            post_id,
+            title,
+            content,
+            score_norm,
+            comments_norm,
+            recency,
+            permalink,
+        ) = documents[id][:8]
+        score = score * (
+            1
+            + weights["score"] * score_norm
+            + weights["comments"] * comments_norm
+            + weights["recency"] * recency
+        )
+        ranked.append((id, post_id, title, score, content, permalink))
+    ranked.sort(key=lambda row: -row[3])
+    return ranked[:limit]
+
+
+def rank_documents(
+    fused: list[list[tuple[str, float]]],
+    limit: int,
+    feature_weights: dict[str, float] | None = None,
+    token_counts: dict | None = None,
+) -> list[list[tuple]]:
+    """
+    Re-ranks fused results with the post features (see `rank_fused`). The
+    documents of all the result lists are fetched with a single query.
+
+    Args:
+        fused (list[list[tuple[str, float]]]): (id, score) lists, one per
+            query, as returned by `fuse_legs`.
+        limit (int): The number of documents to return per query.
+        feature_weights (dict[str, float], optional): See `rank_fused`.
+        token_counts (dict, optional): If given, filled with the token counts
+            stored at ingest of the returned documents, when known.
+    Returns:
+        list[list[tuple]]: Rows of (id, post_id, title, score, content,
+            permalink) for each query.
+    """
+    documents = fetch_ranking_documents(
+        list({id for results in fused for id, _ in results})
+    )
+    results = [rank_fused(ids, documents, limit, feature_weights) for ids in fused]
+    if token_counts is not None:
+        token_counts.update(
+            (row[0], documents[row[0]][8])
+            for rows in results
+            for row in rows
+            if documents[row[0]][8] is not None
+        )
+    return results
+
+
+def leg_candidates(limit: int, feature_weights: dict[str, float] | None) -> int:
+    """Number of documents retrieved per leg, see `hybrid_search`."""
+    weights = {**FEATURE_WEIGHTS, **(feature_weights or {})}
+    rerank = any(w != 0 for w in weights.values())
+    return max(limit, RANK_CANDIDATES) if rerank else limit
+
+
+def leg_depths(
+    limit: int,
+    feature_weights: dict[str, float] | None = None,
+    fusion: dict | None = None,
+) -> tuple[int, int, int]:
+    """
+    Number of documents retrieved by the vector, keyword and exact-match
+    legs, see `FUSION_PARAMS`.
+    """
+    params = {**FUSION_PARAMS, **(fusion or {})}
+    default = leg_candidates(limit, feature_weights)
+    return tuple(
+        params[f"{leg}_depth"] or default for leg in ("vector", "keyword", "exact")
+    )
+
+
+def hybrid_search(
+    text_query: str,
+    limit: int,
+    feature_weights: dict[str, float] | None = None,
+    filters: dict | None = None,
+    fusion: dict | None = None,
+    token_counts: dict | None = None,
+) -> list[tuple]:
+    """
+    Performs a hybrid search. Hybrid search combines:
+        - vector search
+        - full-text search for exact matches
+        - full-text search for partial matches
+
+    using both full-text search and vector search.
+
+    The fused score can optionally be re-ranked with the precomputed post
+    features (see `PostFeatures`). Each feature contributes a multiplicative
+    boost of `1 + weight * feature` to the fused score, so zero weights leave
+    the ranking untouched. When re-ranking is enabled, each leg retrieves at
+    least `RANK_CANDIDATES` documents so that the boost has candidates to
+    promote.
+
+    Args:
+        text_query (str): The user question.
+        limit (int): The number of documents to return.
+        feature_weights (dict[str, float], optional): Weights for the "score",
+            "comments" and "recency" features. Defaults to `FEATURE_WEIGHTS`.
+        filters (dict, optional): Metadata filters applied to every leg. See
+            `parse_filters` for the supported keys.
+        fusion (dict, optional): Leg depths, weights and fusion method.
+            Defaults to `FUSION_PARAMS`, see `parse_fusion`.
+        token_counts (dict, optional): If given, filled with the token counts
+            stored at ingest of the returned documents, e.g. to pack them in a
+            prompt without another query.
+    Returns:
+        list[tuple]: Rows of (id, post_id, title, score, content,
+            permalink).
+    """
+    vector_depth, keyword_depth, exact_depth = leg_depths(
+        limit, feature_weights, fusion
+    )
+
+    keyword_results, exact_keyword_results = keyword_searches(
+        text_query, keyword_depth, filters, exact_depth
+    )
+    vector_results = vector_search(text_query, vector_depth, filters)
+
+    with telemetry.span("fusion"):
+        fused = fuse_legs(
+            vector_results, keyword_results, exact_keyword_results, fusion
+        )
+        return rank_documents([fused], limit, feature_weights, token_counts)[0]
+
+
+def batch_hybrid_search(
+    questions: list[str],
+    limit: int,
+    feature_weights: dict[str, float] | None = None,
+    filters: dict | None = None,
+    fusion: dict | None = None,
+    max_workers: int = BATCH_SEARCH_WORKERS,
+    timings: dict | None = None,
+) -> list[list[tuple]]:
+    """
+    Runs `hybrid_search` for many questions at once, for offline evaluation
+    and bulk retrieval:
+        - the questions are embedded in batched requests
+        - the vector legs run as a single multi-query statement (or a single
+          matrix product with the in-process backend)
+        - the keyword legs run concurrently on `max_workers` threads
+        - the documents of all the results are fetched with a single query
+
+    Args:
+        questions (list[str]): The user questions.
+        limit (int): The number of documents to return per question.
+        feature_weights (dict[str, float], optional): See `hybrid_search`.
+        filters (dict, optional): Metadata filters applied to every question.
+        fusion (dict, optional): See `hybrid_search`.
+        max_workers (int): Number of threads running the keyword legs.
+        timings (dict, optional): If given, filled with the seconds spent
+            embedding, searching and ranking.
+    Returns:
+        list[list[tuple]]: Rows of (id, post_id, title, score, content,
+            permalink) for each question, in input order.
+    """
+    timings = timings if timings is not None else {}
+    vector_depth, keyword_depth, exact_depth = leg_depths(
+        limit, feature_weights, fusion
+    )
+
+    version, model, dimensions = get_embedding_version()
+    start = time.perf_counter()
+    vectors = rag.get_llm_client().get_embeddings(questions, dimensions, model=model)
+    timings["embed_s"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        keyword_futures = [
+            executor.submit(
+                keyword_searches, question, keyword_depth, filters, exact_depth
+            )
+            for question in questions
+        ]
+        try:
+            vector_results = vector_search_batch_by_embedding(
+                vectors, vector_depth, filters, embedding_version=version
+            )
+        except EmbeddingVersionChanged:
+            # The embedding model was switched since the version was last read
+            version, model, dimensions = get_embedding_version(refresh=True)
+            vectors = rag.get_llm_client().get_embeddings(
+                questions, dimensions, model=model
+            )
+            vector_results = vector_search_batch_by_embedding(
+                vectors, vector_depth, filters, embedding_version=version
+            )
+        keyword_results = [future.result() for future in keyword_futures]
+    timings["search_s"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    fused = [
+        fuse_legs(vector, keyword, exact_keyword, fusion)
+        for vector, (keyword, exact_keyword) in zip(vector_results, keyword_results)
+    ]
+    results = rank_documents(fused, limit, feature_weights)
+    timings["rank_s"] = time.perf_counter() - start
+    return results
+
+
+def get_corpus_version() -> str:
+    """
+    Returns a string that changes whenever posts are inserted, refreshed or
+    deleted, used to invalidate cached answers after an ingest.
+    """
+    cursor = get_cursor()
+    cursor.execute("SELECT count(*), max(last_updated_at) FROM posts;")
+    count, last_updated_at = cursor.fetchone()
+    cursor.close()
+    return f"{count}:{last_updated_at.isoformat() if last_updated_at else ''}"
 
 
 def is_post_modified(post_id: str) -> bool:
@@ -420,7 +3108,7 @@ def is_post_modified(post_id: str) -> bool:
     Returns True if a Reddit post has been modified since it was loaded into the database.
     """
     logger.info(f"Checking if post {post_id} has been modified.")
-    with Session(engine) as session:
+    with Session(get_engine()) as session:
         db_post = session.query(RedditPosts).filter_by(id=post_id).first()
 
     reddit_post = reddit.get_post_from_id(post_id)
@@ -455,7 +3143,7 @@ def get_posts_without_documents() -> list[RedditPosts]:
         list[RedditPosts]: A list of RedditPosts objects that do not have any associated documents.
     """
 
-    with Session(engine) as session:
+    with Session(get_engine()) as session:
         posts_without_docs = (
             session.query(RedditPosts)
             .outerjoin(Documents)
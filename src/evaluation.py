@@ -0,0 +1,145 @@
+import hashlib
+
+import numpy as np
+
+from src.keyword_index import tokenize
+
+
+def precision_at_k(retrieved: list[str], relevant: set[str], k: int) -> float:
+    """Fraction of the top `k` retrieved ids that are relevant."""
+    if k <= 0:
+        return 0.0
+    top_k = retrieved[:k]
+    return sum(1 for id in top_k if id in relevant) / k
+
+
+def recall_at_k(retrieved: list[str], relevant: set[str], k: int) -> float:
+    """Fraction of the relevant ids found in the top `k` retrieved ids."""
+    if len(relevant) == 0:
+        return 0.0
+    return len(set(retrieved[:k]) & relevant) / len(relevant)
+
+
+def reciprocal_rank(retrieved: list[str], relevant: set[str]) -> float:
+    """Inverse of the position of the first relevant id, or 0 if none is found."""
+    for position, id in enumerate(retrieved, start=1):
+        if id in relevant:
+            return 1.0 / position
+    return 0.0
+
+
+def unique_in_order(ids: list[str]) -> list[str]:
+    """
+    Removes duplicates while preserving order. Used to turn a ranking of chunks
+    into a ranking of posts, since several chunks may belong to the same post.
+    """
+    seen = set()
+    out = []
+    for id in ids:
+        if id not in seen:
+            seen.add(id)
+            out.append(id)
+    return out
+
+
+def summarize(rankings: list[list[str]], labels: list[set[str]], k: int) -> dict:
+    """
+    Averages precision@k, recall@k and MRR over a set of labeled queries.
+
+    Args:
+        rankings (list[list[str]]): The retrieved ids of each query, best first.
+        labels (list[set[str]]): The relevant ids of each query.
+        k (int): The cutoff used for precision and recall.
+    Returns:
+        dict: The averaged metrics and the number of queries.
+    """
+    assert len(rankings) == len(labels)
+    n = len(rankings)
+    if n == 0:
+        return {"queries": 0, f"precision@{k}": 0.0, f"recall@{k}": 0.0, "mrr": 0.0}
+
+    return {
+        "queries": n,
+        f"precision@{k}": sum(
+            precision_at_k(r, l, k) for r, l in zip(rankings, labels)
+        )
+        / n,
+        f"recall@{k}": sum(recall_at_k(r, l, k) for r, l in zip(rankings, labels))
+        / n,
+        "mrr": sum(reciprocal_rank(r, l) for r, l in zip(rankings, labels)) / n,
+    }
+
+
+def percentile(values: list[float], p: float) -> float:
+    """Returns the `p`-th percentile (0-100) of the values using linear interpolation."""
+    assert len(values) > 0
+    assert 0 <= p <= 100
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * p / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def latency_summary(latencies_ms: list[float]) -> dict:
+    """Summarizes a list of latencies in milliseconds."""
+    if len(latencies_ms) == 0:
+        return {"n": 0}
+    return {
+        "n": len(latencies_ms),
+        "mean_ms": sum(latencies_ms) / len(latencies_ms),
+        "p50_ms": percentile(latencies_ms, 50),
+        "p95_ms": percentile(latencies_ms, 95),
+        "p99_ms": percentile(latencies_ms, 99),
+        "max_ms": max(latencies_ms),
+    }
+
+
+def hashed_embedding(text: str, dimensions: int = 256) -> np.ndarray:
+    """
+    Deterministic stand-in for a text embedding, for benchmarks that must not
+    call the embeddings API. Each (stemmed) token is hashed to a dimension and
+    a sign, so texts sharing words have a high cosine similarity.
+    """
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for token in tokenize(text):
+        digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+        value = int.from_bytes(digest, "little")
+        vector[value % dimensions] += 1.0 if (value >> 32) & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+def find_regressions(
+    report: dict,
+    baseline: dict,
+    quality_tolerance: float = 0.0,
+    latency_tolerance: float = 0.2,
+) -> list[str]:
+    """
+    Compares a benchmark report with a baseline report of the same shape.
+    Only the metrics present in the baseline are checked:
+        - "quality" metrics (higher is better) may not drop by more than
+          `quality_tolerance` (absolute)
+        - "latency" metrics (lower is better) may not grow by more than
+          `latency_tolerance` (relative)
+
+    Returns:
+        list[str]: A description of each regression, empty if none.
+    """
+    regressions = []
+    for metric, expected in baseline.get("quality", {}).items():
+        actual = report["quality"][metric]
+        if actual < expected - quality_tolerance:
+            regressions.append(f"quality.{metric}: {actual:.4f} < {expected:.4f}")
+
+    for stage, summary in baseline.get("latency", {}).items():
+        for metric, expected in summary.items():
+            if not metric.endswith("_ms"):
+                continue
+            actual = report["latency"][stage][metric]
+            if actual > expected * (1 + latency_tolerance):
+                regressions.append(
+                    f"latency.{stage}.{metric}: {actual:.2f} > {expected:.2f}"
+                )
+    return regressions
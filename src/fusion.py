@@ -0,0 +1,55 @@
+def reciprocal_rank_fusion(
+    legs: list[list[tuple]],
+    ks: list[float],
+    weights: list[float] | None = None,
+) -> list[tuple[str, float]]:
+    """
+    Fuses ranked result lists with (weighted) reciprocal rank fusion: each
+    document scores the sum of `weight / (k + rank)` over the legs it appears
+    in.
+
+    Args:
+        legs (list[list[tuple]]): Result lists of (id, rank, ...), e.g. the
+            output of `db.vector_search` and `db.keyword_search`.
+        ks (list[float]): The RRF constant of each leg. A larger k flattens
+            the contribution of the leg.
+        weights (list[float], optional): The weight of each leg. Defaults to 1.
+    Returns:
+        list[tuple[str, float]]: The (id, score) of every document, best first.
+    """
+    weights = weights if weights is not None else [1.0] * len(legs)
+    assert len(legs) == len(ks) == len(weights)
+    scores: dict[str, float] = {}
+    for results, k, weight in zip(legs, ks, weights):
+        for id, rank, *_ in results:
+            scores[id] = scores.get(id, 0.0) + weight / (k + rank)
+    return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+
+def linear_fusion(
+    legs: list[list[tuple]], weights: list[float]
+) -> list[tuple[str, float]]:
+    """
+    Fuses scored result lists with a weighted sum of their min-max normalized
+    scores. Unlike reciprocal rank fusion, a leg that is much more confident
+    about its top result than about the next ones weighs more.
+
+    Args:
+        legs (list[list[tuple]]): Result lists of (id, rank, score), where a
+            higher score is better, e.g. the output of `db.vector_search`.
+        weights (list[float]): The weight of each leg.
+    Returns:
+        list[tuple[str, float]]: The (id, score) of every document, best first.
+    """
+    assert len(legs) == len(weights)
+    scores: dict[str, float] = {}
+    for results, weight in zip(legs, weights):
+        if len(results) == 0:
+            continue
+        leg_scores = [float(score) for _, _, score in results]
+        low, high = min(leg_scores), max(leg_scores)
+        for (id, _, _), score in zip(results, leg_scores):
+            # A leg whose results all score the same gives each of them 1
+            normalized = (score - low) / (high - low) if high > low else 1.0
+            scores[id] = scores.get(id, 0.0) + weight * normalized
+    return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
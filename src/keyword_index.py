@@ -0,0 +1,235 @@
+from array import array
+import math
+import re
+import threading
+
+# Same stopwords as the Postgres 'english' text search configuration
+STOPWORDS = frozenset(
+    """
+    i me my myself we our ours ourselves you your yours yourself yourselves he
+    him his himself she her hers herself it its itself they them their theirs
+    themselves what which who whom this that these those am is are was were be
+    been being have has had having do does did doing a an the and but if or
+    because as until while of at by for with about against between into
+    through during before after above below to from up down in out on off over
+    under again further then once here there when where why how all any both
+    each few more most other some such no nor not only own same so than too
+    very s t can will just don should now
+    """.split()
+)
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+# Share of tombstoned documents above which a BM25Index is compacted
+COMPACT_THRESHOLD = 0.25
+
+
+def _undouble(token: str) -> str:
+    """Drops a doubled final consonant, e.g. "runn" -> "run"."""
+    if len(token) > 2 and token[-1] == token[-2] and token[-1] not in "aeioulsz":
+        return token[:-1]
+    return token
+
+
+def stem(token: str) -> str:
+    """
+    Light suffix stripping so that e.g. "pipelines" and "pipeline" match. Much
+    simpler than the Snowball stemmer used by Postgres, but cheap.
+    """
+    if len(token) <= 3 or token.isdigit():
+        return token
+    if token.endswith("ies") and len(token) > 4:
+        return token[:-3] + "y"
+    if token.endswith("sses"):
+        return token[:-2]
+    if token.endswith("ing") and len(token) > 5:
+        return _undouble(token[:-3])
+    if token.endswith("ed") and len(token) > 4:
+        return _undouble(token[:-2])
+    if token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercases, splits on non-alphanumerics, drops stopwords and stems."""
+    return [
+        stem(token)
+        for token in TOKEN_PATTERN.findall(text.lower())
+        if token not in STOPWORDS
+    ]
+
+
+class BM25Index:
+    """
+    In-process inverted index with BM25 scoring over the document contents.
+
+    Postings are compact typed arrays (document positions and term frequencies)
+    per term. A single pass over the postings of the query terms answers both
+    the any-term and the all-terms query used by the hybrid search.
+
+    Removed documents are tombstoned and skipped at query time, and the index
+    is compacted once more than COMPACT_THRESHOLD of its documents are
+    tombstones. Re-adding a document id replaces the previous version. The
+    document frequency of each term counts the live documents only.
+
+    Searches copy the postings of the query terms under the lock and score
+    them outside of it, so that they don't block each other or the refreshes.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._doc_ids: list[str] = []
+        self._doc_lengths = array("I")
+        self._alive = bytearray()
+        self._positions: dict[str, int] = {}
+        self._postings: dict[str, tuple[array, array]] = {}
+        # Distinct terms of each document (None once removed), to keep the
+        # document frequencies up to date
+        self._doc_terms: list[tuple[str, ...] | None] = []
+        self._df: dict[str, int] = {}
+        self._total_length = 0
+        self._lock = threading.Lock()
+        # Free-form information, e.g. the point up to which the index has
+        # been refreshed
+        self.metadata: dict = {}
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def __contains__(self, id: str) -> bool:
+        return id in self._positions
+
+    @property
+    def ids(self) -> list[str]:
+        return list(self._positions)
+
+    def _remove_position(self, position: int) -> None:
+        self._alive[position] = 0
+        self._total_length -= self._doc_lengths[position]
+        del self._positions[self._doc_ids[position]]
+        for term in self._doc_terms[position]:
+            self._df[term] -= 1
+            if self._df[term] == 0:
+                del self._df[term]
+        self._doc_terms[position] = None
+
+    def _compact_if_needed(self) -> None:
+        """
+        Drops the tombstoned documents and renumbers the live ones when they
+        are more than COMPACT_THRESHOLD of the documents. The arrays are
+        rebuilt rather than modified, as running searches may still read them.
+        """
+        dead = len(self._doc_ids) - len(self._positions)
+        if dead == 0 or dead <= COMPACT_THRESHOLD * len(self._doc_ids):
+            return
+
+        mapping = [-1] * len(self._doc_ids)
+        doc_ids, doc_lengths, doc_terms = [], array("I"), []
+        for position, alive in enumerate(self._alive):
+            if alive:
+                mapping[position] = len(doc_ids)
+                doc_ids.append(self._doc_ids[position])
+                doc_lengths.append(self._doc_lengths[position])
+                doc_terms.append(self._doc_terms[position])
+
+        postings = {}
+        for term in self._df:
+            docs, tfs = self._postings[term]
+            new_docs, new_tfs = array("I"), array("I")
+            for d, tf in zip(docs, tfs):
+                if mapping[d] >= 0:
+                    new_docs.append(mapping[d])
+                    new_tfs.append(tf)
+            postings[term] = (new_docs, new_tfs)
+
+        self._doc_ids = doc_ids
+        self._doc_lengths = doc_lengths
+        self._doc_terms = doc_terms
+        self._alive = bytearray(b"\x01") * len(doc_ids)
+        self._positions = {id: position for position, id in enumerate(doc_ids)}
+        self._postings = postings
+
+    def add(self, ids: list[str], texts: list[str]) -> None:
+        """Indexes documents. Ids already in the index are replaced."""
+        assert len(ids) == len(texts)
+        with self._lock:
+            for id, text in zip(ids, texts):
+                if id in self._positions:
+                    self._remove_position(self._positions[id])
+
+                tokens = tokenize(text)
+                position = len(self._doc_ids)
+                self._doc_ids.append(id)
+                self._doc_lengths.append(len(tokens))
+                self._alive.append(1)
+                self._positions[id] = position
+                self._total_length += len(tokens)
+
+                frequencies: dict[str, int] = {}
+                for token in tokens:
+                    frequencies[token] = frequencies.get(token, 0) + 1
+                for token, tf in frequencies.items():
+                    if token not in self._postings:
+                        self._postings[token] = (array("I"), array("I"))
+                    docs, tfs = self._postings[token]
+                    docs.append(position)
+                    tfs.append(tf)
+                    self._df[token] = self._df.get(token, 0) + 1
+                self._doc_terms.append(tuple(frequencies))
+            self._compact_if_needed()
+
+    def remove(self, ids: list[str]) -> None:
+        """Removes documents from the index. Unknown ids are ignored."""
+        with self._lock:
+            for id in ids:
+                if id in self._positions:
+                    self._remove_position(self._positions[id])
+            self._compact_if_needed()
+
+    def search(self, text_query: str, limit: int) -> tuple[list[tuple], list[tuple]]:
+        """
+        Scores the documents matching the query with BM25.
+
+        Returns:
+            tuple: The id, rank and BM25 score of the top `limit` documents
+                matching any query term, and of those matching all the query
+                terms, in the same format as `db.keyword_search`.
+        """
+        terms = set(tokenize(text_query))
+        with self._lock:
+            n = len(self._positions)
+            if n == 0 or len(terms) == 0:
+                return [], []
+            avgdl = self._total_length / n
+            # The documents are only appended to these, or they are replaced
+            # by a compaction: the positions of the copied postings stay valid
+            doc_ids, doc_lengths = self._doc_ids, self._doc_lengths
+            alive = bytes(self._alive)
+            postings = [
+                (self._df[term], self._postings[term][0][:], self._postings[term][1][:])
+                for term in terms
+                if term in self._df
+            ]
+
+        scores: dict[int, float] = {}
+        matched: dict[int, int] = {}
+        for df, docs, tfs in postings:
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for d, tf in zip(docs, tfs):
+                if not alive[d]:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * doc_lengths[d] / avgdl)
+                scores[d] = scores.get(d, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+                matched[d] = matched.get(d, 0) + 1
+
+        ranked = sorted(scores, key=lambda d: (-scores[d], d))
+        any_terms = [
+            (doc_ids[d], rank, scores[d])
+            for rank, d in enumerate(ranked[:limit], start=1)
+        ]
+        all_docs = [d for d in ranked if matched[d] == len(terms)][:limit]
+        all_terms = [
+            (doc_ids[d], rank, scores[d]) for rank, d in enumerate(all_docs, start=1)
+        ]
+        return any_terms, all_terms
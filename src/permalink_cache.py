@@ -0,0 +1,47 @@
+from collections import OrderedDict
+import threading
+
+
+class PermalinkCache:
+    """
+    Bounded in-process map of post id to permalink. Permalinks never change
+    once a post is created, so entries are only evicted, least recently used
+    first, beyond `max_entries`.
+    """
+
+    def __init__(self, max_entries: int = 100_000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._permalinks: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._permalinks)
+
+    def get_many(self, ids: list[str]) -> tuple[dict[str, str], list[str]]:
+        """
+        Returns the cached permalinks of the ids, and the ids missing from
+        the cache (in input order, without duplicates).
+        """
+        found, missing = {}, []
+        with self._lock:
+            for id in dict.fromkeys(ids):
+                permalink = self._permalinks.get(id)
+                if permalink is None:
+                    missing.append(id)
+                else:
+                    self._permalinks.move_to_end(id)
+                    found[id] = permalink
+            self.hits += len(found)
+            self.misses += len(missing)
+        return found, missing
+
+    def update(self, permalinks: dict[str, str]) -> None:
+        """Adds or refreshes entries, evicting the least recently used ones."""
+        with self._lock:
+            for id, permalink in permalinks.items():
+                self._permalinks[id] = permalink
+                self._permalinks.move_to_end(id)
+            while len(self._permalinks) > self.max_entries:
+                self._permalinks.popitem(last=False)
@@ -0,0 +1,141 @@
+from datetime import datetime, timezone
+import json
+import logging
+from logging.handlers import RotatingFileHandler
+import os
+import queue
+import random
+import threading
+
+from src import telemetry
+
+logger = logging.getLogger(__name__)
+
+# Prompt capture is off unless PROMPT_CAPTURE_PATH is set. Captured prompts are
+# appended as JSON lines to one file per process, named after that path and
+# the process id (e.g. prompts.1234.log), which is rotated by size.
+PROMPT_CAPTURE_PATH = os.getenv("PROMPT_CAPTURE_PATH")
+PROMPT_CAPTURE_SAMPLE_RATE = float(os.getenv("PROMPT_CAPTURE_SAMPLE_RATE", "1.0"))
+PROMPT_CAPTURE_MAX_BYTES = int(os.getenv("PROMPT_CAPTURE_MAX_BYTES", "10485760"))
+PROMPT_CAPTURE_BACKUP_COUNT = int(os.getenv("PROMPT_CAPTURE_BACKUP_COUNT", "5"))
+PROMPT_CAPTURE_QUEUE_SIZE = int(os.getenv("PROMPT_CAPTURE_QUEUE_SIZE", "100"))
+
+
+class PromptCapture:
+    """
+    Records prompts to a rotating log without blocking the request: records
+    are put on a bounded queue and written by a background thread. When the
+    queue is full (the disk cannot keep up) records are dropped rather than
+    slowing down requests.
+
+    Each process writes its own file (see `file_path`): the workers of a
+    pre-fork server would otherwise rotate the same file under each other.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        sample_rate: float = 1.0,
+        max_bytes: int = 10 * 1024 * 1024,
+        backup_count: int = 5,
+        queue_size: int = 100,
+    ):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def file_path(self) -> str:
+        """The file written by the current process."""
+        root, ext = os.path.splitext(self.path)
+        return f"{root}.{os.getpid()}{ext}"
+
+    def _ensure_writer(self) -> None:
+        # Threads do not survive a fork: start one per process, on first use
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(
+                    target=self._write_loop, name="prompt-capture", daemon=True
+                )
+                self._thread.start()
+
+    def _write_loop(self) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        handler = RotatingFileHandler(
+            self.file_path,
+            maxBytes=self.max_bytes,
+            backupCount=self.backup_count,
+            encoding="utf-8",
+        )
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        while True:
+            record = self._queue.get()
+            try:
+                handler.emit(logging.makeLogRecord({"msg": json.dumps(record)}))
+            except Exception as e:
+                logger.error(f"Error writing captured prompt: {str(e)}")
+            finally:
+                self._queue.task_done()
+
+    def capture(self, record: dict) -> bool:
+        """
+        Queues a record for writing, subject to sampling.
+
+        Returns:
+            bool: Whether the record was queued.
+        """
+        if random.random() >= self.sample_rate:
+            return False
+        self._ensure_writer()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            telemetry.increment("prompts_dropped")
+            return False
+        telemetry.increment("prompts_captured")
+        return True
+
+    def flush(self) -> None:
+        """Blocks until all the queued records are written."""
+        self._queue.join()
+
+
+_prompt_capture = None
+_prompt_capture_lock = threading.Lock()
+
+
+def get_prompt_capture() -> PromptCapture | None:
+    """Returns the process-wide prompt capture, or None if it is disabled."""
+    global _prompt_capture
+    if not PROMPT_CAPTURE_PATH or PROMPT_CAPTURE_SAMPLE_RATE <= 0:
+        return None
+    with _prompt_capture_lock:
+        if _prompt_capture is None:
+            _prompt_capture = PromptCapture(
+                PROMPT_CAPTURE_PATH,
+                sample_rate=PROMPT_CAPTURE_SAMPLE_RATE,
+                max_bytes=PROMPT_CAPTURE_MAX_BYTES,
+                backup_count=PROMPT_CAPTURE_BACKUP_COUNT,
+                queue_size=PROMPT_CAPTURE_QUEUE_SIZE,
+            )
+    return _prompt_capture
+
+
+def capture_prompt(question: str, messages: list[dict]) -> None:
+    """Records the messages sent to the LLM for a question, if enabled."""
+    capture = get_prompt_capture()
+    if capture is None:
+        return
+    capture.capture(
+        {
+            "time": datetime.now(timezone.utc).isoformat(),
+            "question": question,
+            "messages": messages,
+        }
+    )
@@ -1,13 +1,30 @@
+from collections import OrderedDict
 import os
-from openai import OpenAI
+import threading
 import tiktoken
 import time
 
-from src import db
+from src import context, prompt_capture, rerank, telemetry
 
 ENCODER = os.getenv("OPENAI_ENCODER")
 EMBEDDING_MODEL_NAME = os.getenv("OPENAI_EMBEDDING_MODEL")
 TOKEN_LIMIT = int(os.getenv("OPENAI_EMBEDDING_MODEL_TOKEN_LIMIT"))
+# text-embedding-3 models are trained with Matryoshka representation learning,
+# so they can return shorter embeddings that keep most of the quality.
+EMBEDDING_DIMENSIONS = int(os.getenv("OPENAI_EMBEDDING_DIMENSIONS", "1536"))
+# Size of the embeddings returned without the `dimensions` parameter. The
+# parameter is only sent to shorten them: older models such as ada-002
+# reject it.
+NATIVE_EMBEDDING_DIMENSIONS = {
+    "text-embedding-ada-002": 1536,
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+}
+# Number of question embeddings kept by `ThrottledOpenAI.embed_query`
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "128"))
+# Number of inputs per embeddings request in `get_embeddings`. The API accepts
+# up to 2048 inputs per request.
+EMBEDDING_BATCH_SIZE = int(os.getenv("OPENAI_EMBEDDING_BATCH_SIZE", "256"))
 
 system_prompt = """
 You are an intelligent assistant that provides accurate, well-structured responses based on the provided context from forum posts. Follow these guidelines precisely:
@@ -92,18 +109,31 @@ Make sure the last question ends with ">>".
 """.strip()
 
 
+_encoding = None
+
+
+def get_encoding() -> tiktoken.Encoding:
+    """
+    Returns the tokenizer, loaded once per process. tiktoken downloads the
+    encoding on first load unless it is found in TIKTOKEN_CACHE_DIR.
+    """
+    global _encoding
+    if _encoding is None:
+        _encoding = tiktoken.get_encoding(ENCODER)
+    return _encoding
+
+
 def get_num_tokens_from_string(string: str) -> int:
     """Returns the number of tokens in a text string."""
-    encoding = tiktoken.get_encoding(ENCODER)
-    return len(encoding.encode(string))
+    return len(get_encoding().encode(string))
 
 
 def get_tokens_from_string(string: str) -> list[int]:
-    return tiktoken.get_encoding(ENCODER).encode(string)
+    return get_encoding().encode(string)
 
 
 def get_string_from_tokens(tokens: list[int]) -> str:
-    return tiktoken.get_encoding(ENCODER).decode(tokens)
+    return get_encoding().decode(tokens)
 
 
 def check_token_limit(string: str) -> int:
@@ -118,88 +148,334 @@ def check_token_limit(string: str) -> int:
         )
 
 
+def embedding_model_params(model: str | None, dimensions: int) -> dict:
+    """
+    Returns the model and, when it differs from the native size of the model,
+    the dimensions to send with an embeddings request. The dimensions are
+    always sent for unknown models.
+    """
+    model = model or EMBEDDING_MODEL_NAME
+    if NATIVE_EMBEDDING_DIMENSIONS.get(model) == dimensions:
+        return {"model": model}
+    return {"model": model, "dimensions": dimensions}
+
+
+def build_prompt_messages(
+    question: str, blocks: list[tuple[str, str, str]]
+) -> list[dict]:
+    """
+    Lays out the chat messages so that they share the longest possible prefix
+    across requests, which the provider serves from its prompt cache:
+        1. the static instructions (identical for every request)
+        2. the retrieved context, sorted by post id so that the same posts
+           always produce the same text regardless of their ranking
+        3. the question, last
+
+    Args:
+        question (str): The user question.
+        blocks (list[tuple[str, str, str]]): (post_id, title, body) of the
+            retrieved posts, see `context.pack_context`.
+    """
+    prompt = "Based on the following context, answer the user's question.\n\nContext:\n\n"
+    for post_id, title, body in sorted(blocks):
+        prompt += f"Post ID: {post_id}\nTitle: {title}\nBody: {body}\n\n"
+    prompt += f"Question: {question}"
+
+    return [
+        {
+            "role": "system",
+            "content": f"{system_prompt}\n{follow_up_questions_prompt}",
+        },
+        {"role": "user", "content": prompt},
+    ]
+
+
 class ThrottledOpenAI:
     """Class that wraps the OpenAI client to avoid rate limiting errors."""
 
-    def __init__(self):
-        self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    def __init__(
+        self, client=None, retriever=None, token_counts=None, reranker=None
+    ):
+        """
+        Args:
+            client (optional): OpenAI client, e.g. a stub for benchmarks.
+                Defaults to a client using OPENAI_API_KEY.
+            retriever (callable, optional): Function with the signature of
+                `db.hybrid_search` used by `rag_query`. Defaults to
+                `db.hybrid_search`.
+            token_counts (callable, optional): Function with the signature of
+                `db.get_document_token_counts` used to pack the context.
+                Defaults to the counts stored at ingest, which the default
+                retriever returns with the documents. Chunks without a count
+                are tokenized.
+            reranker (rerank.Reranker, optional): Re-ranks the retrieved
+                chunks and keeps the best `RERANK_TOP_K` before the context is
+                packed. Defaults to `rerank.get_reranker()`, i.e. none unless
+                RERANK_BACKEND is set.
+        """
+        if client is None:
+            # Imported here: the openai package alone takes longer to import
+            # than the rest of the app, and an ingest run that finds no new
+            # post never calls it
+            from openai import OpenAI
+
+            client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        self.client = client
+        self.retriever = retriever
+        self.token_counts = token_counts
+        self.reranker = reranker
         self._remaining_requests = None
-        self.usage = 0
-
-    def get_embedding(self, string: str) -> list[float]:
-        """Get the embedding for a string using the specified OpenAI client."""
-        response = self.client.embeddings.with_raw_response.create(
-            model=EMBEDDING_MODEL_NAME, input=string
-        )
+        self._query_embeddings: OrderedDict[tuple, list[float]] = OrderedDict()
+        self._query_embeddings_lock = threading.Lock()
+
+    def get_embedding(
+        self,
+        string: str,
+        dimensions: int = EMBEDDING_DIMENSIONS,
+        model: str | None = None,
+    ) -> list[float]:
+        """
+        Get the embedding for a string using the specified OpenAI client, with
+        the OPENAI_EMBEDDING_MODEL unless another `model` is given.
+        """
+        with telemetry.span("embedding_request", inputs=1):
+            response = self.client.embeddings.with_raw_response.create(
+                input=string, **embedding_model_params(model, dimensions)
+            )
 
         total_tokens = response.parse().usage.total_tokens
+        telemetry.increment("embedding_tokens", total_tokens)
         print(f"Embedding tokens: {total_tokens}")
 
-        if response.status_code == 200:
-            x = response.headers.get("x-ratelimit-remaining-requests")
-            # caveman rate limiting
-            if int(x) > 50:
-                time.sleep(5)
-
-            return response.parse().data[0].embedding
-        else:
+        self._check_response(response)
+        return response.parse().data[0].embedding
+
+    def embed_query(
+        self,
+        question: str,
+        dimensions: int = EMBEDDING_DIMENSIONS,
+        model: str | None = None,
+    ) -> list[float]:
+        """
+        Get the embedding of a user question. The last
+        QUERY_EMBEDDING_CACHE_SIZE questions are cached, so that the answer
+        cache lookup and the vector search embed a question only once. The
+        cache is keyed by model, as the embedding model of the documents can
+        change while the app runs (see `db.get_embedding_version`).
+        """
+        key = (model or EMBEDDING_MODEL_NAME, dimensions, question)
+        with self._query_embeddings_lock:
+            if key in self._query_embeddings:
+                self._query_embeddings.move_to_end(key)
+                return self._query_embeddings[key]
+
+        embedding = self.get_embedding(question, dimensions, model)
+        with self._query_embeddings_lock:
+            self._query_embeddings[key] = embedding
+            while len(self._query_embeddings) > QUERY_EMBEDDING_CACHE_SIZE:
+                self._query_embeddings.popitem(last=False)
+        return embedding
+
+    def get_embeddings(
+        self,
+        strings: list[str],
+        dimensions: int = EMBEDDING_DIMENSIONS,
+        batch_size: int = EMBEDDING_BATCH_SIZE,
+        model: str | None = None,
+    ) -> list[list[float]]:
+        """
+        Get the embeddings for a list of strings, sending up to `batch_size`
+        strings per request. The embeddings are returned in input order.
+        """
+        embeddings = []
+        for start in range(0, len(strings), batch_size):
+            batch = strings[start : start + batch_size]
+            with telemetry.span("embedding_request", inputs=len(batch)):
+                response = self.client.embeddings.with_raw_response.create(
+                    input=batch, **embedding_model_params(model, dimensions)
+                )
+
+            parsed = response.parse()
+            telemetry.increment("embedding_tokens", parsed.usage.total_tokens)
+            print(f"Embedding tokens: {parsed.usage.total_tokens}")
+
+            self._check_response(response)
+            data = sorted(parsed.data, key=lambda d: d.index)
+            embeddings.extend(d.embedding for d in data)
+        return embeddings
+
+    def _check_response(self, response) -> None:
+        """Raises on a failed embeddings request and throttles otherwise."""
+        if response.status_code != 200:
             raise ValueError(f"Error getting embedding: {response.errors}")
 
-    def rag_query(self, question: str) -> str:
-
-        self.usage = 0
-        sources: list[tuple] = db.hybrid_search(question, limit=5)
-
-        # Recall output from db.hybrid_search is in the form (id, title, score, content)
-        parsed_sources = []
-        for source in sources:
-            post_id = source[1]
-            title = source[2]
-            body = source[4]
-
-            if body.startswith(title):
-                body = body[len(title) :].strip()
-
-            parsed_sources.append((post_id, title, body))
-
-        # Generate prompt with context
-        prompt = (
-            f"Based on the following context, answer the user's question.\n"
-            f"Question: {question}\n\n"
-            f"Context:\n\n"
-        )
-
-        for post_id, title, body in parsed_sources:
-            prompt += f"Post ID: {post_id}\nTitle: {title}\nBody: {body}\n\n"
-
-        with open("prompt.txt", "w", encoding="utf-8") as f:
-            f.write(prompt)
+        x = response.headers.get("x-ratelimit-remaining-requests")
+        # caveman rate limiting
+        if int(x) > 50:
+            with telemetry.span("rate_limit_wait"):
+                time.sleep(5)
 
-        # Check prompt token limit
-        n_tokens = get_num_tokens_from_string(prompt)
-        if n_tokens > 100_000:
-            raise ValueError(f"Prompt is too big. Number of tokens is {n_tokens}.")
-        else:
-            print(f"Number of tokens in prompt: {n_tokens}")
+    def build_messages(
+        self,
+        question: str,
+        filters: dict | None = None,
+        sources: list | None = None,
+        fusion: dict | None = None,
+    ) -> list[dict]:
+        """
+        Retrieves the context for a question and assembles the chat messages.
+        Split from `stream_answer` so that the retrieval is finished (and
+        timed) before a streaming response starts.
+
+        Args:
+            question (str): The user question.
+            filters (dict, optional): Metadata filters, see `db.parse_filters`.
+            sources (list, optional): If given, filled with the `post_id`,
+                `title` and `permalink` of the posts in the context, in
+                ranking order, e.g. to show them before the answer.
+            fusion (dict, optional): Fusion parameters of the hybrid search,
+                see `db.parse_fusion`.
+        """
+        # Imported here: `db` imports this module for tokenization and embeddings
+        from src import db
+
+        token_counts: dict[str, int] = {}
+        with telemetry.span("retrieval"):
+            if self.retriever is None:
+                # The token counts stored at ingest come with the documents
+                rows: list[tuple] = db.hybrid_search(
+                    question,
+                    limit=context.CONTEXT_CANDIDATES,
+                    filters=filters,
+                    fusion=fusion,
+                    token_counts=token_counts,
+                )
+            else:
+                rows = self.retriever(
+                    question,
+                    limit=context.CONTEXT_CANDIDATES,
+                    filters=filters,
+                    fusion=fusion,
+                )
+
+        # Fewer, better chunks in the prompt: a few ms of CPU per question
+        # save prompt tokens and LLM time
+        reranker = self.reranker or rerank.get_reranker()
+        if reranker is not None:
+            with telemetry.span("rerank", candidates=len(rows)):
+                rows = reranker.rerank(question, rows, rerank.RERANK_TOP_K)
+
+        # Pack the best chunks into the token budget with the token counts
+        # stored at ingest, instead of tokenizing the prompt
+        with telemetry.span("context_packing") as attributes:
+            if self.token_counts is not None:
+                token_counts = self.token_counts([row[0] for row in rows])
+            blocks, n_tokens = context.pack_context(
+                rows,
+                token_counts,
+                budget=context.CONTEXT_TOKEN_BUDGET,
+                count_tokens=get_num_tokens_from_string,
+            )
+            attributes["tokens"] = n_tokens
+        print(f"Number of tokens in context: {n_tokens}")
+
+        if sources is not None:
+            permalinks = {row[1]: row[5] for row in rows if len(row) > 5}
+            sources.extend(
+                {"post_id": post_id, "title": title, "permalink": permalinks.get(post_id)}
+                for post_id, title, _ in blocks
+            )
+
+        with telemetry.span("prompt_assembly"):
+            messages = build_prompt_messages(question, blocks)
+        prompt_capture.capture_prompt(question, messages)
+        return messages
+
+    def stream_answer(self, messages: list[dict], usage: dict | None = None):
+        """
+        Streams the LLM answer to the messages built by `build_messages`. The
+        token usage, including the prompt tokens served from the provider's
+        prompt cache, is read from the last chunk of the stream.
+
+        Args:
+            messages (list[dict]): The chat messages.
+            usage (dict, optional): If given, filled with the `prompt_tokens`,
+                `cached_tokens` and `completion_tokens` once the stream ends.
+        """
+        start_ns = time.time_ns()
+        start = time.perf_counter()
+        first_token = True
+        response_usage = None
 
         stream = self.client.chat.completions.create(
             model="gpt-4o-mini",
-            messages=[
-                {
-                    "role": "system",
-                    "content": f"{system_prompt}\n{follow_up_questions_prompt}",
-                },
-                {"role": "user", "content": prompt},
-            ],
+            messages=messages,
             temperature=0.0,
             stream=True,  # Enable streaming
+            stream_options={"include_usage": True},
         )
 
-        # Stream the response chunks
+        # Stream the response chunks. The usage chunk has no choices.
         for chunk in stream:
-            if chunk.choices[0].delta.content is not None:
-                content = chunk.choices[0].delta.content
-                self.usage += get_num_tokens_from_string(content)
-                yield content
+            if getattr(chunk, "usage", None) is not None:
+                response_usage = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content is not None:
+                if first_token:
+                    telemetry.record(
+                        "llm_ttft", (time.perf_counter() - start) * 1000, start_ns
+                    )
+                    first_token = False
+                yield chunk.choices[0].delta.content
         else:
-            print(f"Ouput tokens: {self.usage}")
+            # Local counts: the client is shared by the concurrent requests
+            prompt_tokens = cached_tokens = completion_tokens = 0
+            if response_usage is not None:
+                completion_tokens = response_usage.completion_tokens
+                prompt_tokens = response_usage.prompt_tokens
+                details = getattr(response_usage, "prompt_tokens_details", None)
+                cached_tokens = (details.cached_tokens or 0) if details else 0
+                telemetry.increment("llm_prompt_tokens", prompt_tokens)
+                telemetry.increment("llm_cached_tokens", cached_tokens)
+                telemetry.increment("llm_completion_tokens", completion_tokens)
+            telemetry.record(
+                "llm_stream",
+                (time.perf_counter() - start) * 1000,
+                start_ns,
+                tokens=completion_tokens,
+                prompt_tokens=prompt_tokens,
+                cached_tokens=cached_tokens,
+            )
+            print(
+                f"Prompt tokens: {prompt_tokens} ({cached_tokens} cached). "
+                f"Ouput tokens: {completion_tokens}"
+            )
+            if usage is not None:
+                usage.update(
+                    prompt_tokens=prompt_tokens,
+                    cached_tokens=cached_tokens,
+                    completion_tokens=completion_tokens,
+                )
+
+    def rag_query(self, question: str, filters: dict | None = None) -> str:
+        messages = self.build_messages(question, filters)
+        yield from self.stream_answer(messages)
+
+
+_llm_client = None
+_llm_client_pid = None
+_llm_client_lock = threading.Lock()
+
+
+def get_llm_client() -> ThrottledOpenAI:
+    """
+    Returns the process-wide client shared by the app, the search and the
+    ingest, so that they share its rate limit state and query embedding
+    cache. It is created on first use, and again in a forked process, which
+    must not reuse the HTTP connections of its parent.
+    """
+    global _llm_client, _llm_client_pid
+    with _llm_client_lock:
+        if _llm_client is None or _llm_client_pid != os.getpid():
+            _llm_client = ThrottledOpenAI()
+            _llm_client_pid = os.getpid()
+    return _llm_client
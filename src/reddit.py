@@ -3,15 +3,50 @@ import praw
 import re
 import requests
 from requests.auth import HTTPBasicAuth
+import threading
 import unicodedata
 
-from src import db
+from src import telemetry
 
-REDDIT = praw.Reddit(
-    client_id=os.getenv("REDDIT_CLIENT_ID"),
-    client_secret=os.getenv("REDDIT_CLIENT_SECRET"),
-    user_agent=os.getenv("USER_AGENT"),
-)
+_reddit = None
+_reddit_pid = None
+_reddit_lock = threading.Lock()
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def get_reddit() -> praw.Reddit:
+    """
+    Returns the process-wide PRAW client, created on first use, and again in
+    a forked process, which must not reuse the HTTP session of its parent.
+    """
+    global _reddit, _reddit_pid
+    with _reddit_lock:
+        if _reddit is None or _reddit_pid != os.getpid():
+            _reddit = praw.Reddit(
+                client_id=os.getenv("REDDIT_CLIENT_ID"),
+                client_secret=os.getenv("REDDIT_CLIENT_SECRET"),
+                user_agent=os.getenv("USER_AGENT"),
+                # Otherwise PRAW queries PyPI for a newer version on creation
+                check_for_updates=False,
+            )
+            _reddit_pid = os.getpid()
+    return _reddit
+
+
+def get_session() -> requests.Session:
+    """
+    Returns the HTTP session of the Reddit API requests, so that they reuse
+    their connections, also across warm Lambda invocations. It is created
+    again in a forked process.
+    """
+    global _session, _session_pid
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            _session = requests.Session()
+            _session_pid = os.getpid()
+    return _session
 
 
 def get_auth_token() -> str:
@@ -21,18 +56,19 @@ def get_auth_token() -> str:
     """
     url = "https://www.reddit.com/api/v1/access_token"
 
-    response = requests.post(
-        url,
-        auth=HTTPBasicAuth(
-            os.getenv("REDDIT_CLIENT_ID"), os.getenv("REDDIT_CLIENT_SECRET")
-        ),
-        data={
-            "grant_type": "password",
-            "username": os.getenv("REDDIT_USER"),
-            "password": os.getenv("REDDIT_USER_PASSWORD"),
-        },
-        headers={"User-Agent": os.getenv("USER_AGENT")},
-    )
+    with telemetry.span("reddit_auth"):
+        response = get_session().post(
+            url,
+            auth=HTTPBasicAuth(
+                os.getenv("REDDIT_CLIENT_ID"), os.getenv("REDDIT_CLIENT_SECRET")
+            ),
+            data={
+                "grant_type": "password",
+                "username": os.getenv("REDDIT_USER"),
+                "password": os.getenv("REDDIT_USER_PASSWORD"),
+            },
+            headers={"User-Agent": os.getenv("USER_AGENT")},
+        )
 
     if response.status_code != 200:
         raise Exception(f"Failed to get token. Error: {response.text}")
@@ -51,14 +87,16 @@ def get_top_posts(subreddit: str, limit: int = 100, t: str = "month", after: str
     Raises:
         Exception: If the request to the Reddit API fails.
     """
-    response = requests.get(
-        f"https://oauth.reddit.com/r/{subreddit}/top",
-        headers={
-            "Authorization": f"bearer {get_auth_token()}",
-            "User-Agent": os.getenv("USER_AGENT"),
-        },
-        params={"limit": limit, "t": t, 'after': after},
-    )
+    token = get_auth_token()
+    with telemetry.span("reddit_top_posts"):
+        response = get_session().get(
+            f"https://oauth.reddit.com/r/{subreddit}/top",
+            headers={
+                "Authorization": f"bearer {token}",
+                "User-Agent": os.getenv("USER_AGENT"),
+            },
+            params={"limit": limit, "t": t, 'after': after},
+        )
 
     if response.status_code != 200:
         raise Exception(
@@ -77,19 +115,21 @@ def get_top_posts(subreddit: str, limit: int = 100, t: str = "month", after: str
 
 def get_post_from_id(post_id: str) -> dict:
     """Fetches a Reddit post using the post's unique identifier."""
-    r = REDDIT.submission(id=post_id)
-    return dict(
-        id=post_id,
-        title=r.title,
-        description=r.selftext,
-        score=r.score,
-        upvotes=r.ups,
-        downvotes=r.downs,
-        tag=r.link_flair_text,
-        num_comments=r.num_comments,
-        permalink=r.permalink,
-        created=r.created_utc,
-    )
+    r = get_reddit().submission(id=post_id)
+    # Submissions are lazy: the request is made on the first attribute access
+    with telemetry.span("reddit_post"):
+        return dict(
+            id=post_id,
+            title=r.title,
+            description=r.selftext,
+            score=r.score,
+            upvotes=r.ups,
+            downvotes=r.downs,
+            tag=r.link_flair_text,
+            num_comments=r.num_comments,
+            permalink=r.permalink,
+            created=r.created_utc,
+        )
 
 
 def get_post_from_url(url: str) -> dict:
@@ -99,7 +139,7 @@ def get_post_from_url(url: str) -> dict:
     """
     assert url.startswith("/r/")
 
-    response = requests.get(
+    response = get_session().get(
         f"https://oauth.reddit.com/{url}",
         headers={
             "Authorization": f"bearer {get_auth_token()}",
@@ -184,12 +224,13 @@ def get_all_comments_in_post(submission_id: str) -> str:
         str: A single string containing the text of all comments, separated by
         newline characters.
     """
-    submission = REDDIT.submission(id=submission_id)
+    submission = get_reddit().submission(id=submission_id)
 
     submission.comment_sort = "best"
 
     # Replace the 'more comments' object with actual comments
-    submission.comments.replace_more(limit=None)
+    with telemetry.span("reddit_replace_more", post_id=submission_id):
+        submission.comments.replace_more(limit=None)
 
     # List to store all comments' text
     all_comments = []
@@ -198,5 +239,7 @@ def get_all_comments_in_post(submission_id: str) -> str:
     for top_level_comment in submission.comments:
         traverse_comments(top_level_comment, all_comments)
 
+    telemetry.increment("comments_collected", len(all_comments))
+
     # Join all comments into a single string
     return "\n".join(all_comments)
@@ -0,0 +1,198 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+
+import numpy as np
+
+from src import telemetry
+from src.keyword_index import tokenize
+
+# Optional re-ranking of the retrieved chunks before the context is packed:
+# "none", "onnx" (a cross-encoder exported to ONNX, e.g. a quantized
+# ms-marco-MiniLM) or "lexical" (query term coverage, no model).
+RERANK_BACKEND = os.getenv("RERANK_BACKEND", "none")
+# Directory with the `model.onnx` and `tokenizer.json` of the cross-encoder
+RERANK_MODEL_DIR = os.getenv("RERANK_MODEL_DIR")
+RERANK_MAX_LENGTH = int(os.getenv("RERANK_MAX_LENGTH", "512"))
+# Number of re-ranked chunks passed on to the context, out of the
+# CONTEXT_CANDIDATES retrieved
+RERANK_TOP_K = int(os.getenv("RERANK_TOP_K", "5"))
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "8"))
+RERANK_WORKERS = int(os.getenv("RERANK_WORKERS", "2"))
+# Number of (question, chunk) scores kept in memory
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "10000"))
+
+
+class OnnxCrossEncoder:
+    """
+    Scores (question, chunk) pairs with a cross-encoder exported to ONNX, on
+    CPU. Requires the optional `onnxruntime` and `tokenizers` packages.
+    """
+
+    def __init__(self, model_dir: str, max_length: int = 512):
+        try:
+            import onnxruntime as ort
+            from tokenizers import Tokenizer
+        except ImportError:
+            raise RuntimeError(
+                "The onnx re-ranker requires onnxruntime and tokenizers: "
+                "pip install onnxruntime tokenizers"
+            )
+
+        options = ort.SessionOptions()
+        # Batches run in parallel on the `Reranker` threads instead
+        options.intra_op_num_threads = 1
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, "model.onnx"),
+            options,
+            providers=["CPUExecutionProvider"],
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length)
+        self.tokenizer.enable_padding()
+
+    def __call__(self, question: str, contents: list[str]) -> list[float]:
+        encodings = self.tokenizer.encode_batch([(question, c) for c in contents])
+        inputs = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array(
+                [e.attention_mask for e in encodings], dtype=np.int64
+            ),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        logits = self.session.run(
+            None, {name: v for name, v in inputs.items() if name in self.input_names}
+        )[0]
+        # Relevance logit, the first one for models with several labels
+        return logits.reshape(len(contents), -1)[:, 0].tolist()
+
+
+def lexical_scorer(question: str, contents: list[str]) -> list[float]:
+    """
+    Fraction of the distinct question terms found in each chunk. A cheap
+    scorer without a model, for benchmarks and tests.
+    """
+    terms = set(tokenize(question))
+    if not terms:
+        return [0.0] * len(contents)
+    return [len(terms & set(tokenize(c))) / len(terms) for c in contents]
+
+
+class Reranker:
+    """
+    Re-scores the retrieved chunks of a question with a pluggable scorer.
+
+    The chunks are scored in batches of `batch_size` pairs, run concurrently
+    on `max_workers` threads, and the scores are cached by (question, chunk id,
+    chunk content) so that repeated questions skip the model.
+    """
+
+    def __init__(
+        self,
+        scorer,
+        batch_size: int = 8,
+        max_workers: int = 2,
+        cache_size: int = 10_000,
+    ):
+        """
+        Args:
+            scorer (callable): Returns the relevance scores of a list of chunk
+                contents for a question, higher is better, e.g.
+                `OnnxCrossEncoder` or `lexical_scorer`.
+        """
+        self.scorer = scorer
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._scores: OrderedDict[tuple, float] = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def score(self, question: str, documents: list[tuple[str, str]]) -> list[float]:
+        """Returns the score of each (id, content) document for the question."""
+        keys = [(question, id, hash(content)) for id, content in documents]
+        scores = {}
+        with self._lock:
+            for key in keys:
+                if key in self._scores:
+                    self._scores.move_to_end(key)
+                    scores[key] = self._scores[key]
+        missing = [
+            (key, content)
+            for key, (_, content) in zip(keys, documents)
+            if key not in scores
+        ]
+
+        batches = [
+            missing[start : start + self.batch_size]
+            for start in range(0, len(missing), self.batch_size)
+        ]
+        futures = [
+            self._executor.submit(self.scorer, question, [c for _, c in batch])
+            for batch in batches
+        ]
+        for batch, future in zip(batches, futures):
+            scores.update(zip((key for key, _ in batch), future.result()))
+
+        with self._lock:
+            for key, _ in missing:
+                self._scores[key] = scores[key]
+            while len(self._scores) > self.cache_size:
+                self._scores.popitem(last=False)
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+        telemetry.increment("rerank_cache_hits", len(keys) - len(missing))
+        telemetry.increment("rerank_cache_misses", len(missing))
+        return [float(scores[key]) for key in keys]
+
+    def rerank(self, question: str, rows: list[tuple], top_k: int) -> list[tuple]:
+        """
+        Re-ranks hybrid search rows of (id, post_id, title, score, content,
+        ...) and keeps the best `top_k`, with the re-ranker score in place of
+        the fused score. Ties keep the retrieval order.
+        """
+        if not rows:
+            return []
+        scores = self.score(question, [(row[0], row[4]) for row in rows])
+        order = sorted(range(len(rows)), key=lambda i: -scores[i])
+        return [(*rows[i][:3], scores[i], *rows[i][4:]) for i in order[:top_k]]
+
+
+def build_scorer(backend: str):
+    """Returns the scorer of a `RERANK_BACKEND`."""
+    if backend == "onnx":
+        if not RERANK_MODEL_DIR:
+            raise ValueError("RERANK_MODEL_DIR must be set for the onnx re-ranker")
+        return OnnxCrossEncoder(RERANK_MODEL_DIR, RERANK_MAX_LENGTH)
+    if backend == "lexical":
+        return lexical_scorer
+    raise ValueError(f"Unknown re-ranker: {backend}")
+
+
+_reranker = None
+_reranker_pid = None
+_reranker_lock = threading.Lock()
+
+
+def get_reranker() -> Reranker | None:
+    """
+    Returns the process-wide re-ranker, or None if it is disabled. The model
+    is loaded on first use, and again in a forked process, which must not
+    reuse the thread pool of its parent.
+    """
+    global _reranker, _reranker_pid
+    if RERANK_BACKEND == "none":
+        return None
+    with _reranker_lock:
+        if _reranker is None or _reranker_pid != os.getpid():
+            _reranker = Reranker(
+                build_scorer(RERANK_BACKEND),
+                batch_size=RERANK_BATCH_SIZE,
+                max_workers=RERANK_WORKERS,
+                cache_size=RERANK_CACHE_SIZE,
+            )
+            _reranker_pid = os.getpid()
+    return _reranker
@@ -0,0 +1,222 @@
+from datetime import datetime, timezone
+import json
+import os
+
+import numpy as np
+
+from src.keyword_index import BM25Index
+from src.vector_index import NumpyVectorIndex, normalize
+
+# Snapshots are directories of:
+#   - manifest.json: format version, embedding dimensions and dtype, counts
+#   - posts.jsonl: one post per line
+#   - documents.jsonl: one document (chunk) per line, without its embedding
+#   - embeddings.npy: the L2-normalized embeddings, row i being the embedding
+#     of line i of documents.jsonl. Loaded memory-mapped.
+SNAPSHOT_VERSION = 1
+
+POST_FIELDS = (
+    "id",
+    "title",
+    "description",
+    "score",
+    "upvotes",
+    "downvotes",
+    "tag",
+    "num_comments",
+    "permalink",
+    "content_hash",
+    "created_at",
+    "last_updated_at",
+)
+DOCUMENT_FIELDS = ("id", "post_id", "chunk_id", "content", "num_tokens")
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+class SnapshotWriter:
+    """
+    Writes a snapshot one post and one document at a time, so that a corpus
+    larger than memory can be exported. The embeddings are written straight
+    into a memory-mapped `.npy` file, which is why the number of documents
+    must be known upfront.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        num_documents: int,
+        dimensions: int,
+        dtype: str = "float32",
+    ):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.num_documents = num_documents
+        self.dimensions = dimensions
+        self.dtype = np.dtype(dtype)
+        # Free-form information written to the manifest, e.g. the embedding
+        # model
+        self.metadata: dict = {}
+        self.num_posts = 0
+        self._row = 0
+        self._posts = open(os.path.join(directory, "posts.jsonl"), "w")
+        self._documents = open(os.path.join(directory, "documents.jsonl"), "w")
+        self._embeddings = np.lib.format.open_memmap(
+            os.path.join(directory, "embeddings.npy"),
+            mode="w+",
+            dtype=self.dtype,
+            shape=(num_documents, dimensions),
+        )
+
+    def __enter__(self) -> "SnapshotWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close(complete=exc_type is None)
+
+    def add_post(self, post: dict) -> None:
+        self._posts.write(
+            json.dumps({f: post.get(f) for f in POST_FIELDS}, default=_json_default)
+            + "\n"
+        )
+        self.num_posts += 1
+
+    def add_document(self, document: dict, embedding=None) -> None:
+        """
+        Adds a document and its embedding. Documents without an embedding are
+        kept with a zero row and `has_embedding` false.
+        """
+        assert self._row < self.num_documents, "More documents than announced"
+        record = {f: document.get(f) for f in DOCUMENT_FIELDS}
+        record["has_embedding"] = embedding is not None
+        if embedding is not None:
+            self._embeddings[self._row] = normalize(embedding)
+        self._documents.write(json.dumps(record) + "\n")
+        self._row += 1
+
+    def close(self, complete: bool = True) -> None:
+        """Flushes the files and writes the manifest, last, if complete."""
+        if self._embeddings is None:
+            return
+        self._posts.close()
+        self._documents.close()
+        self._embeddings.flush()
+        self._embeddings = None
+        if not complete:
+            return
+        assert self._row == self.num_documents, "Fewer documents than announced"
+        manifest = {
+            "version": SNAPSHOT_VERSION,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "num_posts": self.num_posts,
+            "num_documents": self.num_documents,
+            "dimensions": self.dimensions,
+            "dtype": str(self.dtype),
+            **self.metadata,
+        }
+        with open(os.path.join(self.directory, "manifest.json"), "w") as f:
+            json.dump(manifest, f, indent=4)
+
+
+def read_manifest(directory: str) -> dict:
+    """
+    Returns the manifest of a snapshot. A snapshot without a manifest was not
+    completely written.
+    """
+    path = os.path.join(directory, "manifest.json")
+    if not os.path.exists(path):
+        raise ValueError(f"{directory} is not a complete snapshot")
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest["version"] != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version {manifest['version']}")
+    return manifest
+
+
+def _read_jsonl(path: str):
+    with open(path) as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def iter_posts(directory: str):
+    """Yields the posts of a snapshot, with datetimes parsed."""
+    for post in _read_jsonl(os.path.join(directory, "posts.jsonl")):
+        for key in ("created_at", "last_updated_at"):
+            if post[key] is not None:
+                post[key] = datetime.fromisoformat(post[key])
+        yield post
+
+
+def iter_documents(directory: str):
+    """Yields the documents of a snapshot, in the order of the embedding rows."""
+    yield from _read_jsonl(os.path.join(directory, "documents.jsonl"))
+
+
+def load_embeddings(directory: str, mmap: bool = True) -> np.ndarray:
+    """Returns the embedding matrix of a snapshot, memory-mapped by default."""
+    return np.load(
+        os.path.join(directory, "embeddings.npy"), mmap_mode="r" if mmap else None
+    )
+
+
+def _watermark(directory: str) -> str | None:
+    """
+    The latest `last_updated_at` of the snapshot posts, from which a loaded
+    index is refreshed, see `db.refresh_local_index`.
+    """
+    dates = [
+        p["last_updated_at"] for p in iter_posts(directory) if p["last_updated_at"]
+    ]
+    return max(dates).isoformat() if dates else None
+
+
+def load_vector_index(
+    directory: str, mmap: bool = True, dimensions: int | None = None
+) -> NumpyVectorIndex:
+    """
+    Loads the embeddings of a snapshot as an in-process vector index, without
+    copying them when memory-mapped. Documents without an embedding are left
+    out. The embedding model and dimensions of the snapshot are kept in the
+    index metadata.
+
+    Raises:
+        ValueError: If the snapshot embeddings do not have `dimensions`.
+    """
+    manifest = read_manifest(directory)
+    if dimensions is not None and manifest["dimensions"] != dimensions:
+        raise ValueError(
+            f"The snapshot embeddings have {manifest['dimensions']} dimensions, "
+            f"not {dimensions}"
+        )
+    embeddings = load_embeddings(directory, mmap)
+    if embeddings.shape[1] != manifest["dimensions"]:
+        raise ValueError(f"{directory}/embeddings.npy does not match the manifest")
+    ids, rows = [], []
+    for row, document in enumerate(iter_documents(directory)):
+        if document["has_embedding"]:
+            ids.append(document["id"])
+            rows.append(row)
+
+    if len(rows) < embeddings.shape[0]:
+        embeddings = np.ascontiguousarray(embeddings[rows])
+    # Rows are normalized when written
+    index = NumpyVectorIndex.from_normalized(ids, embeddings)
+    index.metadata["watermark"] = _watermark(directory)
+    index.metadata["embedding_model"] = manifest.get("embedding_model")
+    index.metadata["dimensions"] = manifest["dimensions"]
+    return index
+
+
+def load_keyword_index(directory: str) -> BM25Index:
+    """Builds an in-process BM25 index from the documents of a snapshot."""
+    read_manifest(directory)
+    index = BM25Index()
+    documents = list(iter_documents(directory))
+    index.add([d["id"] for d in documents], [d["content"] for d in documents])
+    index.metadata["watermark"] = _watermark(directory)
+    return index
@@ -0,0 +1,317 @@
+from contextlib import contextmanager
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Where finished traces are sent: "none" (default), "log" (one JSON line per
+# trace) or "otlp" (OpenTelemetry, needs the opentelemetry-sdk and
+# opentelemetry-exporter-otlp packages and the standard OTEL_* variables).
+TELEMETRY_EXPORTER = os.getenv("TELEMETRY_EXPORTER", "none")
+
+# Upper bounds of the latency histogram buckets, in milliseconds
+HISTOGRAM_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1_000, 2_500, 5_000, 10_000)
+
+
+class Span:
+    """A timed stage of a request."""
+
+    def __init__(self, name: str, start_ns: int, duration_ms: float, attributes: dict):
+        self.name = name
+        self.start_ns = start_ns
+        self.duration_ms = duration_ms
+        self.attributes = attributes
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "duration_ms": self.duration_ms,
+            "attributes": self.attributes,
+        }
+
+
+class Trace:
+    """The spans recorded while the trace is active, see `activate`."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.start_ns = time.time_ns()
+        self.spans: list[Span] = []
+        self.counters: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def increment(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def server_timing(self) -> str:
+        """
+        Formats the spans recorded so far as a `Server-Timing` header value,
+        e.g. `embed_query;dur=120.5, vector_search;dur=8.2`.
+        """
+        with self._lock:
+            spans = list(self.spans)
+        return ", ".join(f"{s.name};dur={s.duration_ms:.1f}" for s in spans)
+
+    def durations(self) -> dict[str, float]:
+        """Total duration in milliseconds of each span name recorded so far."""
+        with self._lock:
+            spans = list(self.spans)
+        durations: dict[str, float] = {}
+        for s in spans:
+            durations[s.name] = durations.get(s.name, 0.0) + s.duration_ms
+        return durations
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            spans = [s.to_dict() for s in self.spans]
+            counters = dict(self.counters)
+        return {
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "spans": spans,
+            "counters": counters,
+        }
+
+    def summary(self) -> dict:
+        """
+        Aggregates the trace into a report: the counters, and the number,
+        total and percentiles of the durations of each span name.
+        """
+        from src.evaluation import latency_summary
+
+        with self._lock:
+            spans = list(self.spans)
+            counters = dict(self.counters)
+
+        durations: dict[str, list[float]] = {}
+        for s in spans:
+            durations.setdefault(s.name, []).append(s.duration_ms)
+
+        return {
+            "name": self.name,
+            "started_at": time.strftime(
+                "%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.start_ns / 1e9)
+            ),
+            "duration_s": (time.time_ns() - self.start_ns) / 1e9,
+            "counters": counters,
+            "stages": {
+                name: {"total_ms": sum(values), **latency_summary(values)}
+                for name, values in sorted(durations.items())
+            },
+        }
+
+
+class Metrics:
+    """
+    Latency histograms per span name and event counters, rendered in the
+    Prometheus text format.
+    Each process keeps its own metrics: with several gunicorn workers, each
+    scrape reads the worker that served it.
+    """
+
+    def __init__(self, buckets_ms: tuple = HISTOGRAM_BUCKETS_MS):
+        self.buckets_ms = buckets_ms
+        # name -> [bucket counts..., count, sum]
+        self._histograms: dict[str, list[float]] = {}
+        self._counters: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def counters(self) -> dict[str, float]:
+        with self._lock:
+            return dict(self._counters)
+
+    def observe(self, name: str, duration_ms: float) -> None:
+        with self._lock:
+            histogram = self._histograms.setdefault(
+                name, [0] * len(self.buckets_ms) + [0, 0.0]
+            )
+            for i, bound in enumerate(self.buckets_ms):
+                if duration_ms <= bound:
+                    histogram[i] += 1
+            histogram[-2] += 1
+            histogram[-1] += duration_ms
+
+    def snapshot(self) -> dict[str, dict]:
+        """Count and total duration of each span name."""
+        with self._lock:
+            return {
+                name: {"count": h[-2], "sum_ms": h[-1]}
+                for name, h in self._histograms.items()
+            }
+
+    def render(self) -> str:
+        lines = [
+            "# HELP rag_stage_duration_ms Duration of the RAG request stages.",
+            "# TYPE rag_stage_duration_ms histogram",
+        ]
+        with self._lock:
+            histograms = {name: list(h) for name, h in self._histograms.items()}
+        for name, h in sorted(histograms.items()):
+            for bound, count in zip(self.buckets_ms, h):
+                lines.append(
+                    f'rag_stage_duration_ms_bucket{{stage="{name}",le="{bound}"}} {count}'
+                )
+            lines.append(f'rag_stage_duration_ms_bucket{{stage="{name}",le="+Inf"}} {h[-2]}')
+            lines.append(f'rag_stage_duration_ms_count{{stage="{name}"}} {h[-2]}')
+            lines.append(f'rag_stage_duration_ms_sum{{stage="{name}"}} {h[-1]}')
+
+        counters = self.counters()
+        if counters:
+            lines += [
+                "# HELP rag_events_total Number of events, e.g. posts inserted or tokens embedded.",
+                "# TYPE rag_events_total counter",
+            ]
+            for name, value in sorted(counters.items()):
+                lines.append(f'rag_events_total{{name="{name}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+
+class NoopExporter:
+    def export(self, trace: Trace) -> None:
+        pass
+
+
+class LogExporter:
+    def export(self, trace: Trace) -> None:
+        logger.info(json.dumps(trace.to_dict()))
+
+
+class OTLPExporter:
+    """Replays finished traces as OpenTelemetry spans with their original times."""
+
+    def __init__(self):
+        try:
+            from opentelemetry import trace as otel_trace
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import (
+                OTLPSpanExporter,
+            )
+            from opentelemetry.sdk.resources import Resource
+            from opentelemetry.sdk.trace import TracerProvider
+            from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        except ImportError:
+            raise ImportError(
+                "TELEMETRY_EXPORTER=otlp requires the opentelemetry-sdk and "
+                "opentelemetry-exporter-otlp packages."
+            )
+
+        provider = TracerProvider(resource=Resource.create({"service.name": "rag-reddit"}))
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+        self._otel_trace = otel_trace
+        self._tracer = provider.get_tracer(__name__)
+
+    def export(self, trace: Trace) -> None:
+        spans = trace.to_dict()["spans"]
+        end_ns = max(
+            [trace.start_ns]
+            + [int(s["start_ns"] + s["duration_ms"] * 1e6) for s in spans]
+        )
+        root = self._tracer.start_span(trace.name, start_time=trace.start_ns)
+        context = self._otel_trace.set_span_in_context(root)
+        for s in spans:
+            child = self._tracer.start_span(
+                s["name"],
+                context=context,
+                start_time=s["start_ns"],
+                attributes=s["attributes"],
+            )
+            child.end(end_time=int(s["start_ns"] + s["duration_ms"] * 1e6))
+        root.end(end_time=end_ns)
+
+
+# Registry of the trace exporters selected with TELEMETRY_EXPORTER
+EXPORTERS = {
+    "none": NoopExporter,
+    "log": LogExporter,
+    "otlp": OTLPExporter,
+}
+
+metrics = Metrics()
+_exporter = None
+_exporter_lock = threading.Lock()
+_current_trace: contextvars.ContextVar[Trace | None] = contextvars.ContextVar(
+    "current_trace", default=None
+)
+
+
+def get_exporter():
+    """Returns the exporter selected by TELEMETRY_EXPORTER, created on first use."""
+    global _exporter
+    with _exporter_lock:
+        if _exporter is None:
+            _exporter = EXPORTERS[TELEMETRY_EXPORTER]()
+    return _exporter
+
+
+@contextmanager
+def activate(trace: Trace):
+    """Records the spans of the enclosed code on `trace`."""
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+def record(name: str, duration_ms: float, start_ns: int | None = None, **attributes) -> None:
+    """
+    Records an already measured duration, e.g. the time to first token, in
+    the metrics and on the active trace (if any).
+    """
+    metrics.observe(name, duration_ms)
+    trace = _current_trace.get()
+    if trace is not None:
+        if start_ns is None:
+            start_ns = time.time_ns() - int(duration_ms * 1e6)
+        trace.add(Span(name, start_ns, duration_ms, attributes))
+
+
+def increment(name: str, value: float = 1) -> None:
+    """Adds to a counter in the metrics and on the active trace (if any)."""
+    metrics.increment(name, value)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.increment(name, value)
+
+
+def submit(executor, function, *args):
+    """
+    Submits a function to an executor so that it records its spans on the
+    active trace: worker threads do not inherit the caller's context.
+    """
+    return executor.submit(contextvars.copy_context().run, function, *args)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Times the enclosed code. Yields the span attributes, which may be
+    completed inside the block (e.g. with a number of tokens).
+    """
+    start_ns = time.time_ns()
+    start = time.perf_counter()
+    try:
+        yield attributes
+    finally:
+        record(name, (time.perf_counter() - start) * 1000, start_ns, **attributes)
+
+
+def export(trace: Trace) -> None:
+    """Sends a finished trace to the configured exporter. Never raises."""
+    try:
+        get_exporter().export(trace)
+    except Exception as e:
+        logger.error(f"Error exporting trace {trace.name}: {str(e)}")
@@ -0,0 +1,96 @@
+import re
+
+# A double-quoted phrase or a whitespace-separated token, each optionally
+# preceded by "-" to exclude it
+CLAUSE_PATTERN = re.compile(r'(-?)"([^"]*)"?|(-?)([^\s"]+)')
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def _quote(word: str) -> str:
+    # Words only contain \w characters, so they never need escaping
+    return f"'{word}'"
+
+
+def _phrase(words: list[str], stopwords: frozenset) -> str:
+    """
+    Returns the tsquery of consecutive words. Stopwords are dropped and the
+    distance between the remaining words kept, as `phraseto_tsquery` does.
+    """
+    parts, distance = [], 0
+    for word in words:
+        distance += 1
+        if word in stopwords:
+            continue
+        if parts:
+            parts.append("<->" if distance == 1 else f"<{distance}>")
+        parts.append(_quote(word))
+        distance = 0
+    return " ".join(parts)
+
+
+def parse_query(
+    text_query: str, stopwords: frozenset = frozenset()
+) -> tuple[list[str], list[str]]:
+    """
+    Parses a question into `to_tsquery` clauses, with a subset of the web
+    search syntax:
+        - words, e.g. `airflow` -> 'airflow'
+        - prefixes, e.g. `orchestrat*` -> 'orchestrat':*
+        - "double-quoted phrases", e.g. `"data lake"` -> 'data' <-> 'lake'
+        - exclusions, e.g. `-azure` or `-"data lake"`
+
+    Text is lowercased and split into words on non-word characters, and
+    stopwords are dropped, so that a question without operators gives the
+    same words as `plainto_tsquery`.
+
+    Args:
+        text_query (str): The user question.
+        stopwords (frozenset): Words dropped from the query, those of the
+            text search configuration.
+    Returns:
+        tuple[list[str], list[str]]: The included and the excluded clauses,
+            without duplicates.
+    """
+    included, excluded = {}, {}
+    for match in CLAUSE_PATTERN.finditer(text_query.lower()):
+        phrase_sign, phrase, token_sign, token = match.groups()
+        if phrase is not None:
+            clauses = [_phrase(WORD_PATTERN.findall(phrase), stopwords)]
+            sign = phrase_sign
+        else:
+            words = WORD_PATTERN.findall(token)
+            clauses = [_quote(w) for w in words if w not in stopwords]
+            if token.endswith("*") and words and words[-1] not in stopwords:
+                clauses[-1] += ":*"
+            sign = token_sign
+        for clause in clauses:
+            if clause:
+                (excluded if sign == "-" else included)[clause] = None
+    return list(included), list(excluded)
+
+
+def build_tsqueries(
+    text_query: str, stopwords: frozenset = frozenset()
+) -> tuple[str, str]:
+    """
+    Builds the `to_tsquery` input of the two keyword legs of the hybrid
+    search from a question, see `parse_query`.
+
+    Returns:
+        tuple[str, str]: The queries matching any and all of the included
+            clauses, and none of the excluded ones. Both are empty when the
+            question has no included clause, e.g. only stopwords.
+    """
+    included, excluded = parse_query(text_query, stopwords)
+    if not included:
+        return "", ""
+
+    def group(clause: str) -> str:
+        return f"({clause})" if " " in clause else clause
+
+    exclusions = "".join(f" & !{group(c)}" for c in excluded)
+    any_query = " | ".join(group(c) for c in included)
+    if len(included) > 1 and exclusions:
+        any_query = f"({any_query})"
+    all_query = " & ".join(group(c) for c in included)
+    return any_query + exclusions, all_query + exclusions
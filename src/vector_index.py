@@ -0,0 +1,174 @@
+import json
+import os
+import threading
+
+import numpy as np
+
+# Rows scored per block when the matrix is stored as float16. Bounds the size
+# of the temporary float32 copy made for the matrix product.
+BLOCK_SIZE = 65_536
+
+
+def normalize(matrix: np.ndarray) -> np.ndarray:
+    """L2-normalizes the rows of a matrix. Zero rows are left as zeros."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class NumpyVectorIndex:
+    """
+    In-process exact cosine similarity index over the document embeddings.
+
+    Embeddings are stored as a contiguous float32 (or float16, half the memory)
+    matrix with L2-normalized rows, so a search is a single matrix-vector
+    product followed by an `argpartition` top-k. Saved indexes are loaded
+    memory-mapped, so several worker processes share the same pages.
+
+    Updates are copy-on-write: `add` and `remove` build new arrays and swap
+    them in at once, so concurrent searches always see a consistent snapshot.
+    """
+
+    def __init__(self, dtype: str = "float32"):
+        self.dtype = np.dtype(dtype)
+        assert self.dtype in (np.float32, np.float16)
+        # (ids, positions of the ids, matrix) replaced as a whole on update
+        self._state = ([], {}, np.empty((0, 0), dtype=self.dtype))
+        self._lock = threading.Lock()
+        # Free-form information saved along with the index, e.g. the point up
+        # to which the index has been refreshed
+        self.metadata: dict = {}
+
+    def __len__(self) -> int:
+        return len(self._state[0])
+
+    def __contains__(self, id: str) -> bool:
+        return id in self._state[1]
+
+    @property
+    def ids(self) -> list[str]:
+        return list(self._state[0])
+
+    def add(self, ids: list[str], embeddings) -> None:
+        """
+        Adds embeddings to the index. Ids already in the index are replaced,
+        e.g. when a modified post is re-inserted with the same document ids.
+        """
+        if len(ids) == 0:
+            return
+        embeddings = normalize(embeddings).astype(self.dtype)
+        assert embeddings.shape[0] == len(ids)
+
+        with self._lock:
+            old_ids, old_positions, matrix = self._state
+            if len(old_ids) == 0:
+                matrix = np.empty((0, embeddings.shape[1]), dtype=self.dtype)
+            assert matrix.shape[1] == embeddings.shape[1]
+
+            new_ids = list(old_ids)
+            positions = dict(old_positions)
+            replaced, appended = [], []
+            for row, id in enumerate(ids):
+                if id in positions:
+                    replaced.append((positions[id], row))
+                else:
+                    positions[id] = len(new_ids)
+                    new_ids.append(id)
+                    appended.append(row)
+
+            matrix = np.concatenate([matrix, embeddings[appended]])
+            for position, row in replaced:
+                matrix[position] = embeddings[row]
+
+            self._state = (new_ids, positions, matrix)
+
+    def remove(self, ids: list[str]) -> None:
+        """Removes embeddings from the index. Unknown ids are ignored."""
+        with self._lock:
+            old_ids, positions, matrix = self._state
+            drop = {positions[id] for id in ids if id in positions}
+            if len(drop) == 0:
+                return
+            keep = [i for i in range(len(old_ids)) if i not in drop]
+            new_ids = [old_ids[i] for i in keep]
+            self._state = (
+                new_ids,
+                {id: i for i, id in enumerate(new_ids)},
+                np.ascontiguousarray(matrix[keep]),
+            )
+
+    def _scores(self, matrix: np.ndarray, queries: np.ndarray) -> np.ndarray:
+        """Cosine similarities of shape (num_queries, num_rows)."""
+        if matrix.dtype == np.float32:
+            return queries @ matrix.T
+
+        # NumPy has no fast float16 matrix product: score block by block
+        scores = np.empty((queries.shape[0], matrix.shape[0]), dtype=np.float32)
+        for start in range(0, matrix.shape[0], BLOCK_SIZE):
+            block = matrix[start : start + BLOCK_SIZE].astype(np.float32)
+            scores[:, start : start + BLOCK_SIZE] = queries @ block.T
+        return scores
+
+    def search_batch(self, vectors, limit: int) -> list[list[tuple]]:
+        """
+        Returns, for each query vector, the id, rank and cosine similarity of
+        the `limit` most similar documents, in the same format as
+        `db.vector_search`.
+        """
+        ids, _, matrix = self._state
+        queries = normalize(np.atleast_2d(vectors))
+        k = min(limit, len(ids))
+        if k == 0:
+            return [[] for _ in range(queries.shape[0])]
+
+        scores = self._scores(matrix, queries)
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+
+        results = []
+        for q in range(queries.shape[0]):
+            order = top[q][np.argsort(-scores[q, top[q]], kind="stable")]
+            results.append(
+                [
+                    (ids[i], rank, float(scores[q, i]))
+                    for rank, i in enumerate(order, start=1)
+                ]
+            )
+        return results
+
+    def search(self, vector, limit: int) -> list[tuple]:
+        """Returns the id, rank and similarity of the `limit` most similar documents."""
+        return self.search_batch([vector], limit)[0]
+
+    def save(self, directory: str) -> None:
+        """Writes the index as `embeddings.npy` and `ids.json`."""
+        os.makedirs(directory, exist_ok=True)
+        ids, _, matrix = self._state
+        np.save(os.path.join(directory, "embeddings.npy"), matrix)
+        with open(os.path.join(directory, "ids.json"), "w") as f:
+            json.dump({"ids": ids, "metadata": self.metadata}, f)
+
+    @classmethod
+    def from_normalized(cls, ids: list[str], matrix: np.ndarray) -> "NumpyVectorIndex":
+        """
+        Builds an index over a matrix whose rows are already L2-normalized,
+        e.g. memory-mapped from disk, without copying it.
+        """
+        if len(ids) != matrix.shape[0]:
+            raise ValueError(f"{len(ids)} ids for {matrix.shape[0]} embeddings")
+        index = cls(dtype=str(matrix.dtype))
+        index._state = (list(ids), {id: i for i, id in enumerate(ids)}, matrix)
+        return index
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> "NumpyVectorIndex":
+        """Loads an index written with `save`, memory-mapped by default."""
+        matrix = np.load(
+            os.path.join(directory, "embeddings.npy"), mmap_mode="r" if mmap else None
+        )
+        with open(os.path.join(directory, "ids.json")) as f:
+            data = json.load(f)
+
+        index = cls.from_normalized(data["ids"], matrix)
+        index.metadata = data["metadata"]
+        return index
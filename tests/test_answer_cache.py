@@ -0,0 +1,63 @@
+import time
+
+from src import answer_cache
+
+VECTORS = {
+    "What are DE salaries?": [1.0, 0.0, 0.0],
+    "What are data engineer salaries?": [0.99, 0.1, 0.0],
+    "Best orchestration tool?": [0.0, 1.0, 0.0],
+    "How to learn Spark?": [0.0, 0.0, 1.0],
+}
+
+
+def make_cache(version: list[str], **kwargs) -> answer_cache.AnswerCache:
+    return answer_cache.AnswerCache(
+        embed=VECTORS.__getitem__,
+        corpus_version=lambda: version[0],
+        version_seconds=0,
+        **kwargs,
+    )
+
+
+def test_lookup_similar_question():
+    cache = make_cache(["v1"], threshold=0.95)
+    assert cache.lookup("What are DE salaries?") is None
+
+    cache.store("What are DE salaries?", None, ["It ", "depends."])
+    assert cache.lookup("What are data engineer salaries?") == ["It ", "depends."]
+    assert cache.lookup("Best orchestration tool?") is None
+    assert (cache.hits, cache.misses) == (1, 2)
+    assert cache.hit_rate == 1 / 3
+
+
+def test_lookup_filters():
+    cache = make_cache(["v1"])
+    cache.store("What are DE salaries?", {"tag": "Career"}, ["answer"])
+    assert cache.lookup("What are DE salaries?") is None
+    assert cache.lookup("What are DE salaries?", {"tag": "Career"}) == ["answer"]
+
+
+def test_corpus_version_invalidates():
+    version = ["v1"]
+    cache = make_cache(version)
+    cache.store("What are DE salaries?", None, ["answer"])
+    version[0] = "v2"
+    assert cache.lookup("What are DE salaries?") is None
+    assert len(cache) == 0
+
+
+def test_eviction_by_size_and_age():
+    cache = make_cache(["v1"], max_entries=2)
+    cache.store("What are DE salaries?", None, ["a"])
+    cache.store("Best orchestration tool?", None, ["b"])
+    # Recently used entries are kept
+    assert cache.lookup("What are DE salaries?") == ["a"]
+    cache.store("How to learn Spark?", None, ["c"])
+    assert len(cache) == 2
+    assert cache.lookup("Best orchestration tool?") is None
+    assert cache.lookup("What are DE salaries?") == ["a"]
+
+    cache = make_cache(["v1"], max_age_seconds=0.01)
+    cache.store("What are DE salaries?", None, ["a"])
+    time.sleep(0.02)
+    assert cache.lookup("What are DE salaries?") is None
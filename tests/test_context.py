@@ -0,0 +1,60 @@
+from src import context
+
+
+def make_chunks(title: str, text: str, size: int, overlap: int) -> list[str]:
+    """Splits words like `db.insert_documents_from_comments_body` splits tokens."""
+    words = text.split(" ")
+    chunks = []
+    start = 0
+    while start < len(words):
+        chunk = " ".join(words[start : start + size])
+        chunks.append(f"{title}\n{chunk}")
+        if start + size >= len(words):
+            break
+        start += size - overlap
+    return chunks
+
+
+def test_merge_overlap():
+    words = [f"word{i}" for i in range(30)]
+    previous = " ".join(words[:20])
+    following = " ".join(words[12:])
+    merged = context.merge_overlap(previous, following, max_chars=100)
+    assert merged == " ".join(words)
+
+    # Overlaps shorter than the anchor are not merged
+    assert context.merge_overlap("a b c d", "c d e f", max_chars=100) == "a b c d\nc d e f"
+
+
+def test_pack_context_merges_adjacent_chunks():
+    text = " ".join(f"w{i}" for i in range(100))
+    chunks = make_chunks("Title", text, size=40, overlap=10)
+    sources = [
+        ("p1_2", "p1", "Title", 0.9, chunks[1]),
+        ("p2_1", "p2", "Other", 0.8, "Other\nshort post"),
+        ("p1_1", "p1", "Title", 0.7, chunks[0]),
+    ]
+    token_counts = {"p1_1": 40, "p1_2": 40, "p2_1": 3}
+
+    blocks, used = context.pack_context(sources, token_counts, budget=1000, chunk_overlap=10)
+    assert [b[0] for b in blocks] == ["p1", "p2"]
+    assert blocks[0][2] == " ".join(f"w{i}" for i in range(70))
+    assert blocks[1] == ("p2", "Other", "short post")
+    assert used == 40 + 3 + 30
+
+
+def test_pack_context_budget():
+    sources = [
+        ("p1_1", "p1", "A", 0.9, "A\nlong"),
+        ("p2_1", "p2", "B", 0.8, "B\nshort"),
+        ("p3_1", "p3", "C", 0.7, "C\nshort"),
+    ]
+    token_counts = {"p1_1": 500, "p2_1": 50, "p3_1": 50}
+
+    blocks, used = context.pack_context(sources, token_counts, budget=120)
+    assert [b[0] for b in blocks] == ["p2", "p3"]
+    assert used == 100
+
+    # Missing counts fall back to the given counter
+    blocks, used = context.pack_context(sources, {}, budget=120, count_tokens=len)
+    assert len(blocks) == 3
@@ -1,15 +1,23 @@
+from datetime import datetime
 import json
+import numpy as np
 import os
+import pytest
 from sqlalchemy.sql import text
 
-from src import db
+from src import db, rag
 
 OUTPUT_DIR =  os.path.join(os.path.dirname(__file__), "output")
 
+def test_get_engine():
+    engine = db.get_engine()
+    assert db.get_engine() is engine
+
+
 def test_database_connection():
     """Test if we can connect to the database and perform a simple query."""
     try:
-        with db.engine.connect() as connection:
+        with db.get_engine().connect() as connection:
             result = connection.execute(text("SELECT 1"))
             assert result.scalar() == 1
     except Exception as e:
@@ -34,7 +42,7 @@ def test_insert_reddit_post():
             }
         )
 
-        with db.Session(db.engine) as session:
+        with db.Session(db.get_engine()) as session:
             post = session.query(db.RedditPosts).filter_by(id="11AAZZ").first()
             assert post.title == "What do you think about this?"
             assert post.description == "This is a test post"
@@ -47,7 +55,7 @@ def test_insert_reddit_post():
     except Exception as e:
         raise e
     finally:
-        with db.Session(db.engine) as session:
+        with db.Session(db.get_engine()) as session:
             session.query(db.RedditPosts).filter_by(id="11AAZZ").delete()
             session.commit()
 
@@ -61,7 +69,7 @@ def test_get_posts_url():
         "1brqa92": "/r/dataengineering/comments/1brqa92/is_this_chart_accurate/",
     }
 
-    # checks urls are returned in alphabetical order
+    # second call is served from the permalink cache
     urls = db.get_posts_url(["1brqa92", "1arwf4u"])
     assert type(urls) == dict
     assert len(urls) > 0
@@ -77,11 +85,11 @@ def test_vector_search():
         "what are key features of a good data engineering team?", limit=5
     )
     assert type(rows) == list
-    assert len(rows[0]) == 2
+    assert len(rows[0]) == 3
     assert type(rows[0][1]) == int
     ids = [r[0] for r in rows]
 
-    with db.Session(db.engine) as session:
+    with db.Session(db.get_engine()) as session:
         posts = session.query(db.Documents).filter(
             db.Documents.id.in_(ids)).all()
         assert len(posts) == 5
@@ -94,7 +102,7 @@ def test_keyword_search():
 
     rows = db.keyword_search("What are key features of a snowflake", limit=5)
     assert type(rows) == list
-    assert len(rows[0]) == 2
+    assert len(rows[0]) == 3
     assert type(rows[0][1]) == int
 
     with open(os.path.join(OUTPUT_DIR, "keyword_search.json"), "w") as f:
@@ -105,7 +113,7 @@ def test_keyword_search_match_all():
 
     rows = db.keyword_search(query, limit=5)
     assert type(rows) == list
-    assert len(rows[0]) == 2
+    assert len(rows[0]) == 3
     assert type(rows[0][1]) == int
 
     # DEV NOTE: This test is expected to fail because the query is too specific
@@ -113,6 +121,21 @@ def test_keyword_search_match_all():
     assert len(rows) == 0
 
 
+def test_keyword_searches_query_syntax():
+    any_rows, all_rows = db._postgres_keyword_searches("snowflake argentina", 20)
+    # The documents matching all the words are a subset of those matching any
+    assert {r[0] for r in all_rows} <= {r[0] for r in any_rows}
+
+    excluded, _ = db._postgres_keyword_searches("snowflake -argentina", 20)
+    assert {r[0] for r in excluded} <= {r[0] for r in any_rows}
+    assert {r[0] for r in excluded}.isdisjoint(r[0] for r in all_rows)
+
+    phrase, _ = db._postgres_keyword_searches('"data engineering"', 5)
+    assert len(phrase) == 5
+
+    assert db._postgres_keyword_searches("what is it?", 5) == ([], [])
+
+
 def test_hybrid_search():
 
     rows = db.hybrid_search(
@@ -120,7 +143,7 @@ def test_hybrid_search():
 
     assert type(rows) == list
     assert len(rows) == 5  # 5 rows
-    assert len(rows[0]) == 5  # 4 columns
+    assert len(rows[0]) == 6  # 6 columns
 
     # check document id attribute
     assert type(rows[0][0]) == str
@@ -138,6 +161,13 @@ def test_hybrid_search():
     assert type(rows[0][4]) == str
     assert len(rows[0][4]) > 100
 
+    # check permalink attribute
+    assert rows[0][5].startswith("/r/")
+
+    token_counts = {}
+    rows = db.hybrid_search("Snowflake Argentina", limit=5, token_counts=token_counts)
+    assert token_counts == db.get_document_token_counts([r[0] for r in rows])
+
 
 def test_is_post_modified():
     result = db.is_post_modified("1aieu3j")
@@ -147,3 +177,229 @@ def test_is_post_modified():
 def test_get_posts_without_documents():
     result = db.get_posts_without_documents()
     assert len(result) == 0
+
+
+def test_parse_filters():
+    filters = db.parse_filters(
+        {"tag": "Career", "created_after": "2024-01-01", "min_score": "100"}
+    )
+    assert filters["tag"] == "Career"
+    assert filters["created_after"] == datetime(2024, 1, 1)
+    assert filters["min_score"] == 100
+
+    assert db.parse_filters(None) == {}
+    with pytest.raises(ValueError):
+        db.parse_filters({"subreddit": "dataengineering"})
+    for filters in (
+        {"created_after": 20240101},
+        {"created_before": ["2024-01-01"]},
+        {"min_score": {"gte": 100}},
+        {"min_score": float("inf")},
+        {"tag": 1},
+    ):
+        with pytest.raises(ValueError):
+            db.parse_filters(filters)
+
+
+def test_hybrid_search_with_filters():
+
+    rows = db.hybrid_search(
+        "What are key features of a good data engineering team?",
+        limit=5,
+        filters={"tag": "Career"},
+    )
+    assert len(rows) == 5
+
+    with db.Session(db.get_engine()) as session:
+        tags = {
+            post.tag
+            for post in session.query(db.RedditPosts)
+            .filter(db.RedditPosts.id.in_([r[1] for r in rows]))
+            .all()
+        }
+    assert tags == {"Career"}
+
+
+def test_parse_fusion(monkeypatch):
+    fusion = db.parse_fusion(
+        {"method": "linear", "vector_depth": "50", "keyword_weight": 2}
+    )
+    assert fusion == {"method": "linear", "vector_depth": 50, "keyword_weight": 2.0}
+
+    assert db.parse_fusion(None) == {}
+    with pytest.raises(ValueError):
+        db.parse_fusion({"method": "borda"})
+    with pytest.raises(ValueError):
+        db.parse_fusion({"vector_depth": db.FUSION_MAX_DEPTH + 1})
+    with monkeypatch.context() as m:
+        m.setattr(db, "FUSION_MAX_DEPTH", 5000)
+        assert db.parse_fusion({"keyword_depth": 2000}) == {"keyword_depth": 2000}
+        with pytest.raises(ValueError):
+            db.parse_fusion({"vector_depth": db.HNSW_MAX_EF_SEARCH + 1})
+    with pytest.raises(ValueError):
+        db.parse_fusion({"reranker": "cross-encoder"})
+    for fusion in (
+        {"vector_depth": 1e400},
+        {"keyword_weight": float("nan")},
+        {"rrf_k": float("inf")},
+        {"exact_weight": 10**400},
+    ):
+        with pytest.raises(ValueError):
+            db.parse_fusion(fusion)
+
+
+def test_leg_depths():
+    assert db.leg_depths(5, {"score": 0, "comments": 0, "recency": 0}) == (5, 5, 5)
+    assert db.leg_depths(
+        5,
+        {"score": 0, "comments": 0, "recency": 0},
+        {"vector_depth": 40, "exact_depth": 10},
+    ) == (40, 5, 10)
+
+
+def test_partition_ranges():
+    assert db.partition_bounds(datetime(2024, 12, 31, 23), "month") == (
+        datetime(2024, 12, 1),
+        datetime(2025, 1, 1),
+    )
+    ranges = db.partition_ranges(datetime(2023, 6, 1), datetime(2025, 1, 1), "year")
+    assert [name for name, _, _ in ranges] == [
+        "documents_p2023",
+        "documents_p2024",
+        "documents_p2025",
+    ]
+    assert db.parse_partition_name("documents_p2024_03") == (
+        datetime(2024, 3, 1),
+        datetime(2024, 4, 1),
+    )
+    with pytest.raises(ValueError):
+        db.parse_partition_name("documents_default")
+    with pytest.raises(ValueError):
+        db.partition_bounds(datetime(2024, 1, 1), "week")
+
+
+def test_check_archived_filters():
+    archived = [db.parse_partition_name("documents_p2019")]
+    db.check_archived_filters({"created_after": datetime(2020, 1, 1)}, archived)
+    db.check_archived_filters({"tag": "Career"}, archived)
+    with pytest.raises(ValueError):
+        db.check_archived_filters({"created_before": datetime(2019, 6, 1)}, archived)
+    with pytest.raises(ValueError):
+        db.check_archived_filters(
+            db.parse_filters({"created_after": "2019-12-31T20:00:00+05:00"}), archived
+        )
+
+
+def test_hybrid_search_with_fusion():
+
+    question = "What are key features of a snowflake Argentina"
+    for fusion in (
+        {"method": "linear"},
+        {"vector_depth": 50, "keyword_depth": 20, "exact_depth": 20},
+        {"keyword_weight": 0, "exact_weight": 0},
+    ):
+        rows = db.hybrid_search(question, limit=5, fusion=fusion)
+        assert len(rows) == 5
+        assert len(rows[0]) == 6
+
+
+def test_snapshot_round_trip(tmp_path):
+    manifest = db.export_snapshot(str(tmp_path))
+    assert manifest["dimensions"] == db.EMBEDDING_DIMENSIONS
+    assert manifest["num_documents"] > 0
+
+    # Everything is already in the database
+    result = db.import_snapshot(str(tmp_path), rebuild_index=False)
+    assert result == {"posts": 0, "documents": 0}
+
+
+def test_get_embedding_version():
+    version, model, dimensions = db.get_embedding_version(refresh=True)
+    assert (model, dimensions) == (rag.EMBEDDING_MODEL_NAME, db.EMBEDDING_DIMENSIONS)
+
+    vector = rag.get_llm_client().embed_query("best orchestrator", dimensions, model)
+    assert len(db.vector_search_by_embedding(vector, 5, embedding_version=version)) == 5
+    # A query embedded with a version that is no longer active
+    with pytest.raises(db.EmbeddingVersionChanged):
+        db.vector_search_by_embedding(vector, 5, embedding_version=-1)
+
+
+def test_check_embedding_version_releases_connection():
+    class Connection:
+        def __init__(self):
+            self.calls = []
+
+        def rollback(self):
+            self.calls.append("rollback")
+
+        def close(self):
+            self.calls.append("close")
+
+    class Cursor:
+        def __init__(self):
+            self.connection = Connection()
+
+        def execute(self, query):
+            pass
+
+        def fetchone(self):
+            return (2,)
+
+    cursor = Cursor()
+    db.check_embedding_version(cursor, 2)
+    assert cursor.connection.calls == []
+    # The lock is released and the connection not left idle in transaction
+    with pytest.raises(db.EmbeddingVersionChanged):
+        db.check_embedding_version(cursor, 1)
+    assert cursor.connection.calls == ["rollback", "close"]
+
+
+def test_vector_search_ef_search():
+    query = "what are key features of a good data engineering team?"
+    rows = db.vector_search(query, limit=5, ef_search=100)
+    assert len(rows) == 5
+    assert [r[1] for r in rows] == sorted(r[1] for r in rows)
+
+
+def test_batch_hybrid_search():
+    questions = [
+        "What are key features of a snowflake Argentina",
+        "What are key features of a good data engineering team?",
+    ]
+    timings = {}
+    results = db.batch_hybrid_search(questions, limit=5, timings=timings)
+    assert len(results) == 2
+    assert set(timings) == {"embed_s", "search_s", "rank_s"}
+
+    for question, rows in zip(questions, results):
+        assert [r[0] for r in rows] == [
+            r[0] for r in db.hybrid_search(question, limit=5)
+        ]
+
+
+def test_vector_index_rebuilt_after_cutover(monkeypatch):
+    active = [(1, "text-embedding-3-small", 2)]
+    embeddings = {1: [[1.0, 0.0]], 2: [[0.0, 1.0]]}
+
+    def fetch_document_embeddings(updated_since=None, ids=None, embedding_version=None):
+        if embedding_version != active[0][0]:
+            raise db.EmbeddingVersionChanged()
+        return ["d1"], np.array(embeddings[embedding_version]), None
+
+    monkeypatch.setattr(db, "get_embedding_version", lambda refresh=False: active[0])
+    monkeypatch.setattr(db, "fetch_document_embeddings", fetch_document_embeddings)
+    monkeypatch.setattr(db, "refresh_local_index", lambda index, fetch: None)
+    monkeypatch.setattr(db, "VECTOR_INDEX_DIR", None)
+    monkeypatch.setattr(db, "SNAPSHOT_DIR", None)
+    monkeypatch.setattr(db, "_vector_index", None)
+
+    assert db.get_vector_index(1).metadata["embedding_version"] == 1
+
+    # A question embedded with the new version rebuilds the index, never
+    # refreshes the old one with the new embeddings
+    active[0] = (2, "text-embedding-3-large", 2)
+    index = db.get_vector_index(2)
+    assert index.metadata["embedding_version"] == 2
+    assert index.search([0.0, 1.0], limit=1)[0][2] > 0.99
+    with pytest.raises(db.EmbeddingVersionChanged):
+        db.get_vector_index(1)
@@ -0,0 +1,81 @@
+import pytest
+
+from src import evaluation
+
+
+def test_precision_at_k():
+    retrieved = ["a", "b", "c", "d"]
+    assert evaluation.precision_at_k(retrieved, {"a", "c"}, 2) == 0.5
+    assert evaluation.precision_at_k(retrieved, {"a", "c"}, 4) == 0.5
+    assert evaluation.precision_at_k(retrieved, {"z"}, 4) == 0.0
+
+
+def test_recall_at_k():
+    retrieved = ["a", "b", "c", "d"]
+    assert evaluation.recall_at_k(retrieved, {"a", "c"}, 2) == 0.5
+    assert evaluation.recall_at_k(retrieved, {"a", "c"}, 3) == 1.0
+    assert evaluation.recall_at_k(retrieved, set(), 3) == 0.0
+
+
+def test_reciprocal_rank():
+    assert evaluation.reciprocal_rank(["a", "b", "c"], {"c"}) == pytest.approx(1 / 3)
+    assert evaluation.reciprocal_rank(["a", "b", "c"], {"z"}) == 0.0
+
+
+def test_unique_in_order():
+    assert evaluation.unique_in_order(["p1", "p2", "p1", "p3"]) == ["p1", "p2", "p3"]
+
+
+def test_summarize():
+    report = evaluation.summarize([["a", "b"], ["c", "d"]], [{"a"}, {"d"}], k=2)
+    assert report["queries"] == 2
+    assert report["precision@2"] == 0.5
+    assert report["recall@2"] == 1.0
+    assert report["mrr"] == 0.75
+
+
+def test_percentile():
+    values = [1.0, 2.0, 3.0, 4.0, 5.0]
+    assert evaluation.percentile(values, 0) == 1.0
+    assert evaluation.percentile(values, 50) == 3.0
+    assert evaluation.percentile(values, 100) == 5.0
+    assert evaluation.percentile([10.0, 20.0], 50) == 15.0
+
+
+def test_latency_summary():
+    summary = evaluation.latency_summary([5.0, 1.0, 3.0])
+    assert summary["n"] == 3
+    assert summary["p50_ms"] == 3.0
+    assert summary["max_ms"] == 5.0
+    assert evaluation.latency_summary([]) == {"n": 0}
+
+
+def test_hashed_embedding():
+    a = evaluation.hashed_embedding("How do I build data pipelines?")
+    b = evaluation.hashed_embedding("How do I build data pipelines?")
+    c = evaluation.hashed_embedding("building a data pipeline")
+    d = evaluation.hashed_embedding("salary negotiation tips")
+
+    assert a.shape == (256,)
+    assert (a == b).all()
+    assert a @ a == pytest.approx(1.0)
+    assert a @ c > a @ d
+    assert not evaluation.hashed_embedding("the and of").any()
+
+
+def test_find_regressions():
+    baseline = {
+        "quality": {"recall@5": 0.8, "mrr": 0.7},
+        "latency": {"hybrid": {"n": 10, "p50_ms": 10.0, "p95_ms": 20.0}},
+    }
+    report = {
+        "quality": {"recall@5": 0.8, "mrr": 0.75},
+        "latency": {"hybrid": {"n": 20, "p50_ms": 11.0, "p95_ms": 20.0}},
+    }
+    assert evaluation.find_regressions(report, baseline) == []
+
+    report["quality"]["recall@5"] = 0.7
+    report["latency"]["hybrid"]["p95_ms"] = 30.0
+    regressions = evaluation.find_regressions(report, baseline)
+    assert len(regressions) == 2
+    assert evaluation.find_regressions(report, baseline, 0.15, 1.0) == []
@@ -0,0 +1,54 @@
+import pytest
+
+from src import fusion
+
+
+def test_reciprocal_rank_fusion():
+    vector = [("a", 1), ("b", 2), ("c", 3)]
+    keyword = [("c", 1), ("a", 2)]
+
+    fused = fusion.reciprocal_rank_fusion([vector, keyword], [60, 60])
+    assert [id for id, _ in fused] == ["a", "c", "b"]
+    assert fused[0][1] == pytest.approx(1 / 61 + 1 / 62)
+    assert fused[2][1] == pytest.approx(1 / 62)
+
+
+def test_reciprocal_rank_fusion_k():
+    vector = [("a", 1)]
+    keyword = [("b", 1)]
+    fused = fusion.reciprocal_rank_fusion([vector, keyword], [60, 180])
+    assert [id for id, _ in fused] == ["a", "b"]
+
+
+def test_reciprocal_rank_fusion_empty_legs():
+    assert fusion.reciprocal_rank_fusion([[], []], [60, 60]) == []
+
+
+def test_weighted_reciprocal_rank_fusion():
+    vector = [("a", 1), ("b", 2)]
+    keyword = [("b", 1), ("a", 2)]
+
+    fused = fusion.reciprocal_rank_fusion([vector, keyword], [60, 60], [1.0, 2.0])
+    assert [id for id, _ in fused] == ["b", "a"]
+    assert fused[0][1] == pytest.approx(1 / 62 + 2 / 61)
+
+
+def test_linear_fusion():
+    vector = [("a", 1, 0.9), ("b", 2, 0.8), ("c", 3, 0.5)]
+    keyword = [("c", 1, 12.0), ("b", 2, 2.0)]
+
+    fused = fusion.linear_fusion([vector, keyword], [1.0, 1.0])
+    # a: 1 + 0, b: 0.75 + 0, c: 0 + 1
+    assert fused == [
+        ("a", pytest.approx(1.0)),
+        ("c", pytest.approx(1.0)),
+        ("b", pytest.approx(0.75)),
+    ]
+
+    fused = fusion.linear_fusion([vector, keyword], [1.0, 0.0])
+    assert [id for id, _ in fused] == ["a", "b", "c"]
+
+
+def test_linear_fusion_single_result_leg():
+    fused = fusion.linear_fusion([[("a", 1, 0.3)], []], [0.5, 1.0])
+    assert fused == [("a", pytest.approx(0.5))]
@@ -0,0 +1,92 @@
+from src.keyword_index import BM25Index, stem, tokenize
+
+
+def test_tokenize():
+    assert tokenize("What are the key features of Snowflake?") == [
+        "key",
+        "feature",
+        "snowflake",
+    ]
+    assert tokenize("Data pipelines, pipeline!") == ["data", "pipeline", "pipeline"]
+
+
+def test_stem():
+    assert stem("queries") == "query"
+    assert stem("classes") == "class"
+    assert stem("running") == "run"
+    assert stem("called") == "call"
+    assert stem("glass") == "glass"
+    assert stem("sql") == "sql"
+
+
+def get_index():
+    index = BM25Index()
+    index.add(
+        ["d1", "d2", "d3", "d4"],
+        [
+            "Snowflake is a cloud data warehouse",
+            "Argentina salaries for data engineers",
+            "Snowflake pricing and Snowflake features",
+            "Airflow orchestrates data pipelines",
+        ],
+    )
+    return index
+
+
+def test_search_any_and_all_terms():
+    index = get_index()
+    any_terms, all_terms = index.search("snowflake features", limit=5)
+
+    assert [id for id, _, _ in any_terms] == ["d3", "d1"]
+    assert [rank for _, rank, _ in any_terms] == [1, 2]
+    assert any_terms[0][2] > any_terms[1][2] > 0
+    assert [(id, rank) for id, rank, _ in all_terms] == [("d3", 1)]
+
+
+def test_search_no_match_all():
+    index = get_index()
+    any_terms, all_terms = index.search("argentina snowflake", limit=5)
+    assert {id for id, _, _ in any_terms} == {"d1", "d2", "d3"}
+    assert all_terms == []
+
+    assert index.search("the of and", limit=5) == ([], [])
+    assert index.search("kubernetes", limit=5) == ([], [])
+
+
+def test_search_limit():
+    index = get_index()
+    any_terms, _ = index.search("data", limit=2)
+    assert len(any_terms) == 2
+
+
+def test_add_replaces_and_remove():
+    index = get_index()
+    index.add(["d2"], ["Kafka streaming"])
+    assert len(index) == 4
+    assert index.search("argentina", limit=5) == ([], [])
+    assert [row[:2] for row in index.search("kafka", limit=5)[0]] == [("d2", 1)]
+
+    index.remove(["d3", "unknown"])
+    assert len(index) == 3
+    assert "d3" not in index
+    assert [id for id, _, _ in index.search("snowflake", limit=5)[0]] == ["d1"]
+
+
+def test_document_frequencies_and_compaction():
+    index = get_index()
+    fresh = BM25Index()
+    fresh.add(
+        ["d1", "d4"],
+        ["Snowflake is a cloud data warehouse", "Airflow orchestrates data pipelines"],
+    )
+
+    # Removing half of the documents compacts the index, and the scores are
+    # those of an index built from the remaining documents only
+    index.remove(["d2", "d3"])
+    assert len(index._doc_ids) == 2
+    assert index.search("snowflake data", limit=5) == fresh.search(
+        "snowflake data", limit=5
+    )
+
+    index.add(["d5"], ["Snowflake streams"])
+    assert [id for id, _, _ in index.search("snowflake", limit=5)[0]] == ["d5", "d1"]
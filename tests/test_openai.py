@@ -1,3 +1,5 @@
+from types import SimpleNamespace
+
 import pytest
 
 from src import db, rag
@@ -26,6 +28,30 @@ def test_check_token_limit():
         rag.check_token_limit(test_string)
 
 
+def test_get_llm_client(monkeypatch):
+    client = rag.get_llm_client()
+    assert rag.get_llm_client() is client
+    # A forked process gets its own client
+    monkeypatch.setattr(rag.os, "getpid", lambda: -1)
+    assert rag.get_llm_client() is not client
+
+
+def test_embed_query_cache_per_model(monkeypatch):
+    client = rag.ThrottledOpenAI(client=object())
+    calls = []
+
+    def get_embedding(question, dimensions, model):
+        calls.append(model)
+        return [float(len(calls))] * dimensions
+
+    monkeypatch.setattr(client, "get_embedding", get_embedding)
+    a = client.embed_query("Best orchestrator?", 4, "model-a")
+    assert client.embed_query("Best orchestrator?", 4, "model-a") == a
+    # Questions embedded before an embedding model migration are not reused
+    assert client.embed_query("Best orchestrator?", 4, "model-b") != a
+    assert calls == ["model-a", "model-b"]
+
+
 def test_get_embedding():
 
     test_string = "Hello, world!"
@@ -43,6 +69,110 @@ def test_get_embedding_2():
     assert isinstance(embeddings, list)
     assert len(embeddings) == 1536
 
+def test_get_embedding_dimensions():
+
+    test_string = "What are key features of a good data engineering team?"
+    client = rag.ThrottledOpenAI()
+    embeddings = client.get_embedding(test_string, dimensions=256)
+    assert isinstance(embeddings, list)
+    assert len(embeddings) == 256
+
+
+def test_embedding_model_params():
+    assert rag.embedding_model_params("text-embedding-ada-002", 1536) == {
+        "model": "text-embedding-ada-002"
+    }
+    assert rag.embedding_model_params("text-embedding-3-large", 1024) == {
+        "model": "text-embedding-3-large",
+        "dimensions": 1024,
+    }
+
+
+def test_get_embeddings():
+
+    test_strings = ["Hello, world!", "What are key features of a good data engineering team?"]
+    client = rag.ThrottledOpenAI()
+    embeddings = client.get_embeddings(test_strings, batch_size=1)
+    assert len(embeddings) == 2
+    assert embeddings[1] == client.get_embedding(test_strings[1])
+
+
+def test_build_messages_prefix_stability():
+    sources = [
+        ("1abcdef_1", "1abcdef", "Airflow or Dagster?", 0.9, "Airflow or Dagster?\nUse Dagster."),
+        ("2bcdefg_1", "2bcdefg", "DE salaries", 0.8, "DE salaries\nIt depends."),
+    ]
+    retrieved = {
+        "Best orchestrator?": sources,
+        # Same posts, ranked differently
+        "Which orchestrator should I use?": sources[::-1],
+    }
+    client = rag.ThrottledOpenAI(
+        client=object(),
+        retriever=lambda question, limit, filters, fusion: retrieved[question],
+        token_counts=lambda ids: {id: 10 for id in ids},
+    )
+
+    a = client.build_messages("Best orchestrator?")
+    b = client.build_messages("Which orchestrator should I use?")
+
+    # Static instructions first, then the same context, the question last
+    assert a[0] == b[0]
+    assert a[1]["content"].endswith("Question: Best orchestrator?")
+    prefix = a[1]["content"][: -len("Best orchestrator?")]
+    assert b[1]["content"] == prefix + "Which orchestrator should I use?"
+    assert "Use Dagster." in prefix and "It depends." in prefix
+
+
+def test_build_messages_sources():
+    rows = [
+        ("2bcdefg_1", "2bcdefg", "DE salaries", 0.9, "DE salaries\nIt depends.", "/r/de/2bcdefg/"),
+        ("1abcdef_1", "1abcdef", "Airflow or Dagster?", 0.8, "Airflow or Dagster?\nDagster.", "/r/de/1abcdef/"),
+    ]
+    client = rag.ThrottledOpenAI(
+        client=object(),
+        retriever=lambda question, limit, filters, fusion: rows,
+        token_counts=lambda ids: {id: 10 for id in ids},
+    )
+
+    sources = []
+    client.build_messages("DE salaries?", sources=sources)
+
+    # In ranking order, while the prompt lists the posts by id
+    assert sources == [
+        {"post_id": "2bcdefg", "title": "DE salaries", "permalink": "/r/de/2bcdefg/"},
+        {"post_id": "1abcdef", "title": "Airflow or Dagster?", "permalink": "/r/de/1abcdef/"},
+    ]
+
+
+def test_stream_answer_usage_per_request():
+    def create(messages, **kwargs):
+        words = messages[-1]["content"].split()
+        for word in words:
+            yield SimpleNamespace(
+                choices=[SimpleNamespace(delta=SimpleNamespace(content=word))],
+                usage=None,
+            )
+        yield SimpleNamespace(
+            choices=[],
+            usage=SimpleNamespace(
+                prompt_tokens=1, completion_tokens=len(words), prompt_tokens_details=None
+            ),
+        )
+
+    chat = SimpleNamespace(completions=SimpleNamespace(create=create))
+    client = rag.ThrottledOpenAI(client=SimpleNamespace(chat=chat))
+    usage_a, usage_b = {}, {}
+    stream_a = client.stream_answer([{"content": "a b c"}], usage_a)
+    stream_b = client.stream_answer([{"content": "d"}], usage_b)
+    # Concurrent requests sharing the process-wide client
+    next(stream_a)
+    assert list(stream_b) == ["d"]
+    assert list(stream_a) == ["b", "c"]
+    assert usage_a["completion_tokens"] == 3
+    assert usage_b["completion_tokens"] == 1
+
+
 def test_rag_query():
     question = "Currently, what is the best API for web scraping large swaths of data?"
     client = rag.ThrottledOpenAI()
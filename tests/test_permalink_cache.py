@@ -0,0 +1,21 @@
+from src.permalink_cache import PermalinkCache
+
+
+def test_get_many():
+    cache = PermalinkCache()
+    cache.update({"a": "/r/de/a/", "b": "/r/de/b/"})
+
+    found, missing = cache.get_many(["b", "c", "a", "c"])
+    assert found == {"b": "/r/de/b/", "a": "/r/de/a/"}
+    assert missing == ["c"]
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_evicts_least_recently_used():
+    cache = PermalinkCache(max_entries=2)
+    cache.update({"a": "/r/de/a/", "b": "/r/de/b/"})
+    cache.get_many(["a"])
+    cache.update({"c": "/r/de/c/"})
+
+    assert len(cache) == 2
+    assert cache.get_many(["a", "b", "c"])[1] == ["b"]
@@ -0,0 +1,47 @@
+import json
+import os
+
+from src import prompt_capture
+
+
+def test_capture(tmp_path):
+    capture = prompt_capture.PromptCapture(str(tmp_path / "prompts" / "prompts.log"))
+    for i in range(3):
+        assert capture.capture({"question": f"q{i}"})
+    capture.flush()
+
+    # One file per process
+    path = tmp_path / "prompts" / f"prompts.{os.getpid()}.log"
+    assert capture.file_path == str(path)
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [r["question"] for r in records] == ["q0", "q1", "q2"]
+
+
+def test_capture_sampling(tmp_path):
+    capture = prompt_capture.PromptCapture(str(tmp_path / "p.log"), sample_rate=0.0)
+    assert not capture.capture({"question": "q"})
+
+
+def test_capture_rotation(tmp_path):
+    capture = prompt_capture.PromptCapture(
+        str(tmp_path / "p.log"), max_bytes=200, backup_count=2
+    )
+    for i in range(20):
+        capture.capture({"question": "x" * 50})
+        capture.flush()
+    assert os.path.exists(capture.file_path)
+    assert os.path.exists(f"{capture.file_path}.1")
+    assert not os.path.exists(f"{capture.file_path}.3")
+
+
+def test_capture_drops_when_queue_is_full(tmp_path):
+    capture = prompt_capture.PromptCapture(str(tmp_path / "p.log"), queue_size=1)
+    # Writer not started: the queue fills up
+    capture._ensure_writer = lambda: None
+    assert capture.capture({"question": "q0"})
+    assert not capture.capture({"question": "q1"})
+
+
+def test_capture_disabled_by_default():
+    if not prompt_capture.PROMPT_CAPTURE_PATH:
+        assert prompt_capture.get_prompt_capture() is None
@@ -5,6 +5,11 @@ from src import reddit
 
 OUTPUT_DIR =  os.path.join(os.path.dirname(__file__), "output")
 
+def test_get_session():
+    session = reddit.get_session()
+    assert reddit.get_session() is session
+
+
 def test_get_auth_token():
 
     token = reddit.get_auth_token()
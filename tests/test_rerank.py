@@ -0,0 +1,62 @@
+from src import rag, rerank
+from src.rerank import Reranker, lexical_scorer
+
+ROWS = [
+    ("1abcdef_1", "1abcdef", "Airflow or Dagster?", 0.9, "Airflow or Dagster?\nUse cron.", "/r/de/1abcdef/"),
+    ("2bcdefg_1", "2bcdefg", "DE salaries", 0.8, "DE salaries\nIt depends.", "/r/de/2bcdefg/"),
+    ("3cdefgh_1", "3cdefgh", "Dagster review", 0.7, "Dagster review\nDagster assets are great.", "/r/de/3cdefgh/"),
+]
+
+
+class CountingScorer:
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, question, contents):
+        self.batches.append(len(contents))
+        return [content.count("Dagster") for content in contents]
+
+
+def test_rerank_keeps_top_k():
+    reranker = Reranker(CountingScorer())
+    rows = reranker.rerank("Is Dagster good?", ROWS, top_k=2)
+
+    assert [row[0] for row in rows] == ["3cdefgh_1", "1abcdef_1"]
+    # Re-ranker score in place of the fused score, other columns unchanged
+    assert rows[0] == ROWS[2][:3] + (2.0,) + ROWS[2][4:]
+
+
+def test_rerank_batches_and_caches_scores():
+    scorer = CountingScorer()
+    reranker = Reranker(scorer, batch_size=2)
+
+    first = reranker.rerank("Is Dagster good?", ROWS, top_k=3)
+    assert sorted(scorer.batches) == [1, 2]
+
+    # Only the new chunk is scored
+    new_row = ("4defghi_1", "4defghi", "Dagster", 0.6, "Dagster", "/r/de/4defghi/")
+    second = reranker.rerank("Is Dagster good?", ROWS + [new_row], top_k=3)
+    assert sorted(scorer.batches) == [1, 1, 2]
+    assert (reranker.hits, reranker.misses) == (3, 4)
+    assert second[0] == first[0]
+
+
+def test_lexical_scorer():
+    scores = lexical_scorer(
+        "Dagster assets", ["Dagster assets are great.", "Use cron.", "Dagster"]
+    )
+    assert scores == [1.0, 0.0, 0.5]
+
+
+def test_build_messages_reranked(monkeypatch):
+    monkeypatch.setattr(rerank, "RERANK_TOP_K", 2)
+    client = rag.ThrottledOpenAI(
+        client=object(),
+        retriever=lambda question, limit, filters, fusion: ROWS,
+        token_counts=lambda ids: {id: 10 for id in ids},
+        reranker=Reranker(CountingScorer()),
+    )
+
+    sources = []
+    client.build_messages("Is Dagster good?", sources=sources)
+    assert [s["post_id"] for s in sources] == ["3cdefgh", "1abcdef"]
@@ -0,0 +1,68 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from src import snapshot
+
+POSTS = [
+    {"id": "1abcdef", "title": "Airflow or Dagster?", "created_at": datetime(2024, 1, 1), "last_updated_at": datetime(2025, 1, 1)},
+    {"id": "2bcdefg", "title": "DE salaries", "created_at": datetime(2024, 2, 1), "last_updated_at": datetime(2025, 2, 1)},
+]
+DOCUMENTS = [
+    ({"id": "1abcdef_1", "post_id": "1abcdef", "chunk_id": 1, "content": "Use Dagster assets."}, [3.0, 4.0]),
+    ({"id": "2bcdefg_1", "post_id": "2bcdefg", "chunk_id": 1, "content": "Salaries depend."}, None),
+    ({"id": "2bcdefg_2", "post_id": "2bcdefg", "chunk_id": 2, "content": "Salaries grow."}, [0.0, 2.0]),
+]
+
+
+def write(directory):
+    with snapshot.SnapshotWriter(directory, len(DOCUMENTS), dimensions=2) as writer:
+        for post in POSTS:
+            writer.add_post(post)
+        for document, embedding in DOCUMENTS:
+            writer.add_document(document, embedding)
+
+
+def test_round_trip(tmp_path):
+    write(tmp_path)
+
+    manifest = snapshot.read_manifest(tmp_path)
+    assert (manifest["num_posts"], manifest["num_documents"]) == (2, 3)
+    assert [p["created_at"] for p in snapshot.iter_posts(tmp_path)] == [
+        datetime(2024, 1, 1),
+        datetime(2024, 2, 1),
+    ]
+    documents = list(snapshot.iter_documents(tmp_path))
+    assert [d["has_embedding"] for d in documents] == [True, False, True]
+
+    embeddings = snapshot.load_embeddings(tmp_path)
+    assert isinstance(embeddings, np.memmap)
+    # Stored normalized, zeros for the missing embedding
+    np.testing.assert_allclose(embeddings, [[0.6, 0.8], [0.0, 0.0], [0.0, 1.0]])
+
+
+def test_load_indexes(tmp_path):
+    write(tmp_path)
+
+    vector_index = snapshot.load_vector_index(tmp_path)
+    assert vector_index.ids == ["1abcdef_1", "2bcdefg_2"]
+    assert vector_index.search([0.0, 1.0], limit=1)[0][0] == "2bcdefg_2"
+    assert vector_index.metadata["watermark"] == "2025-02-01T00:00:00"
+    assert vector_index.metadata["dimensions"] == 2
+    # A snapshot of embeddings of another size is never served
+    with pytest.raises(ValueError):
+        snapshot.load_vector_index(tmp_path, dimensions=1536)
+
+    keyword_index = snapshot.load_keyword_index(tmp_path)
+    any_terms, _ = keyword_index.search("salaries", limit=5)
+    assert sorted(row[0] for row in any_terms) == ["2bcdefg_1", "2bcdefg_2"]
+
+
+def test_incomplete_snapshot(tmp_path):
+    with pytest.raises(ZeroDivisionError):
+        with snapshot.SnapshotWriter(tmp_path, len(DOCUMENTS), dimensions=2) as writer:
+            writer.add_post(POSTS[0])
+            1 / 0
+    with pytest.raises(ValueError):
+        snapshot.read_manifest(tmp_path)
@@ -0,0 +1,68 @@
+from src import telemetry
+
+
+def test_span_records_on_active_trace():
+    trace = telemetry.Trace("test")
+    with telemetry.activate(trace):
+        with telemetry.span("stage_a") as attributes:
+            attributes["tokens"] = 3
+        telemetry.record("stage_b", 12.5)
+
+    # Spans outside of an active trace are only counted in the metrics
+    with telemetry.span("stage_a"):
+        pass
+
+    assert [s.name for s in trace.spans] == ["stage_a", "stage_b"]
+    assert trace.spans[0].attributes == {"tokens": 3}
+    assert trace.spans[0].duration_ms >= 0
+    assert trace.server_timing().endswith("stage_b;dur=12.5")
+
+
+def test_trace_durations():
+    trace = telemetry.Trace("test")
+    with telemetry.activate(trace):
+        telemetry.record("stage_a", 2.0)
+        telemetry.record("stage_b", 12.5)
+        telemetry.record("stage_a", 3.0)
+
+    assert trace.durations() == {"stage_a": 5.0, "stage_b": 12.5}
+
+
+def test_metrics_render():
+    metrics = telemetry.Metrics(buckets_ms=(10, 100))
+    metrics.observe("embed_query", 5)
+    metrics.observe("embed_query", 50)
+    metrics.observe("embed_query", 500)
+
+    text = metrics.render()
+    assert 'rag_stage_duration_ms_bucket{stage="embed_query",le="10"} 1' in text
+    assert 'rag_stage_duration_ms_bucket{stage="embed_query",le="100"} 2' in text
+    assert 'rag_stage_duration_ms_bucket{stage="embed_query",le="+Inf"} 3' in text
+    assert 'rag_stage_duration_ms_sum{stage="embed_query"} 555' in text
+    assert metrics.snapshot() == {"embed_query": {"count": 3, "sum_ms": 555}}
+
+
+def test_noop_exporter():
+    trace = telemetry.Trace("test")
+    telemetry.export(trace)
+
+
+def test_trace_summary_with_worker_threads():
+    from concurrent.futures import ThreadPoolExecutor
+
+    def work(n):
+        with telemetry.span("work"):
+            telemetry.increment("items", n)
+
+    run = telemetry.Trace("ingest")
+    with telemetry.activate(run):
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [telemetry.submit(executor, work, n) for n in range(1, 5)]
+            for f in futures:
+                f.result()
+
+    summary = run.summary()
+    assert summary["counters"] == {"items": 10}
+    assert summary["stages"]["work"]["n"] == 4
+    assert summary["stages"]["work"]["total_ms"] >= 0
+    assert 'rag_events_total{name="items"}' in telemetry.metrics.render()
@@ -0,0 +1,33 @@
+from src.keyword_index import STOPWORDS
+from src.text_query import build_tsqueries, parse_query
+
+
+def test_plain_question():
+    any_query, all_query = build_tsqueries(
+        "What are the key features of Snowflake?", STOPWORDS
+    )
+    assert any_query == "'key' | 'features' | 'snowflake'"
+    assert all_query == "'key' & 'features' & 'snowflake'"
+
+
+def test_operators():
+    included, excluded = parse_query(
+        '"state of the art" orchestrat* -azure -"data lake"', STOPWORDS
+    )
+    # Stopwords keep their place in phrases
+    assert included == ["'state' <3> 'art'", "'orchestrat':*"]
+    assert excluded == ["'azure'", "'data' <-> 'lake'"]
+
+    any_query, all_query = build_tsqueries('airflow dagster -"data lake"')
+    assert any_query == "('airflow' | 'dagster') & !('data' <-> 'lake')"
+    assert all_query == "'airflow' & 'dagster' & !('data' <-> 'lake')"
+
+
+def test_no_included_words():
+    assert build_tsqueries("what is it?", STOPWORDS) == ("", "")
+    assert build_tsqueries("-azure") == ("", "")
+    # Quotes and punctuation never reach the tsquery unescaped
+    assert build_tsqueries("it's 'quoted' \\ text") == (
+        "'it' | 's' | 'quoted' | 'text'",
+        "'it' & 's' & 'quoted' & 'text'",
+    )
@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+
+from src.vector_index import NumpyVectorIndex, normalize
+
+
+@pytest.fixture
+def embeddings():
+    rng = np.random.default_rng(42)
+    return rng.normal(size=(200, 64)).astype(np.float32)
+
+
+def brute_force(embeddings, query, limit):
+    scores = normalize(embeddings) @ normalize(query)
+    return list(np.argsort(-scores)[:limit])
+
+
+def test_normalize():
+    matrix = normalize(np.array([[3.0, 4.0], [0.0, 0.0]]))
+    assert np.allclose(matrix[0], [0.6, 0.8])
+    assert np.allclose(matrix[1], [0.0, 0.0])
+
+
+def test_search_matches_brute_force(embeddings):
+    ids = [f"doc_{i}" for i in range(len(embeddings))]
+    index = NumpyVectorIndex()
+    index.add(ids, embeddings)
+
+    query = embeddings[7] + 0.1
+    rows = index.search(query, limit=10)
+    assert [r[1] for r in rows] == list(range(1, 11))
+    assert [r[2] for r in rows] == sorted((r[2] for r in rows), reverse=True)
+    assert [r[0] for r in rows] == [ids[i] for i in brute_force(embeddings, query, 10)]
+
+
+def test_search_batch(embeddings):
+    ids = [f"doc_{i}" for i in range(len(embeddings))]
+    index = NumpyVectorIndex()
+    index.add(ids, embeddings)
+
+    results = index.search_batch(embeddings[:3], limit=5)
+    assert len(results) == 3
+    for i, rows in enumerate(results):
+        assert rows[0][0] == ids[i]
+
+
+def test_search_float16(embeddings):
+    ids = [f"doc_{i}" for i in range(len(embeddings))]
+    index = NumpyVectorIndex(dtype="float16")
+    index.add(ids, embeddings)
+    assert index.search(embeddings[3], limit=1)[0][0] == "doc_3"
+
+
+def test_search_limit_larger_than_index(embeddings):
+    index = NumpyVectorIndex()
+    assert index.search(embeddings[0], limit=5) == []
+
+    index.add(["a", "b"], embeddings[:2])
+    assert len(index.search(embeddings[0], limit=5)) == 2
+
+
+def test_add_replaces_and_remove(embeddings):
+    index = NumpyVectorIndex()
+    index.add(["a", "b", "c"], embeddings[:3])
+    index.add(["b"], embeddings[10:11])
+    assert len(index) == 3
+    assert index.search(embeddings[10], limit=1)[0][0] == "b"
+
+    index.remove(["a", "unknown"])
+    assert len(index) == 2
+    assert "a" not in index
+    assert index.search(embeddings[2], limit=1)[0][0] == "c"
+
+
+def test_save_and_load(embeddings, tmp_path):
+    ids = [f"doc_{i}" for i in range(len(embeddings))]
+    index = NumpyVectorIndex()
+    index.add(ids, embeddings)
+    index.metadata["watermark"] = "2025-01-01T00:00:00"
+    index.save(str(tmp_path))
+
+    loaded = NumpyVectorIndex.load(str(tmp_path))
+    assert isinstance(loaded._state[2], np.memmap)
+    assert loaded.ids == ids
+    assert loaded.metadata == index.metadata
+    assert loaded.search(embeddings[5], limit=3) == index.search(embeddings[5], limit=3)
+
+    # Updates on a memory-mapped index do not write to the file
+    loaded.add(["new"], embeddings[:1])
+    assert len(NumpyVectorIndex.load(str(tmp_path))) == len(ids)
+
+
+def test_from_normalized(embeddings):
+    ids = [f"doc_{i}" for i in range(len(embeddings))]
+    matrix = normalize(embeddings)
+    index = NumpyVectorIndex.from_normalized(ids, matrix)
+    assert index._state[2] is matrix
+    assert index.search(embeddings[7], limit=1)[0][0] == "doc_7"
+
+    with pytest.raises(ValueError):
+        NumpyVectorIndex.from_normalized(ids[:-1], matrix)